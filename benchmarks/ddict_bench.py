@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+"""
+Benchmarks for datautils.ddict
+
+python benchmarks/ddict_bench.py [name...]
+
+runs the named benchmarks (or all of them)
+"""
+
+import json
+import random
+import sys
+import time
+
+try:
+    import bson
+except ImportError:
+    bson = None
+
+from datautils.ddict.ddict import DDict, FlatDDict, FrozenDDict
+from datautils.ddict.lazy import BSONDDict, JSONDDict
+
+
+def make_doc(depth=3, width=5):
+    if depth == 0:
+        return 1.
+    return dict([('k%i' % i, make_doc(depth - 1, width))
+                 for i in xrange(width)])
+
+
+def flat(n=100000, depth=3, width=5):
+    """
+    Compare the time to make each DDict type, n dotted gets of the
+    deepest keys and the memory used by the flat index (or cache)
+    """
+    doc = make_doc(depth, width)
+    keys = ['.'.join(['k%i' % i] * depth) for i in xrange(width)]
+    for cls in (DDict, FlatDDict, FrozenDDict):
+        t0 = time.time()
+        d = cls(doc)
+        tm = time.time() - t0
+        t0 = time.time()
+        for _ in xrange(n // len(keys)):
+            for k in keys:
+                d[k]
+        tg = time.time() - t0
+        extra = sys.getsizeof(getattr(d, '_flat', getattr(d, '_cache', {})))
+        print "%s: make %.1fus, %i gets %.3fs, index %i bytes" % (
+            cls.__name__, tm * 1E6, n, tg, extra)
+
+
+def make_wide_doc(n=200, array_size=5, seed=None):
+    """
+    Make a wide document with n keys (some with sub-documents and some
+    with arrays of length array_size)
+    """
+    r = random.Random(seed)
+    d = {}
+    for i in xrange(n):
+        if i % 4 == 0:
+            d['k%i' % i] = {'a': r.random(), 'b': {'c': 's%i' % i}}
+        elif i % 4 == 1:
+            d['k%i' % i] = [r.randint(0, 10) for _ in xrange(array_size)]
+        else:
+            d['k%i' % i] = r.random()
+    return d
+
+
+def lazy(n=1000, width=200, array_size=5,
+         keys=('k1', 'k100.b.c', 'k150')):
+    """
+    Compare decoding n documents (each with width keys) and reading keys
+    to lazy views
+    """
+    doc = make_wide_doc(width, array_size, seed=0)
+    funcs = [('json', json.dumps, lambda s: DDict(json.loads(s)),
+              JSONDDict)]
+    if bson is not None:
+        funcs.append(('bson', bson.BSON.encode,
+                      lambda s: DDict(bson.BSON(s).decode()), BSONDDict))
+    for (name, encode, decode, view) in funcs:
+        s = encode(doc)
+        for (label, f) in (('decode', decode), ('lazy', view)):
+            t0 = time.time()
+            for _ in xrange(n):
+                d = f(s)
+                [d[k] for k in keys]
+            print "%s %s: %.1fus per document" % (
+                name, label, (time.time() - t0) * 1E6 / n)
+
+
+benchmarks = {
+    'flat': flat,
+    'lazy': lazy,
+}
+
+
+if __name__ == '__main__':
+    for name in (sys.argv[1:] or sorted(benchmarks)):
+        print "---- %s ----" % name
+        benchmarks[name]()
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+"""
+Benchmarks for datautils.grouping
+
+python benchmarks/grouping_bench.py [name...]
+
+runs the named benchmarks (or all of them)
+"""
+
+import random
+import sys
+import time
+
+import numpy
+
+from datautils.grouping import ops
+from datautils.grouping.aggregation import aggregate
+from datautils.grouping.arrays import group_inds
+from datautils.grouping.base import Group
+from datautils.grouping.coding import CategoricalCodec, DiscreteCodec
+from datautils.grouping.continuous import ContinuousGroup
+from datautils.grouping.continuous import find_levels as find_bins
+from datautils.grouping.discrete import DiscreteGroup, find_levels
+from datautils.grouping.incremental import IncrementalGrouping
+from datautils.grouping.utils import groupn
+
+
+def codes(n=1000000, k=1000):
+    """
+    Compare coding n string values (with k categories) one at a time
+    (with a DiscreteCodec dict lookup) to a CategoricalCodec
+    """
+    labels = numpy.array(['label%i' % i for i in xrange(k)])
+    values = labels[numpy.random.randint(0, k, n)]
+    lvalues = values.tolist()
+    mapping = dict([(l, i) for (i, l) in enumerate(sorted(labels))])
+    t0 = time.time()
+    dc = DiscreteCodec(mapping)
+    [dc.mapping[v] for v in lvalues]
+    print "dict lookup: %.3fs" % (time.time() - t0)
+    t0 = time.time()
+    codec = CategoricalCodec()
+    for s in xrange(0, n, n // 10):
+        codec.fit(values[s:s + n // 10])
+    print "fit (10 chunks): %.3fs" % (time.time() - t0)
+    out = numpy.empty(n, dtype=int)
+    t0 = time.time()
+    codec(values, out=out)
+    print "code: %.3fs" % (time.time() - t0)
+
+
+def discrete(n=100000, k=1000):
+    """
+    Compare grouping n values (with k unique values) with the level
+    tests to the one pass (dict lookup) grouping
+    """
+    values = [{'id': 'id%i' % random.randint(0, k - 1)} for _ in xrange(n)]
+    key = lambda v: v['id']
+    levels = find_levels(values, key=key)
+    t0 = time.time()
+    Group.group(DiscreteGroup(levels), values, key=key)
+    print "level tests: %.3fs" % (time.time() - t0)
+    t0 = time.time()
+    DiscreteGroup()(values, key=key)
+    print "one pass: %.3fs" % (time.time() - t0)
+
+
+def continuous(n=100000, nbins=100):
+    """
+    Compare grouping n values into nbins with the level tests, the
+    binary search and (for arrays) searchsorted
+    """
+    values = [random.random() for _ in xrange(n)]
+    levels = find_bins(values, n=nbins)
+    t0 = time.time()
+    Group.group(ContinuousGroup(levels), values)
+    print "level tests: %.3fs" % (time.time() - t0)
+    t0 = time.time()
+    ContinuousGroup(levels)(values)
+    print "bisect: %.3fs" % (time.time() - t0)
+    values = numpy.array(values)
+    t0 = time.time()
+    ContinuousGroup(levels)(values)
+    print "searchsorted: %.3fs" % (time.time() - t0)
+
+
+def arrays(n=1000000, nkeys=3, k=100):
+    """
+    Compare groupn of n rows (dicts) by nkeys (each with k values) to
+    group_inds of a structured array
+    """
+    names = ['k%i' % i for i in xrange(nkeys)]
+    a = numpy.zeros(n, dtype=[(nm, 'i8') for nm in names])
+    for nm in names:
+        a[nm] = numpy.random.randint(0, k, n)
+    docs = [dict(zip(names, r)) for r in a.tolist()]
+    t0 = time.time()
+    groupn(docs, names)
+    print "groupn (list of dicts): %.3fs" % (time.time() - t0)
+    t0 = time.time()
+    group_inds(a, names)
+    print "group_inds (structured array): %.3fs" % (time.time() - t0)
+
+
+def aggregation(n=1000000, k=100):
+    """
+    Compare groupn -> ops.stat (with pick) to aggregate for n documents
+    (and an array) with 2 keys (k values each)
+    """
+    a = numpy.zeros(n, dtype=[('a', 'i8'), ('b', 'i8'), ('v', 'f8')])
+    a['a'] = numpy.random.randint(0, k, n)
+    a['b'] = numpy.random.randint(0, k, n)
+    a['v'] = numpy.random.randn(n)
+    docs = [{'a': i, 'b': j, 'v': v} for (i, j, v) in a.tolist()]
+    mean = lambda vs: sum(vs) / float(len(vs))
+    t0 = time.time()
+    ops.stat(groupn(docs, ('a', 'b')), mean, 'v')
+    print "groupn + stat: %.3fs" % (time.time() - t0)
+    t0 = time.time()
+    aggregate(docs, ('a', 'b'), ('v', 'mean'))
+    print "aggregate (docs): %.3fs" % (time.time() - t0)
+    t0 = time.time()
+    aggregate(a, ('a', 'b'), ('v', 'mean'))
+    print "aggregate (array): %.3fs" % (time.time() - t0)
+
+
+def incremental(n=100000, batch=100, k=100):
+    """
+    Compare regrouping all documents (groupn + stat) to adding a batch
+    of new documents to an IncrementalGrouping
+    """
+    docs = [{'a': random.randint(0, k), 'b': random.randint(0, k),
+             'v': random.random()} for _ in xrange(n + batch)]
+    mean = lambda vs: sum(vs) / float(len(vs))
+    ig = IncrementalGrouping(('a', 'b'), {'v': ('v', 'mean')})
+    ig.add(docs[:n])
+    t0 = time.time()
+    ops.stat(groupn(docs, ('a', 'b')), mean, 'v')
+    print "regroup %i docs: %.3fs" % (n + batch, time.time() - t0)
+    t0 = time.time()
+    ig.add(docs[n:])
+    ig.stat('v')
+    print "add %i docs and read: %.3fs" % (batch, time.time() - t0)
+
+
+benchmarks = {
+    'aggregation': aggregation,
+    'arrays': arrays,
+    'codes': codes,
+    'continuous': continuous,
+    'discrete': discrete,
+    'incremental': incremental,
+}
+
+
+if __name__ == '__main__':
+    for name in (sys.argv[1:] or sorted(benchmarks)):
+        print "---- %s ----" % name
+        benchmarks[name]()
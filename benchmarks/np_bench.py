@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+"""
+Benchmarks for datautils.np
+
+python benchmarks/np_bench.py [name...]
+
+runs the named benchmarks (or all of them)
+"""
+
+import sys
+import time
+
+import numpy
+
+from datautils.np.query import mask, sparse_density
+
+
+def best(f, repeat):
+    """
+    Return the best time of running f repeat times
+    """
+    ts = []
+    for _ in xrange(repeat):
+        t0 = time.time()
+        f()
+        ts.append(time.time() - t0)
+    return min(ts)
+
+
+def density(n=10000000, repeat=3):
+    """
+    Time mask with masks only (density=0), indices only (density=1)
+    and the default density for first items of different selectivity
+    """
+    r = numpy.random.RandomState(0)
+    a = numpy.empty(n, dtype=[('x', 'f8'), ('y', 'i4'), ('z', 'f4')])
+    a['x'] = r.rand(n)
+    a['y'] = r.randint(0, 100, n)
+    a['z'] = r.rand(n)
+    for selectivity in (0.5, 0.1, 0.01, 0.001, 0.0001):
+        q = {'$and': [
+            {'x': {'$lt': selectivity}},
+            {'y': {'$in': range(50)}},
+            {'z': {'$gte': 0.25, '$lt': 0.75}},
+        ]}
+        ts = [best(lambda: mask(a, q, density=d), repeat)
+              for d in (0, 1, sparse_density)]
+        print "selectivity %g: masks %.3fs, indices %.3fs, default %.3fs" % (
+            (selectivity, ) + tuple(ts))
+
+
+benchmarks = {
+    'density': density,
+}
+
+
+if __name__ == '__main__':
+    for name in (sys.argv[1:] or sorted(benchmarks)):
+        print "---- %s ----" % name
+        benchmarks[name]()
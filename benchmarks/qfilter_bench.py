@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+"""
+Benchmarks for datautils.qfilter
+
+python benchmarks/qfilter_bench.py [name...]
+
+runs the named benchmarks (or all of them)
+"""
+
+import random
+import sys
+import time
+
+from datautils.qfilter.columnar import ColumnarCollection
+from datautils.qfilter.query import compile_query, make_query_test, qfilter
+
+
+def make_docs(n, seed=0):
+    """
+    Generate n synthetic nested documents
+    """
+    r = random.Random(seed)
+    subjects = ['s%i' % i for i in xrange(100)]
+    return [{
+        'subject': {'name': r.choice(subjects), 'age': r.randint(1, 100)},
+        'session': {'trial': {'index': i, 'value': r.random()}},
+        'tags': [r.randint(0, 10) for _ in xrange(3)],
+        } for i in xrange(n)]
+
+
+def best(f, repeat):
+    """
+    Return (best time, result) of running f repeat times
+    """
+    ts = []
+    for _ in xrange(repeat):
+        t0 = time.time()
+        r = f()
+        ts.append(time.time() - t0)
+    return min(ts), r
+
+
+def compiled(n=1000000, repeat=3):
+    """
+    Compare qfilter (make_query_test) to a CompiledQuery
+
+    Prints the best of repeat times for each query
+    """
+    docs = make_docs(n)
+    queries = [
+        {'subject.name': 's1'},
+        {'subject.name': {'$in': ['s%i' % i for i in xrange(20)]}},
+        {'subject.age': {'$gte': 20, '$lt': 40},
+         'session.trial.value': {'$lt': 0.5}},
+        {'tags': {'$nin': [1, 2, 3]}},
+        ]
+    for q in queries:
+        def uncompiled():
+            t = make_query_test(q)
+            return [i for i in docs if t(i)]
+        tu, ru = best(uncompiled, repeat)
+        tc, rc = best(lambda: compile_query(q).filter(docs), repeat)
+        assert ru == rc
+        print "%s: %i docs, make_query_test %.3fs, compiled %.3fs [%.1fx]" % (
+            q, len(rc), tu, tc, tu / tc)
+
+
+def columnar(n=1000000, repeat=3):
+    """
+    Compare qfilter to a ColumnarCollection
+
+    Prints the best of repeat times for each query (and the time to
+    extract the queried columns)
+    """
+    docs = make_docs(n)
+    queries = [
+        {'subject.age': {'$gte': 20, '$lt': 40}},
+        {'subject.age': {'$in': range(10)},
+         'session.trial.value': {'$lt': 0.5}},
+        {'subject.name': {'$in': ['s%i' % i for i in xrange(20)]}},
+        ]
+    cc = ColumnarCollection(docs)
+    t0 = time.time()
+    for k in ('subject.age', 'subject.name', 'session.trial.value'):
+        cc.column(k)
+    print "column extraction %.3fs" % (time.time() - t0, )
+    for q in queries:
+        tq, rq = best(lambda: qfilter(docs, q), repeat)
+        tc, rc = best(lambda: cc.filter(q), repeat)
+        assert rq == rc
+        print "%s: %i docs, qfilter %.3fs, columnar %.3fs [%.1fx]" % (
+            q, len(rc), tq, tc, tq / tc)
+
+
+benchmarks = {
+    'columnar': columnar,
+    'compiled': compiled,
+}
+
+
+if __name__ == '__main__':
+    for name in (sys.argv[1:] or sorted(benchmarks)):
+        print "---- %s ----" % name
+        benchmarks[name]()
@@ -8,6 +8,7 @@ import sys
 import datautils
 import numpy
 
+from . import ddict
 from . import log
 
 
@@ -84,6 +85,8 @@ def save(cfg, fn):
 def parse(cfg):
     if cfg is None:
         return {}
+    if isinstance(cfg, ddict.PDict):  # immutable, no need to copy
+        return cfg
     if isinstance(cfg, dict):
         return copy.deepcopy(cfg)
     if isinstance(cfg, (str, unicode)):  # filename
@@ -92,7 +95,20 @@ def parse(cfg):
     raise TypeError("Unknown cfg type {}: {}".format(type(cfg), cfg))
 
 
-def cascade(a, b, modify=False):
+def cascade(a, b, modify=False, persistent=False):
+    """
+    Cascade (recursively update) config a with b
+
+    Unless modify is True, a is not modified and the result is a copy.
+    If persistent is True the result is an (immutable) ddict.PDict that
+    shares all sub-dicts of a that b does not change (so cascading a
+    PDict only copies the changed paths).
+    """
+    if persistent:
+        try:
+            return ddict.persistent.freeze(a).merge(b)
+        except TypeError as e:
+            raise CascadeError(str(e))
     if not modify:
         a = copy.deepcopy(a)
     for k in b:
@@ -109,19 +125,63 @@ def cascade(a, b, modify=False):
 
 
 def delta(a, b):
-    """Find all keys and values in b not in a"""
+    """Find all keys and values in b not in a
+
+    Sub-dicts shared by a and b (see cascade) are skipped and values of
+    PDicts (which are immutable) are not copied.
+    """
+    if isinstance(b, ddict.PDict):
+        copy_value = lambda v: v
+    else:
+        copy_value = copy.deepcopy
     d = {}
     for k in b:
+        if k in a and a[k] is b[k]:
+            continue
         if k not in a:
-            d[k] = copy.deepcopy(b[k])
+            d[k] = copy_value(b[k])
         elif isinstance(a[k], dict):
             if isinstance(b[k], dict):
                 dd = delta(a[k], b[k])
                 if dd != {}:
                     d[k] = dd
             else:
-                d[k] = copy.deepcopy(b[k])
+                d[k] = copy_value(b[k])
         else:
             if a[k] != b[k]:
-                d[k] = copy.deepcopy(b[k])
+                d[k] = copy_value(b[k])
     return d
+
+
+def test_cascade_delta():
+    a = {'a': {'b': 1, 'c': [1]}, 'd': {'e': {'f': 2}}}
+    # results are mutable copies unless persistent
+    m = cascade(a, {'a': {'b': 2}})
+    assert not isinstance(m, ddict.PDict)
+    m['a']['c'].append(2)
+    m['d']['x'] = 1
+    assert a == {'a': {'b': 1, 'c': [1]}, 'd': {'e': {'f': 2}}}
+    assert m == {'a': {'b': 2, 'c': [1, 2]}, 'd': {'e': {'f': 2}, 'x': 1}}
+    b = cascade(a, {'a': {'b': 2}, 'g': 3}, persistent=True)
+    assert isinstance(b, ddict.PDict)
+    assert b == {'a': {'b': 2, 'c': [1]}, 'd': {'e': {'f': 2}}, 'g': 3}
+    assert a['a']['b'] == 1
+    c = cascade(b, {'a': {'c': [2]}}, persistent=True)
+    assert c['d'] is b['d']
+    assert delta(b, c) == {'a': {'c': [2]}}
+    assert delta(a, b) == {'a': {'b': 2}, 'g': 3}
+    assert cascade(b, {'a': {'b': 2}}, persistent=True) is b
+    try:
+        b['g'] = 4
+        assert False
+    except TypeError:
+        pass
+    for p in (False, True):
+        try:
+            cascade(b, {'g': {'h': 1}}, persistent=p)
+            assert False
+        except CascadeError:
+            pass
+    m = {'a': {}}
+    assert cascade(m, {'a': {'b': 1}}, modify=True) is m
+    assert m == {'a': {'b': 1}}
@@ -1,7 +1,13 @@
 #!/usr/bin/env python
 
-from ddict import DDict
-from ops import rget, rset, rdel, dget, dset, ddel, tget
+from ddict import DDict, FlatDDict, FrozenDDict
+from persistent import PDict
+import diff
+from lazy import LazyDDict, BSONDDict, JSONDDict
+from ops import rget, rset, rdel, dget, dset, ddel, tget, KeyPath, key_path, \
+    itemgetter
 
 
-__all__ = ['DDict', 'rget', 'rset', 'rdel', 'dget', 'dset', 'ddel', 'tget']
+__all__ = ['DDict', 'FlatDDict', 'FrozenDDict', 'rget', 'rset', 'rdel',
+           'dget', 'dset', 'ddel', 'tget', 'KeyPath', 'key_path',
+           'itemgetter', 'LazyDDict', 'BSONDDict', 'JSONDDict', 'PDict']
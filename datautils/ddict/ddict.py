@@ -14,6 +14,11 @@ which can be cumbersome for large document heirarchies.
 These utilities are meant to allow for access like this
 
 dget(d, 'a.b')
+
+For documents that are read many times see FlatDDict (which keeps an
+index of all dotted keys) and FrozenDDict (read-only, caches dotted
+gets). Both trade memory for faster dotted gets, see
+benchmarks/ddict_bench.py.
 """
 
 from ops import dget, dset, ddel
@@ -60,3 +65,206 @@ class DDict(dict):
             # this seems like the right thing to do as it's incorrectly trying
             # to use a leaf node
             return default
+
+    def freeze(self):
+        """
+        Return a read-only copy (see FrozenDDict)
+        """
+        return FrozenDDict(self)
+
+
+def indexable(key):
+    """
+    Can key be part of a dotted key
+    """
+    return isinstance(key, (str, unicode)) and '.' not in key
+
+
+class FlatDDict(DDict):
+    """
+    A DDict that keeps a flat index of every dotted key
+    {'a': {'b': 1}} -> {'a': {'b': 1}, 'a.b': 1} so dotted gets are
+    a single lookup.
+
+    The index is updated when the FlatDDict is modified (d['a.b'] = 2,
+    del d['a.b'], d.update...) but not when nested dicts are modified
+    directly (d['a']['b'] = 2) so all writes should go through the
+    FlatDDict. The index holds one entry per nested value. Copies copy
+    all nested dicts (not other values) so writes through a copy don't
+    change the original.
+    """
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._flat = {}
+        for (k, v) in dict.iteritems(self):
+            if not isinstance(k, (str, unicode)) or '.' not in k:
+                self._index(k, v)
+
+    def _index(self, key, value):
+        self._flat[key] = value
+        if isinstance(value, dict) and isinstance(key, (str, unicode)):
+            for (k, v) in value.iteritems():
+                if indexable(k):
+                    self._index(key + '.' + k, v)
+
+    def _unindex(self, key, value):
+        self._flat.pop(key, None)
+        if isinstance(value, dict) and isinstance(key, (str, unicode)):
+            for (k, v) in value.iteritems():
+                if indexable(k):
+                    self._unindex(key + '.' + k, v)
+
+    def __getitem__(self, key):
+        try:
+            return self._flat[key]
+        except KeyError:
+            # raise the same errors as DDict
+            return DDict.__getitem__(self, key)
+
+    def __setitem__(self, key, value):
+        flat = self._flat
+        old = flat.get(key, flat)
+        DDict.__setitem__(self, key, value)
+        if old is not flat:
+            self._unindex(key, old)
+        if isinstance(key, (str, unicode)) and '.' in key:
+            # index any new parent dicts
+            ks = key.split('.')
+            for i in xrange(1, len(ks)):
+                pk = '.'.join(ks[:i])
+                if pk not in flat:
+                    flat[pk] = dget(self, pk)
+        self._index(key, value)
+
+    def __delitem__(self, key):
+        flat = self._flat
+        old = flat.get(key, flat)
+        DDict.__delitem__(self, key)
+        if old is not flat:
+            self._unindex(key, old)
+
+    def update(self, *args, **kwargs):
+        for (k, v) in dict(*args, **kwargs).iteritems():
+            self[k] = v
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def pop(self, key, *args):
+        if key not in self:
+            return dict.pop(self, key, *args)
+        v = dict.__getitem__(self, key)
+        del self[key]
+        return v
+
+    def popitem(self):
+        k, v = dict.popitem(self)
+        self._unindex(k, v)
+        return k, v
+
+    def clear(self):
+        dict.clear(self)
+        self._flat.clear()
+
+    def copy(self):
+        return self.__class__(copy_dicts(self))
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self), ))
+
+
+def copy_dicts(d):
+    """
+    Copy d and all nested dicts (other values are not copied)
+    """
+    return dict([(k, copy_dicts(v) if isinstance(v, dict) else v)
+                 for (k, v) in dict.iteritems(d)])
+
+
+class FrozenDDict(DDict):
+    """
+    A read-only DDict that caches the results of dotted gets
+
+    Unlike FlatDDict nothing is indexed until it is read so it is cheap
+    to make for documents that are only read a few times. Nested dicts
+    are not copied (or frozen) and should not be modified.
+    """
+    def __init__(self, *args, **kwargs):
+        dict.__init__(self, *args, **kwargs)
+        self._cache = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._cache[key]
+        except KeyError:
+            pass
+        v = self._cache[key] = DDict.__getitem__(self, key)
+        return v
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("%s is read-only" % type(self).__name__)
+
+    __setitem__ = __delitem__ = _read_only
+    update = setdefault = pop = popitem = clear = _read_only
+
+    def freeze(self):
+        return self
+
+    def copy(self):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self), ))
+
+
+# ------------------ tests ------------------
+def test_flat_ddict():
+    d = FlatDDict({'a': {'b': {'c': 1}}, 1: 2, 'x.y': 3})
+    assert d['a.b.c'] == 1
+    assert d['a.b'] == {'c': 1}
+    assert d[1] == 2
+    assert d.get('x.y') is None
+    assert d.get('a.b.d', 4) == 4
+    d['a.b.c'] = {'e': 5}
+    assert d['a.b.c.e'] == 5
+    assert d['a'] == {'b': {'c': {'e': 5}}}
+    d['a.b'] = 6
+    assert d['a.b'] == 6
+    assert 'a.b.c' not in d._flat
+    d['f.g.h'] = 7
+    assert d['f.g'] == {'h': 7} and d['f'] == {'g': {'h': 7}}
+    del d['f.g']
+    assert d['f'] == {} and d.get('f.g.h') is None
+    d.update({'f': {'i': 8}})
+    assert d['f.i'] == 8
+    assert d.setdefault('j.k', 9) == 9
+    assert d.pop('f') == {'i': 8}
+    assert d.get('f.i') is None
+    assert isinstance(d.copy(), FlatDDict) and d.copy()['j.k'] == 9
+    # writes through a copy don't change the original (or its index)
+    c = d.copy()
+    c['j.k'] = 10
+    c['j.l'] = 11
+    assert d['j.k'] == d['j']['k'] == 9 and d['j'] == {'k': 9}
+    assert c['j.k'] == c['j']['k'] == 10 and c['j.l'] == 11
+    assert d._flat == FlatDDict(dict(d))._flat
+    d.clear()
+    assert d == {} and d._flat == {}
+
+
+def test_frozen_ddict():
+    d = DDict({'a': {'b': 1}}).freeze()
+    assert isinstance(d, FrozenDDict)
+    assert d['a.b'] == 1
+    assert d['a.b'] == 1
+    assert d.get('a.c', 2) == 2
+    for f in (lambda: d.__setitem__('a', 1), lambda: d.__delitem__('a'),
+              lambda: d.update({}), lambda: d.pop('a')):
+        try:
+            f()
+            assert False
+        except TypeError:
+            pass
+    assert d.freeze() is d
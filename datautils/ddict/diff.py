@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+"""
+Diff and patch nested dicts
+
+diff(a, b) returns a list of operations that turn a into b:
+
+    ('set', 'a.b', value)  # add a key that is not in a
+    ('replace', 'a.b', value)  # change the value of a key
+    ('unset', 'a.b')  # remove a key
+
+paths are dotted keys (see ddict.ops.dget). Sub-dicts that are the same
+object in a and b (for example sub-dicts shared by PDicts, see
+ddict.persistent) are skipped without being compared so the time to
+diff two versions of a PDict depends on the size of the differences
+not the size of the dicts.
+
+patch(a, ops) applies the operations to a.
+
+Example
+------
+
+a = {'a': {'b': 1, 'c': 2}}
+b = {'a': {'b': 2}, 'd': 3}
+ops = diff(a, b)
+# [('unset', 'a.c'), ('replace', 'a.b', 2), ('set', 'd', 3)]
+patch(a, ops)  # a == b
+"""
+
+import copy
+
+from ops import dset, ddel
+from persistent import PDict
+
+
+def indexable(key):
+    """
+    Can key be part of a dotted path
+    """
+    return isinstance(key, (str, unicode)) and '.' not in key
+
+
+def is_different(a, b):
+    return (type(a) is not type(b)) or (a != b)
+
+
+def make_path(prefix, key):
+    if prefix is not None:
+        return prefix + key
+    if isinstance(key, (str, unicode)) and '.' in key:
+        raise ValueError("Cannot diff top level key %r" % key)
+    return key
+
+
+def diff(a, b, prefix=None, ops=None):
+    """
+    Return a list of operations (see module docstring) that turn a into
+    b, values in operations are copies of the values in b
+    """
+    if ops is None:
+        ops = []
+    if a is b:
+        return ops
+    for k in a:
+        if k not in b:
+            ops.append(('unset', make_path(prefix, k)))
+    for (k, bv) in b.iteritems():
+        if k not in a:
+            ops.append(('set', make_path(prefix, k), copy.deepcopy(bv)))
+            continue
+        av = a[k]
+        if av is bv:
+            continue
+        p = make_path(prefix, k)
+        if isinstance(av, dict) and isinstance(bv, dict) and \
+                isinstance(p, (str, unicode)) and \
+                all([indexable(sk) for sk in av]) and \
+                all([indexable(sk) for sk in bv]):
+            diff(av, bv, p + '.', ops)
+        elif is_different(av, bv):
+            ops.append(('replace', p, copy.deepcopy(bv)))
+    return ops
+
+
+def patch(d, ops):
+    """
+    Apply operations (see diff) to d in place and return d. Values are
+    not copied so ops should only be applied once.
+
+    For a PDict (which can't be modified) a new PDict is returned.
+    """
+    persistent = isinstance(d, PDict)
+    for op in ops:
+        if op[0] in ('set', 'replace'):
+            if persistent:
+                d = d.set(op[1], op[2])
+            else:
+                dset(d, op[1], op[2])
+        elif op[0] == 'unset':
+            if persistent:
+                d = d.remove(op[1])
+            else:
+                ddel(d, op[1])
+        else:
+            raise ValueError("Unknown patch operation %r" % (op, ))
+    return d
+
+
+# ------------------ tests ------------------
+def test_diff_patch():
+    a = {'a': {'b': 1, 'c': 2, 'd': {'e': [1]}}, 'f': 1, 'g': {'h': 1},
+         1: 'x', 'i': {1: 2}}
+    b = {'a': {'b': 2, 'd': {'e': [1, 2]}, 'j': {'k': 1}}, 'f': 1.0,
+         'g': 1, 1: 'y', 'i': {1: 3}, 'l': None}
+    ops = diff(a, b)
+    assert sorted(ops) == sorted([
+        ('unset', 'a.c'), ('replace', 'a.b', 2),
+        ('replace', 'a.d.e', [1, 2]), ('set', 'a.j', {'k': 1}),
+        ('replace', 'f', 1.0), ('replace', 'g', 1), ('replace', 1, 'y'),
+        ('replace', 'i', {1: 3}), ('set', 'l', None)])
+    assert diff(a, a) == []
+    c = copy.deepcopy(a)
+    assert patch(c, ops) is c
+    assert c == b and type(c['f']) is float
+    b['a']['d']['e'].append(3)
+    assert c['a']['d']['e'] == [1, 2]  # values were copied
+    # json round trip
+    import json
+    c = copy.deepcopy(a)
+    del c[1], c['i']
+    bc = copy.deepcopy(b)
+    del bc[1], bc['i']
+    assert patch(c, json.loads(json.dumps(diff(c, bc)))) == bc
+    try:
+        patch({}, [('bad', 'a')])
+        assert False
+    except ValueError:
+        pass
+    try:
+        diff({'a.b': 1}, {})
+        assert False
+    except ValueError:
+        pass
+
+
+def test_persistent_diff():
+    a = PDict(dict([
+        ('n%i' % i, dict([('k%i' % j, {'v': j}) for j in xrange(10)]))
+        for i in xrange(10)]))
+    b = a.set('n1.k2.v', -1).remove('n3.k4').set('n5.x', {'y': 1})
+    ops = diff(a, b)
+    assert sorted(ops) == sorted([
+        ('replace', 'n1.k2.v', -1), ('unset', 'n3.k4'),
+        ('set', 'n5.x', {'y': 1})])
+    assert patch(a, ops) == b
+    assert isinstance(patch(a, ops), PDict)
+    c = copy.deepcopy(a)
+    assert patch(c, ops) == b
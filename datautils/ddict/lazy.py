@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+"""
+Lazy (read-only) DDict views of encoded documents
+
+A view keeps the encoded document (a BSON or JSON string) and scans
+its top level keys only until the key being read is found. Values are
+decoded when they are read (and cached). Sub-documents are returned as
+views of the same string so they are not copied or decoded until one
+of their keys is read.
+
+Scanning is done in python so reading most of the keys of a document
+is slower than decoding it (with bson's C extension or json). Views
+are faster (and use less memory) when a few keys are read from
+documents with large values (sub-documents, arrays, strings) as values
+that are not read are skipped without being decoded (see
+benchmarks/ddict_bench.py).
+
+Views support dotted gets like a DDict (view['a.b'], view.get('a.b'),
+ddict.ops.tget...) and can be fully decoded with view.decode().
+
+Example
+------
+
+view = BSONDDict(raw_bson)  # or BSONDDict(RawBSONDocument(...).raw)
+view['subject.name']  # only decodes subject.name
+view = JSONDDict(json_string)
+view.get('session.trial', None)
+"""
+
+import collections
+import json
+import re
+import struct
+
+try:
+    import bson
+except ImportError:
+    bson = None
+
+from ddict import DDict
+from ops import dget
+
+
+class LazyDDict(collections.Mapping):
+    """
+    Base lazy view, subclasses must define scan and decode_value
+
+    data : str
+        encoded document (shared by all sub-document views)
+
+    start : int
+        offset of this (sub-)document in data
+
+    convert : function (default=None)
+        called on every decoded value that isn't a sub-document
+    """
+    def __init__(self, data, start=0, convert=None):
+        self._data = data
+        self._start = start
+        self._convert = convert
+        self._keys = []
+        self._spans = {}
+        self._scanner = None
+        self._values = {}
+
+    def scan(self):
+        """
+        Generator that scans the top level keys, adding each to _keys
+        and _spans (key: span passed to decode_value) and yielding it
+        """
+        raise NotImplementedError
+
+    def decode_value(self, span):
+        raise NotImplementedError
+
+    @property
+    def scanner(self):
+        if self._scanner is None:
+            self._scanner = self.scan()
+        return self._scanner
+
+    def find(self, key):
+        """
+        Find the span of key, scanning only until it is found
+        """
+        try:
+            return self._spans[key]
+        except KeyError:
+            pass
+        for k in self.scanner:
+            if k == key:
+                return self._spans[k]
+        raise KeyError(key)
+
+    @property
+    def keys_list(self):
+        """
+        All top level keys (in order)
+        """
+        for _ in self.scanner:
+            pass
+        return self._keys
+
+    def view(self, start):
+        return self.__class__(self._data, start, self._convert)
+
+    def get_value(self, key):
+        """
+        Get (and decode) the value of a top level key
+        """
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        v = self.decode_value(self.find(key))
+        if (self._convert is not None) and not isinstance(v, LazyDDict):
+            v = self._convert(v)
+        self._values[key] = v
+        return v
+
+    def __getitem__(self, key):
+        if isinstance(key, (str, unicode)) and '.' in key:
+            return dget(self, key)
+        return self.get_value(key)
+
+    def get(self, key, default=None):
+        # like DDict.get this doesn't catch TypeError
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __iter__(self):
+        return iter(self.keys_list)
+
+    def __len__(self):
+        return len(self.keys_list)
+
+    def __contains__(self, key):
+        try:
+            self.find(key)
+        except (KeyError, TypeError):
+            return False
+        return True
+
+    def decode(self, dclass=DDict):
+        """
+        Decode all values, returning a dclass (sub-documents are also
+        converted to dclass)
+        """
+        r = dclass()
+        for k in self.keys_list:
+            v = self.get_value(k)
+            if isinstance(v, LazyDDict):
+                v = v.decode(dclass)
+            dict.__setitem__(r, k, v)
+        return r
+
+    def __repr__(self):
+        return "%s(%s keys)" % (type(self).__name__, len(self))
+
+
+# ------------------ BSON ------------------
+int32 = struct.Struct('<i')
+double = struct.Struct('<d')
+int64 = struct.Struct('<q')
+
+
+def bson_string_size(data, i):
+    return 4 + int32.unpack_from(data, i)[0]
+
+
+def bson_cstring_size(data, i):
+    return data.index('\x00', i) + 1 - i
+
+
+# size of fixed size BSON element types
+bson_fixed_sizes = {
+    '\x01': 8,  # double
+    '\x06': 0,  # undefined
+    '\x07': 12,  # ObjectId
+    '\x08': 1,  # bool
+    '\x09': 8,  # datetime
+    '\x0A': 0,  # null
+    '\x10': 4,  # int32
+    '\x11': 8,  # timestamp
+    '\x12': 8,  # int64
+    '\x13': 16,  # decimal128
+    '\x7F': 0,  # max key
+    '\xFF': 0,  # min key
+}
+
+
+# BSON element type : function(data, offset) returning the value size
+bson_sizes = {
+    '\x02': bson_string_size,  # string
+    '\x03': lambda d, i: int32.unpack_from(d, i)[0],  # document
+    '\x04': lambda d, i: int32.unpack_from(d, i)[0],  # array
+    '\x05': lambda d, i: 5 + int32.unpack_from(d, i)[0],  # binary
+    '\x0B': lambda d, i: (  # regex
+        bson_cstring_size(d, i) +
+        bson_cstring_size(d, i + bson_cstring_size(d, i))),
+    '\x0C': lambda d, i: bson_string_size(d, i) + 12,  # DBPointer
+    '\x0D': bson_string_size,  # javascript
+    '\x0E': bson_string_size,  # symbol
+    '\x0F': lambda d, i: int32.unpack_from(d, i)[0],  # code with scope
+}
+
+
+# decode common types without bson
+bson_decoders = {
+    '\x01': lambda d, i: double.unpack_from(d, i)[0],
+    '\x02': lambda d, i: d[
+        i + 4:i + 3 + int32.unpack_from(d, i)[0]].decode('utf-8'),
+    '\x08': lambda d, i: d[i] != '\x00',
+    '\x0A': lambda d, i: None,
+    '\x10': lambda d, i: int32.unpack_from(d, i)[0],
+    '\x12': lambda d, i: int64.unpack_from(d, i)[0],
+}
+
+
+class BSONDDict(LazyDDict):
+    """
+    Lazy view of a BSON document (for example RawBSONDocument.raw)
+
+    Arrays and uncommon types are decoded with bson (from pymongo).
+    """
+    def scan(self):
+        data = self._data
+        find = data.index
+        add_key = self._keys.append
+        spans = self._spans
+        fixed = bson_fixed_sizes
+        i = self._start + 4
+        end = self._start + int32.unpack_from(data, self._start)[0] - 1
+        while i < end:
+            t = data[i]
+            vi = find('\x00', i + 1) + 1
+            if t in fixed:
+                vend = vi + fixed[t]
+            elif t in bson_sizes:
+                vend = vi + bson_sizes[t](data, vi)
+            else:
+                raise ValueError("Invalid BSON element type %r" % t)
+            k = data[i + 1:vi - 1].decode('utf-8')
+            add_key(k)
+            spans[k] = (t, i, vi, vend)
+            yield k
+            i = vend
+
+    def decode_value(self, span):
+        t, i, vi, vend = span
+        if t == '\x03':
+            return self.view(vi)
+        if t in bson_decoders:
+            return bson_decoders[t](self._data, vi)
+        if bson is None:
+            raise ImportError("bson is required to decode type %r" % t)
+        # decode a document containing only this element
+        e = self._data[i:vend]
+        return bson.BSON(
+            int32.pack(len(e) + 5) + e + '\x00').decode().values()[0]
+
+
+# ------------------ JSON ------------------
+json_string = re.compile(r'"(?:[^"\\]|\\.)*"')
+# strings and other scalars
+json_scalar = re.compile(r'"(?:[^"\\]|\\.)*"|[^\s,}\]]+')
+# arrays with no strings or nesting
+json_flat_array = re.compile(r'\[[^\[\]{}"]*\]')
+# tokens needed to skip nested values
+json_nested = re.compile(r'"(?:[^"\\]|\\.)*"|[\[\]{}]')
+json_space = re.compile(r'\s*')
+json_decoder = json.JSONDecoder()
+
+
+def json_skip_nested(data, i):
+    """
+    Return the end of a nested (object or array) value starting at i
+    """
+    depth = 0
+    for m in json_nested.finditer(data, i):
+        c = m.group()[0]
+        if c in '[{':
+            depth += 1
+        elif c in ']}':
+            depth -= 1
+            if depth == 0:
+                return m.end()
+    raise ValueError("Unterminated JSON value at %i" % i)
+
+
+class JSONDDict(LazyDDict):
+    """
+    Lazy view of a JSON object (a str or unicode)
+    """
+    def scan(self):
+        data = self._data
+        add_key = self._keys.append
+        spans = self._spans
+        space = json_space.match
+        i = space(data, self._start).end()
+        if data[i] != '{':
+            raise ValueError("JSON object expected at %i" % i)
+        i = space(data, i + 1).end()
+        while data[i] != '}':
+            m = json_string.match(data, i)
+            if m is None:
+                raise ValueError("JSON key expected at %i" % i)
+            key = m.group()
+            key = key[1:-1] if '\\' not in key else json.loads(key)
+            i = space(data, m.end()).end()
+            if data[i] != ':':
+                raise ValueError("JSON ':' expected at %i" % i)
+            vi = space(data, i + 1).end()
+            if data[vi] in '[{':
+                m = json_flat_array.match(data, vi)
+                i = m.end() if m is not None else json_skip_nested(data, vi)
+            else:
+                i = json_scalar.match(data, vi).end()
+            add_key(key)
+            spans[key] = vi
+            yield key
+            i = space(data, i).end()
+            if data[i] == ',':
+                i = space(data, i + 1).end()
+
+    def decode_value(self, vi):
+        if self._data[vi] == '{':
+            return self.view(vi)
+        return json_decoder.raw_decode(self._data, vi)[0]
+
+
+# ------------------ tests ------------------
+def test_json_ddict():
+    doc = {'a': {'b': {'c': 1}, 's': 'x{"}'}, 'l': [1, {'m': 2}],
+           'e': u'\xe9', 'k"q': True, 'n': None, 'f': 1.5, 'o': {}}
+    s = json.dumps(doc)
+    v = JSONDDict(s)
+    assert v['a.b.c'] == 1
+    assert v['a.s'] == 'x{"}'
+    assert isinstance(v['a'], JSONDDict)
+    assert v['l'] == [1, {'m': 2}]
+    assert v['e'] == u'\xe9'
+    assert v['k"q'] is True
+    assert v['n'] is None
+    assert v.get('a.b.d', 2) == 2
+    assert v.get('z') is None
+    assert len(v) == len(doc) and set(v) == set(doc)
+    assert v.decode() == doc
+    assert isinstance(v.decode()['a'], DDict)
+    assert JSONDDict(' {"a" : { } , "b":[ ]} ')['a'].decode() == {}
+    v = JSONDDict(s, convert=lambda x: x * 2 if x == 1.5 else x)
+    assert v['f'] == 3.
+
+
+def test_bson_ddict():
+    if bson is None:
+        return
+    import datetime
+    doc = {'a': {'b': {'c': 1}, 's': u'x'}, 'l': [1, {'m': 2}],
+           'i': 1 << 40, 'f': 1.5, 't': True, 'n': None, 'o': {},
+           'd': datetime.datetime(2000, 1, 1), 'e': u'\xe9'}
+    raw = bson.BSON.encode(doc)
+    v = BSONDDict(raw)
+    assert v['a.b.c'] == 1
+    assert isinstance(v['a.b'], BSONDDict)
+    assert v['a.s'] == u'x'
+    assert v['l'] == [1, {'m': 2}]
+    assert v['i'] == 1 << 40
+    assert v['t'] is True and v['n'] is None
+    assert v['d'] == doc['d']
+    assert v.get('a.z', 3) == 3
+    assert v.decode() == doc
+    assert set(v) == set(doc)
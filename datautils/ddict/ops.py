@@ -14,56 +14,139 @@ which can be cumbersome for large document heirarchies.
 These utilities are meant to allow for access like this
 
 dget(d, 'a.b')
+
+Dotted keys are split once and cached as KeyPaths (see key_path) so
+repeated gets with the same key don't re-split the key.
 """
 
 
+# maximum number of cached KeyPaths (see key_path)
+max_key_paths = 4096
+key_paths = {}
+
+
+class KeyPath(object):
+    """
+    A dotted key split (once) into the keys for each level
+
+    Example
+    ------
+    p = KeyPath('a.b')
+    p.keys  # ('a', 'b')
+    p.get({'a': {'b': 1}})  # 1
+    """
+    __slots__ = ('key', 'keys', 'parents', 'last')
+
+    def __init__(self, key, delimiter='.'):
+        self.key = key
+        if isinstance(key, (str, unicode)):
+            self.keys = tuple(key.split(delimiter))
+        else:
+            self.keys = (key, )
+        self.parents = self.keys[:-1]
+        self.last = self.keys[-1]
+
+    def get(self, d):
+        for k in self.keys:
+            d = d[k]
+        return d
+
+    __call__ = get
+
+    def tget(self, d, default=None):
+        try:
+            for k in self.keys:
+                d = d[k]
+        except:
+            return default
+        return d
+
+    def set(self, d, v):
+        """
+        Set the value, creating any missing levels (as dicts)
+        """
+        for k in self.parents:
+            if k not in d:
+                d[k] = {}
+            d = d[k]
+        d[self.last] = v
+
+    def delete(self, d):
+        for k in self.parents:
+            d = d[k]
+        del d[self.last]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __repr__(self):
+        return "KeyPath(%r)" % (self.keys, )
+
+
+def key_path(k, delimiter='.'):
+    """
+    Return a (cached) KeyPath for k
+
+    The cache is cleared when it holds more than max_key_paths
+    """
+    if isinstance(k, KeyPath):
+        return k
+    if not isinstance(k, (str, unicode)):
+        return KeyPath(k)
+    ck = (k, delimiter)
+    try:
+        return key_paths[ck]
+    except KeyError:
+        pass
+    if len(key_paths) >= max_key_paths:
+        key_paths.clear()
+    p = key_paths[ck] = KeyPath(k, delimiter)
+    return p
+
+
 def rget(d, k, *others):
     """
     recursive get
     """
-    if len(others):
-        return rget(d[k], *others)
-    return d[k]
+    d = d[k]
+    for k in others:
+        d = d[k]
+    return d
 
 
 def rset(d, k, v, *others):
-    if len(others):
+    for o in others:
         if k not in d:
             d[k] = {}
-        rset(d[k], others[0], v, *others[1:])
-    else:
-        d[k] = v
+        d, k = d[k], o
+    d[k] = v
 
 
 def rdel(d, k, *others):
-    if len(others):
-        rdel(d[k], *others)
-    else:
-        del d[k]
+    for o in others:
+        d, k = d[k], o
+    del d[k]
 
 
 def dget(d, k, delimiter='.'):
     """
     dotted get
     """
-    if isinstance(k, (str, unicode)):
-        return rget(d, *k.split(delimiter))
-    return rget(d, k)
+    try:
+        p = key_paths[(k, delimiter)]
+    except (KeyError, TypeError):
+        p = key_path(k, delimiter)
+    for k in p.keys:
+        d = d[k]
+    return d
 
 
 def dset(d, k, v, delimiter='.'):
-    if isinstance(k, (str, unicode)):
-        ks = k.split(delimiter)
-        rset(d, ks[0], v, *ks[1:])
-    else:
-        rset(d, k, v)
+    key_path(k, delimiter).set(d, v)
 
 
 def ddel(d, k, delimiter='.'):
-    if isinstance(k, (str, unicode)):
-        rdel(d, *k.split(delimiter))
-    else:
-        rdel(d, k)
+    key_path(k, delimiter).delete(d)
 
 
 def tget(d, k, default=None, delimiter=None):
@@ -81,6 +164,69 @@ def tdget(d, k, default=None):
     return tget(d, k, default, '.')
 
 
+class itemgetter(object):
+    """
+    Get several dotted keys from documents (like operator.itemgetter)
+
+    keys are split once when the itemgetter is made. If a default is
+    provided it is used for keys that can't be found, otherwise the
+    error (KeyError...) is raised.
+
+    Example
+    ------
+    get = itemgetter('a.b', 'c', default=None)
+    get({'a': {'b': 1}, 'c': 2})  # (1, 2)
+    get.columns(docs)  # {'a.b': [1, ...], 'c': [2, ...]}
+    """
+    def __init__(self, *keys, **kwargs):
+        delimiter = kwargs.pop('delimiter', '.')
+        self.has_default = 'default' in kwargs
+        self.default = kwargs.pop('default', None)
+        if len(kwargs):
+            raise TypeError(
+                "itemgetter got unexpected kwargs: %s" % kwargs.keys())
+        self.keys = keys
+        self.paths = tuple([key_path(k, delimiter).keys for k in keys])
+
+    def __call__(self, d):
+        r = []
+        for ks in self.paths:
+            v = d
+            try:
+                for k in ks:
+                    v = v[k]
+            except:
+                if not self.has_default:
+                    raise
+                v = self.default
+            r.append(v)
+        return tuple(r)
+
+    def columns(self, docs, asarray=False):
+        """
+        Get all keys from all docs in one pass, returning a dict of
+        key : list of values (or numpy arrays if asarray is True)
+        """
+        has_default, default = self.has_default, self.default
+        cols = [[] for _ in self.paths]
+        getters = zip(self.paths, [c.append for c in cols])
+        for d in docs:
+            for (ks, append) in getters:
+                v = d
+                try:
+                    for k in ks:
+                        v = v[k]
+                except:
+                    if not has_default:
+                        raise
+                    v = default
+                append(v)
+        if asarray:
+            import numpy
+            cols = [numpy.array(c) for c in cols]
+        return dict(zip(self.keys, cols))
+
+
 # ------------------ tests ------------------
 def test_rget():
     d = {'a': {'b': {'c': 1}}}
@@ -90,3 +236,62 @@ def test_rget():
 def test_dget():
     d = {'a': {'b': {'c': 1}}}
     assert dget(d, 'a.b.c') == 1
+
+
+def test_dset_ddel():
+    d = {}
+    dset(d, 'a.b.c', 1)
+    assert d == {'a': {'b': {'c': 1}}}
+    dset(d, 'a.d', 2)
+    rset(d, 'e', 3, 'f')
+    assert d == {'a': {'b': {'c': 1}, 'd': 2}, 'e': {'f': 3}}
+    ddel(d, 'a.b.c')
+    rdel(d, 'e', 'f')
+    assert d == {'a': {'b': {}, 'd': 2}, 'e': {}}
+    dset(d, 1, 'x')
+    assert dget(d, 1) == 'x'
+    ddel(d, 1)
+    assert 1 not in d
+
+
+def test_key_path():
+    d = {'a': {'b': {'c': 1}}, 'a|b': 2}
+    p = key_path('a.b.c')
+    assert p is key_path('a.b.c')
+    assert p.keys == ('a', 'b', 'c')
+    assert p.get(d) == 1
+    assert p(d) == 1
+    assert p.tget({'a': 1}, 3) == 3
+    assert key_path('a|b', '|').get(d) == {'c': 1}
+    assert key_path('a|b').get(d) == 2
+    p.set(d, 2)
+    assert d['a']['b']['c'] == 2
+    p.delete(d)
+    assert d['a']['b'] == {}
+    try:
+        p.get(d)
+        assert False
+    except KeyError:
+        pass
+    assert tget(d, 'a.b.c', 4) == 4
+    assert tdget(d, 'a|b', 5) == 2
+
+
+def test_itemgetter():
+    docs = [{'a': {'b': i}, 'c': str(i)} for i in xrange(5)]
+    docs.append({'a': 1})
+    get = itemgetter('a.b', 'c', default=-1)
+    assert get(docs[0]) == (0, '0')
+    assert get(docs[-1]) == (-1, -1)
+    cols = get.columns(docs)
+    assert cols == {'a.b': [0, 1, 2, 3, 4, -1], 'c': list('01234') + [-1]}
+    assert itemgetter('a|b', delimiter='|')(docs[1]) == (1, )
+    a = itemgetter('a.b').columns(docs[:-1], asarray=True)['a.b']
+    assert a.dtype.kind == 'i' and list(a) == range(5)
+    for f in (lambda: itemgetter('a.b')(docs[-1]),
+              lambda: itemgetter('c').columns(docs)):
+        try:
+            f()
+            assert False
+        except (KeyError, TypeError):
+            pass
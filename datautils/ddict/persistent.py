@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+"""
+Persistent (immutable) nested dictionaries
+
+A PDict can't be modified. Instead set, remove and assoc return a new
+PDict that copies only the dicts on the changed path(s) and shares all
+other (unchanged) sub-dicts with the original. This makes small changes
+to large nested dicts (like configs) cheap and old versions are kept
+intact.
+
+Nested dicts are converted to PDicts and other values are (deep)
+copied when they are added (see freeze) so they are owned by the PDict
+and should not be modified.
+
+Example
+------
+
+a = PDict({'a': {'b': 1}, 'c': {'d': 2}})
+b = a.set('a.b', 2)  # {'a': {'b': 2}, 'c': {'d': 2}}
+a['a']['b']  # 1, a is unchanged
+b['c'] is a['c']  # True, unchanged sub-dicts are shared
+"""
+
+import copy
+
+from ops import key_path
+
+
+class PDict(dict):
+    """
+    An immutable nested dict (see module docstring)
+
+    PDicts are dicts (for json, isinstance...) but all methods that
+    would modify a dict raise TypeError. copy.copy and copy.deepcopy
+    return (mutable) dicts.
+    """
+    def __init__(self, *args, **kwargs):
+        items = dict(*args, **kwargs)
+        for (k, v) in items.iteritems():
+            if not isinstance(v, PDict):
+                items[k] = freeze(v)
+        dict.__init__(self, items)
+
+    @classmethod
+    def from_frozen(cls, items):
+        """
+        Make a PDict from a dict of already frozen values
+        """
+        p = cls.__new__(cls)
+        dict.update(p, items)
+        return p
+
+    def _immutable(self, *args, **kwargs):
+        raise TypeError("%s is immutable" % type(self).__name__)
+
+    __setitem__ = __delitem__ = _immutable
+    clear = pop = popitem = setdefault = update = _immutable
+
+    def assoc(self, items):
+        """
+        Return a new PDict with items (a dict of frozen values) replacing
+        values in this PDict (or self if nothing changed)
+        """
+        for (k, v) in items.iteritems():
+            if dict.get(self, k, items) is not v:
+                break
+        else:
+            return self
+        p = self.from_frozen(self)
+        dict.update(p, items)
+        return p
+
+    def set(self, key, value, delimiter='.'):
+        """
+        Return a new PDict with (dotted) key set to value, missing
+        levels are added (as empty PDicts)
+        """
+        return self._set(key_path(key, delimiter).keys, freeze(value))
+
+    def _set(self, keys, value):
+        k = keys[0]
+        if len(keys) > 1:
+            sub = dict.get(self, k, None)
+            if sub is None:
+                sub = empty
+            elif not isinstance(sub, PDict):
+                raise TypeError(
+                    "Cannot set %s in non-dict %r" % (keys[1:], sub))
+            value = sub._set(keys[1:], value)
+        return self.assoc({k: value})
+
+    def remove(self, key, delimiter='.'):
+        """
+        Return a new PDict without (dotted) key, raises KeyError if key
+        is missing
+        """
+        return self._remove(key_path(key, delimiter).keys)
+
+    def _remove(self, keys):
+        k = keys[0]
+        if len(keys) > 1:
+            return self.assoc({k: self[k]._remove(keys[1:])})
+        if k not in self:
+            raise KeyError(k)
+        p = self.from_frozen(self)
+        dict.__delitem__(p, k)
+        return p
+
+    def merge(self, other):
+        """
+        Return a new PDict with the values of other (recursively)
+        merged in, sub-dicts are merged rather than replaced
+        """
+        items = {}
+        for (k, v) in other.iteritems():
+            if isinstance(v, dict):
+                sub = dict.get(self, k, empty)
+                if not isinstance(sub, PDict):
+                    raise TypeError(
+                        "Cannot merge non-dict [%r] with dict [%r]" % (sub, v))
+                items[k] = sub.merge(v)
+            else:
+                items[k] = freeze(v)
+        return self.assoc(items)
+
+    def __copy__(self):
+        return dict(self)
+
+    def __deepcopy__(self, memo):
+        return thaw(self)
+
+    def __reduce__(self):
+        return (self.__class__, (dict(self), ))
+
+    def __repr__(self):
+        return "PDict(%s)" % dict.__repr__(self)
+
+
+empty = PDict()
+
+
+def freeze(v):
+    """
+    Convert dicts (recursively) to PDicts, other values are deep copied
+    """
+    if isinstance(v, PDict):
+        return v
+    if isinstance(v, dict):
+        return PDict(v)
+    return copy.deepcopy(v)
+
+
+def thaw(v):
+    """
+    Convert PDicts (recursively) to (mutable) dicts, other values are
+    deep copied
+    """
+    if isinstance(v, dict):
+        return dict([(k, thaw(sv)) for (k, sv) in v.iteritems()])
+    return copy.deepcopy(v)
+
+
+# ------------------ tests ------------------
+def test_pdict():
+    l = [1, 2]
+    a = PDict({'a': {'b': 1}, 'c': {'d': {'e': 2}}, 'l': l})
+    assert isinstance(a['a'], PDict) and isinstance(a['c']['d'], PDict)
+    assert a['l'] == l and a['l'] is not l
+    for f in (lambda: a.__setitem__('a', 1), lambda: a.__delitem__('a'),
+              lambda: a.update({}), lambda: a.pop('a'),
+              lambda: a['a'].setdefault('x', 1)):
+        try:
+            f()
+            assert False
+        except TypeError:
+            pass
+    b = a.set('a.b', 2)
+    assert a['a']['b'] == 1 and b['a']['b'] == 2
+    assert b['c'] is a['c']
+    assert a.set('a.b', 1) is a
+    c = a.set('x.y.z', 3)
+    assert c['x'] == {'y': {'z': 3}} and isinstance(c['x']['y'], PDict)
+    try:
+        a.set('l.m', 1)
+        assert False
+    except TypeError:
+        pass
+    d = a.remove('c.d.e')
+    assert d['c']['d'] == {} and a['c']['d']['e'] == 2
+    assert d['a'] is a['a']
+    try:
+        a.remove('c.x')
+        assert False
+    except KeyError:
+        pass
+    m = a.merge({'c': {'d': {'f': 3}}, 'g': 4})
+    assert m == {'a': {'b': 1}, 'c': {'d': {'e': 2, 'f': 3}}, 'l': l, 'g': 4}
+    assert m['a'] is a['a']
+    t = copy.deepcopy(m)
+    assert type(t) is dict and type(t['c']['d']) is dict and t == m
+    t['c']['d']['e'] = 5
+    assert m['c']['d']['e'] == 2
+    assert type(copy.copy(m)) is dict
+    import pickle
+    assert pickle.loads(pickle.dumps(m, 2)) == m
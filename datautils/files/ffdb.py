@@ -32,7 +32,7 @@ import logging
 import os
 import re
 
-from ..qfilter.query import qfilter
+from ..qfilter.query import qfilter, iqfilter
 
 
 config_filename = '.ffdb'
@@ -269,6 +269,17 @@ class FFDB(object):
         query.update(kwargs)
         return qfilter(self.data[key], query)
 
+    def iquery(self, key, query=None, limit=None, skip=0, **kwargs):
+        """Lazily query the database (see qfilter.iqfilter)
+
+        Returns an iterator over matching items
+        """
+        if key not in self._config:
+            raise FFDBError("Unknown key %s" % key)
+        query = {} if query is None else query.copy()
+        query.update(kwargs)
+        return iqfilter(self.data[key], query, limit=limit, skip=skip)
+
     def generate_filename(self, key, **kwargs):
         if key not in self._config:
             raise FFDBError("Unknown key %s" % key)
@@ -1,11 +1,15 @@
 #!/usr/bin/env python
 
+from aggregation import aggregate
+import arrays
 from coding import to_codes
+from incremental import IncrementalGrouping
 from utils import group, group2, groupn
 import ops
 from ops import depth, drop_levels, collapse
 from . import display
 
 
-__all__ = ['display', 'to_codes', 'group', 'group2', 'groupn', 'depth', 'drop_levels',
+__all__ = ['aggregate', 'arrays', 'display', 'IncrementalGrouping',
+           'to_codes', 'group', 'group2', 'groupn', 'depth', 'drop_levels',
            'ops', 'collapse']
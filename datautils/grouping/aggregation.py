@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+"""
+Group values and reduce each group (count, mean...) in one step
+
+aggregate does what groupn -> ops.pick -> ops.stat does without making
+lists of the grouped values (or picked copies of them). Documents (a
+list of dicts) are read once, adding each value to a running reduction
+for its group. Arrays (a structured array or dict of arrays, see
+arrays) are sorted by the keys once (see arrays.sort_groups) and reduced
+with numpy (ufunc.reduceat...) for all groups at once.
+
+Reductions are given as a (field, reduction) tuple where reduction is:
+    'count', 'sum', 'mean', 'var', 'std', 'min', 'max', 'first', 'last',
+    'median', ('quantile', q) (with 0 <= q <= 1) or a function that is
+    called with the list (or array) of values in the group
+
+field is a (dotted) key or None (for 'count' the number of documents,
+for functions the documents, or rows of an array, see arrays.take).
+Documents without field are skipped.
+
+Example
+------
+
+r = aggregate(docs, ('subject', 'session'), {
+    'n': (None, 'count'),
+    'rt': ('rt', 'mean'),
+    'rt_q90': ('rt', ('quantile', 0.9))})
+r['rt']['s1'][3]  # mean rt for subject s1, session 3
+aggregate(docs, 'subject', ('rt', 'std'))  # {'s1': std of rt, ...}
+"""
+
+import math
+import operator
+
+try:
+    import numpy
+    has_numpy = True
+except ImportError:
+    has_numpy = False
+
+from .. import ddict
+from arrays import get_column, nest, sort_groups, take
+
+
+reductions = ('count', 'sum', 'mean', 'var', 'std', 'min', 'max',
+              'first', 'last', 'median', 'quantile')
+
+
+class Count(object):
+    __slots__ = ['n']
+
+    def __init__(self):
+        self.n = 0
+
+    def add(self, v):
+        self.n += 1
+
+    def remove(self, v):
+        self.n -= 1
+
+    def result(self):
+        return self.n
+
+
+class Sum(object):
+    __slots__ = ['s']
+
+    def __init__(self):
+        self.s = 0
+
+    def add(self, v):
+        self.s += v
+
+    def remove(self, v):
+        self.s -= v
+
+    def result(self):
+        return self.s
+
+
+class Mean(object):
+    __slots__ = ['n', 's']
+
+    def __init__(self):
+        self.n = 0
+        self.s = 0.
+
+    def add(self, v):
+        self.n += 1
+        self.s += v
+
+    def remove(self, v):
+        self.n -= 1
+        self.s -= v
+
+    def result(self):
+        return self.s / self.n if self.n else None
+
+
+class Var(object):
+    """
+    Running (population) variance with Welford's algorithm
+    """
+    __slots__ = ['n', 'mean', 'm2', 'std']
+
+    def __init__(self, std=False):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+        self.std = std
+
+    def add(self, v):
+        self.n += 1
+        d = v - self.mean
+        self.mean += d / self.n
+        self.m2 += d * (v - self.mean)
+
+    def remove(self, v):
+        """
+        Remove a value that was added (reverse the update in add)
+        """
+        self.n -= 1
+        if not self.n:
+            self.mean = self.m2 = 0.
+            return
+        d = v - self.mean
+        self.mean -= d / self.n
+        self.m2 -= d * (v - self.mean)
+
+    def result(self):
+        if not self.n:
+            return None
+        # removing values can leave a (tiny) negative m2
+        v = max(self.m2, 0.) / self.n
+        return math.sqrt(v) if self.std else v
+
+
+class Min(object):
+    __slots__ = ['v']
+
+    def __init__(self):
+        self.v = None
+
+    def add(self, v):
+        if self.v is None or v < self.v:
+            self.v = v
+
+    def result(self):
+        return self.v
+
+
+class Max(Min):
+    __slots__ = []
+
+    def add(self, v):
+        if self.v is None or v > self.v:
+            self.v = v
+
+
+class First(Min):
+    __slots__ = []
+
+    def add(self, v):
+        if self.v is None:
+            self.v = v
+
+
+class Last(Min):
+    __slots__ = []
+
+    def add(self, v):
+        self.v = v
+
+
+class Values(object):
+    """
+    Keep all values, the result is func(values)
+    """
+    __slots__ = ['values', 'func']
+
+    def __init__(self, func):
+        self.values = []
+        self.func = func
+
+    def add(self, v):
+        self.values.append(v)
+
+    def result(self):
+        return self.func(self.values)
+
+
+def quantile(values, q):
+    """
+    q (0 <= q <= 1) quantile of values (with linear interpolation like
+    numpy.percentile)
+    """
+    if not len(values):
+        return None
+    vs = sorted(values)
+    p = q * (len(vs) - 1)
+    i = int(math.floor(p))
+    if i + 1 >= len(vs):
+        return float(vs[i])
+    return vs[i] + (vs[i + 1] - vs[i]) * (p - i)
+
+
+def parse_reduction(reduction):
+    """
+    Return (name, argument) for a reduction (see module docstring)
+    """
+    if callable(reduction):
+        return ('function', reduction)
+    if isinstance(reduction, (tuple, list)):
+        if len(reduction) != 2 or reduction[0] != 'quantile':
+            raise ValueError("Invalid reduction %r" % (reduction, ))
+        if not 0 <= reduction[1] <= 1:
+            raise ValueError("Invalid quantile %r" % (reduction[1], ))
+        return tuple(reduction)
+    if reduction not in reductions or reduction == 'quantile':
+        raise ValueError("Invalid reduction %r" % (reduction, ))
+    if reduction == 'median':
+        return ('quantile', 0.5)
+    return (reduction, None)
+
+
+def accumulator(name, arg):
+    """
+    Return a function that makes a new accumulator for a reduction
+    """
+    simple = {'count': Count, 'sum': Sum, 'mean': Mean, 'var': Var,
+              'min': Min, 'max': Max, 'first': First, 'last': Last}
+    if name in simple:
+        return simple[name]
+    if name == 'std':
+        return lambda: Var(std=True)
+    if name == 'quantile':
+        return lambda: Values(lambda vs: quantile(vs, arg))
+    return lambda: Values(arg)
+
+
+missing = object()
+
+
+def field_getter(field):
+    """
+    Return a function get(d, default) for a (dotted) field
+    """
+    if field is None:
+        return lambda d, default: d
+    return ddict.ops.key_path(field).tget
+
+
+def key_getter(keys):
+    """
+    Return a function that gets the group key (the value of one key or
+    a tuple of values for several keys) from a document
+    """
+    if all([isinstance(k, (str, unicode)) and '.' not in k for k in keys]):
+        return operator.itemgetter(*keys)
+    gets = [k if callable(k) else ddict.ops.key_path(k).get for k in keys]
+    if len(gets) == 1:
+        return gets[0]
+    return lambda d: tuple([g(d) for g in gets])
+
+
+def aggregate_docs(docs, keys, aggs, levels):
+    """
+    Aggregate a list (or iterable) of documents in one pass, returns
+    group_keys (see arrays.sort_groups) and a list (per agg) of lists
+    (per group) of results
+    """
+    keyf = key_getter(keys)
+    allowed = [None if l is None else set(l) for l in levels]
+    if all([a is None for a in allowed]):
+        allowed = None
+    getters = [field_getter(f) for (f, _) in aggs]
+    makes = [accumulator(*parse_reduction(r)) for (_, r) in aggs]
+    groups = {}
+    adds = {}
+    for d in docs:
+        gk = keyf(d)
+        gadds = adds.get(gk, None)
+        if gadds is None:
+            if allowed is not None and any([
+                    (a is not None) and (k not in a) for (k, a) in
+                    zip((gk, ) if len(keys) == 1 else gk, allowed)]):
+                continue
+            accs = groups[gk] = [make() for make in makes]
+            gadds = adds[gk] = [
+                (get, acc.add) for (get, acc) in zip(getters, accs)]
+        for (get, add) in gadds:
+            v = get(d, missing)
+            if v is not missing:
+                add(v)
+    gks = groups.keys()
+    if len(keys) == 1:
+        group_keys = [gks]
+    else:
+        group_keys = [[gk[i] for gk in gks] for i in xrange(len(keys))]
+    results = [[groups[gk][i].result() for gk in gks]
+               for i in xrange(len(aggs))]
+    return group_keys, results
+
+
+def reduce_array(v, starts, counts, name, arg):
+    """
+    Reduce each group of v (sorted by group, see arrays.sort_groups)
+    returning a list of results (one per group)
+    """
+    stops = starts + counts
+    if name == 'count':
+        return counts.tolist()
+    if name == 'sum':
+        return numpy.add.reduceat(v, starts).tolist()
+    if name == 'min':
+        return numpy.minimum.reduceat(v, starts).tolist()
+    if name == 'max':
+        return numpy.maximum.reduceat(v, starts).tolist()
+    if name == 'first':
+        return v.take(starts).tolist()
+    if name == 'last':
+        return v.take(stops - 1).tolist()
+    if name == 'function':
+        return [arg(v[s:e]) for (s, e) in zip(starts, stops)]
+    gid = numpy.repeat(numpy.arange(len(starts)), counts)
+    if name == 'quantile':
+        # sort values within each group and interpolate
+        vs = v.take(numpy.lexsort((v, gid)))
+        p = starts + arg * (counts - 1)
+        lo = numpy.floor(p).astype(int)
+        hi = numpy.minimum(lo + 1, stops - 1)
+        vlo = vs.take(lo).astype('f8')
+        return (vlo + (vs.take(hi) - vlo) * (p - lo)).tolist()
+    mean = numpy.add.reduceat(v, starts) / counts.astype('f8')
+    if name == 'mean':
+        return mean.tolist()
+    d = v - mean.take(gid)
+    var = numpy.add.reduceat(d * d, starts) / counts
+    if name == 'var':
+        return var.tolist()
+    return numpy.sqrt(var).tolist()
+
+
+def aggregate_array(data, keys, aggs, levels):
+    """
+    Aggregate a structured array (or dict of arrays), returns the
+    same as aggregate_docs
+    """
+    order, starts, group_keys = sort_groups(data, keys, levels)
+    if not len(order):
+        return group_keys, [[] for _ in aggs]
+    counts = numpy.diff(numpy.append(starts, len(order)))
+    columns = {}
+    results = []
+    for (f, r) in aggs:
+        name, arg = parse_reduction(r)
+        if f is None:
+            if name not in ('count', 'function'):
+                raise ValueError("%s requires a field" % name)
+            if name == 'function':
+                # functions are called with the rows of each group
+                results.append([
+                    arg(take(data, order[s:s + c])) for (s, c) in
+                    zip(starts.tolist(), counts.tolist())])
+                continue
+            v = order
+        else:
+            if f not in columns:
+                columns[f] = get_column(data, f).take(order)
+            v = columns[f]
+        results.append(reduce_array(v, starts, counts, name, arg))
+    return group_keys, results
+
+
+def aggregate(values, keys, aggs, levels=None):
+    """
+    Group values by keys and reduce each group (see module docstring)
+
+    values : list of dicts, structured array or dict of arrays
+        values to group
+    keys : str, function or list of these
+        (dotted) keys to group by (one grouping level per key), for
+        arrays keys must be field names
+    aggs : tuple, list or dict
+        a (field, reduction) tuple (or list) or a dict of
+        name: (field, reduction)
+    levels : list (default=None)
+        per key, None (a group for each value) or a list of values to
+        group (other values are dropped)
+
+    Returns a grouping (nested dict, see groupn) with leaves of
+    reduction results or (if aggs is a dict) a dict of name: grouping
+    """
+    if isinstance(keys, (str, unicode)) or callable(keys):
+        keys = [keys]
+    if levels is None:
+        levels = [None] * len(keys)
+    if len(levels) != len(keys):
+        raise ValueError(
+            "levels [%i] must match keys [%i]" % (len(levels), len(keys)))
+    single = isinstance(aggs, (tuple, list))
+    names = [None] if single else aggs.keys()
+    specs = [aggs] if single else [aggs[n] for n in names]
+    if has_numpy and isinstance(values, (numpy.ndarray, dict)):
+        group_keys, results = aggregate_array(values, keys, specs, levels)
+    else:
+        group_keys, results = aggregate_docs(values, keys, specs, levels)
+    gs = [nest(group_keys, r) for r in results]
+    if single:
+        return gs[0]
+    return dict(zip(names, gs))
+
+
+# ------------------ tests ------------------
+def test_aggregate():
+    import ops
+    from utils import groupn
+    docs = [
+        {'s': 'a', 'n': 1, 'v': {'x': 1.}},
+        {'s': 'b', 'n': 1, 'v': {'x': 2.}},
+        {'s': 'a', 'n': 2, 'v': {'x': 3.}},
+        {'s': 'a', 'n': 1, 'v': {'x': 4.}},
+        {'s': 'b', 'n': 1, 'v': {'x': 8.}},
+        {'s': 'b', 'n': 1},
+    ]
+    a = numpy.zeros(5, dtype=[('s', 'S1'), ('n', 'i8'), ('v', [('x', 'f8')])])
+    for (i, d) in enumerate(docs[:5]):
+        a[i] = (d['s'], d['n'], (d['v']['x'], ))
+    g = groupn(docs[:5], ('s', 'n'))
+    funcs = {
+        'sum': sum,
+        'mean': numpy.mean,
+        'var': numpy.var,
+        'std': numpy.std,
+        'min': min,
+        'max': max,
+        'first': lambda vs: vs[0],
+        'last': lambda vs: vs[-1],
+        'median': numpy.median,
+        ('quantile', 0.25): lambda vs: numpy.percentile(vs, 25),
+    }
+    for data in (docs, a, {'s': a['s'], 'n': a['n'], 'v': {'x': a['v']['x']}}):
+        for (r, f) in funcs.iteritems():
+            agg = aggregate(data, ('s', 'n'), ('v.x', r))
+            expected = ops.stat(g, f, 'v.x')
+            for s in expected:
+                for n in expected[s]:
+                    assert abs(agg[s][n] - expected[s][n]) < 1e-9
+        r = aggregate(data, 's', {'n': (None, 'count'), 'x': ('v.x', 'count'),
+                                  'f': ('v.x', lambda vs: len(vs))})
+        if data is docs:
+            assert r['n'] == {'a': 3, 'b': 3}
+        else:
+            assert r['n'] == {'a': 3, 'b': 2}
+        assert r['x'] == r['f'] == {'a': 3, 'b': 2}
+        r = aggregate(data, ('s', 'n'), ('v.x', 'sum'), levels=(['b'], None))
+        assert r == {'b': {1: 10.}}
+        assert aggregate(data, 's', ('v.x', 'sum'), levels=(['c'], )) == {}
+    assert aggregate([], 's', ('v', 'sum')) == {}
+    # functions without a field get the documents (or rows) of a group
+    # (a dict of arrays for a dict of arrays)
+    ns = lambda rows: sorted([r['n'] for r in rows])
+    for (data, f) in ((docs[:5], ns), (a, ns),
+                      ({'s': a['s'], 'n': a['n']},
+                       lambda rows: sorted(rows['n'].tolist()))):
+        assert aggregate(data, 's', (None, f)) == {'a': [1, 1, 2],
+                                                   'b': [1, 1]}
+        assert aggregate(data, 's', ['n', 'max']) == {'a': 2, 'b': 1}
+    assert aggregate(docs, lambda d: d['n'] > 1, ('v.x', 'max')) == \
+        {False: 8., True: 3.}
+    for bad in ('bad', ('quantile', 2), ('quantile', )):
+        try:
+            aggregate(docs, 's', ('v', bad))
+            assert False
+        except ValueError:
+            pass
+    try:
+        aggregate(a, 's', (None, 'sum'))
+        assert False
+    except ValueError:
+        pass
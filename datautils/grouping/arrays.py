@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+"""
+Group the rows of arrays by sorting (rather than one value at a time)
+
+data is a numpy structured array or a dict of (equal length) arrays
+(columns) and keys are (dotted) field names. Rows are sorted by all keys
+at once (one sort) and the groups are the runs of equal keys in the
+sorted rows. Leaves of the returned grouping are index arrays into data
+(views of the one sort order, not copies) or slices if data was already
+sorted by the keys.
+
+Example
+------
+
+g = group_inds(a, ('subject', 'session'))
+g['s1'][3]  # indices of rows where subject == 's1' and session == 3
+a[g['s1'][3]]  # rows for subject 's1', session 3
+take(a, g, 'rt')  # same grouping with leaves of 'rt' values
+"""
+
+try:
+    import numpy
+    has_numpy = True
+except ImportError:
+    has_numpy = False
+
+from .. import ddict
+from coding import CategoricalCodec
+
+
+def get_column(data, key):
+    """
+    Get a (dotted) field of a structured array or dict of arrays
+    """
+    for k in ddict.ops.key_path(key).keys:
+        data = data[k]
+    return numpy.asarray(data)
+
+
+def column_codes(c):
+    """
+    Return (codes, n) int codes (that sort like the values, NaNs are
+    equal) for a column and the number of possible codes
+    """
+    if c.dtype.kind in 'biu':
+        c = c.astype('i8')
+        lo = c.min()
+        return c - lo, int(c.max()) - int(lo) + 1
+    u, codes = numpy.unique(c, return_inverse=True)
+    if c.dtype.kind in 'fc':
+        # numpy.unique doesn't merge NaNs (which sort last)
+        nans = numpy.flatnonzero(u != u)
+        if len(nans):
+            numpy.minimum(codes, nans[0], out=codes)
+            return codes, int(nans[0]) + 1
+    return codes, len(u)
+
+
+def sort_rows(columns):
+    """
+    Return (order, change) where order sorts rows by columns (the first
+    column is the primary sort key) and change is True where a sorted
+    row differs from the previous row
+    """
+    codes = [column_codes(c) for c in columns]
+    size = reduce(lambda a, b: a * b, [n for (_, n) in codes], 1)
+    if size < 2 ** 62:
+        # combine columns into one key, so only one sort
+        key = codes[0][0]
+        for (c, n) in codes[1:]:
+            key = key * n + c
+        bits = len(key).bit_length()
+        if (size << bits) < 2 ** 63:
+            # put the row index in the low bits of the key, so sorting
+            # the keys (faster than a stable argsort) gives the order
+            key <<= bits
+            key |= numpy.arange(len(key))
+            key.sort()
+            order = key & ((1 << bits) - 1)
+            key >>= bits
+        else:
+            order = numpy.argsort(key, kind='mergesort')
+            key = key.take(order)
+        return order, key[1:] != key[:-1]
+    order = numpy.lexsort([c for (c, _) in codes][::-1])
+    change = numpy.zeros(len(order) - 1, dtype=bool)
+    for (c, _) in codes:
+        c = c.take(order)
+        change |= c[1:] != c[:-1]
+    return order, change
+
+
+def sort_groups(data, keys, levels=None):
+    """
+    Sort the rows of data (a structured array or dict of arrays) by
+    keys (see group_inds), returning:
+        order : indices of (kept) rows in sorted order
+        starts : index (in order) of the first row of each group
+        group_keys : list (one per key) of lists of group key values
+    """
+    if isinstance(keys, (str, unicode)):
+        keys = [keys]
+    if levels is None:
+        levels = [None] * len(keys)
+    if len(levels) != len(keys):
+        raise ValueError(
+            "levels [%i] must match keys [%i]" % (len(levels), len(keys)))
+    columns = []
+    codecs = []
+    keep = None
+    for (k, l) in zip(keys, levels):
+        c = get_column(data, k)
+        if l is not None:
+            # sort by the position of each value in levels
+            codecs.append(CategoricalCodec(l))
+            c = codecs[-1].index(c, -1)
+            keep = (c != -1) if keep is None else (keep & (c != -1))
+        else:
+            codecs.append(None)
+        columns.append(c)
+    rows = None
+    if keep is not None:
+        # drop rows not in levels
+        rows = numpy.flatnonzero(keep)
+        columns = [c.take(rows) for c in columns]
+    if not len(columns[0]):
+        return (numpy.zeros(0, dtype=int), numpy.zeros(0, dtype=int),
+                [[] for _ in keys])
+    order, change = sort_rows(columns)
+    if rows is not None:
+        columns = [c.take(order) for c in columns]
+        order = rows.take(order)
+    starts = numpy.concatenate(([0], numpy.flatnonzero(change) + 1))
+    # the key values of each group (from the first row in each group)
+    first = starts if rows is not None else order.take(starts)
+    group_keys = []
+    for (c, cd) in zip(columns, codecs):
+        gk = c.take(first)
+        if cd is not None:
+            gk = cd.decode(gk)
+        group_keys.append(gk.tolist())
+    return order, starts, group_keys
+
+
+def nest(group_keys, leaves):
+    """
+    Make a nested dict (one level per list in group_keys) with one leaf
+    per group
+    """
+    g = {}
+    last = group_keys[-1]
+    for (i, leaf) in enumerate(leaves):
+        d = g
+        for gk in group_keys[:-1]:
+            d = d.setdefault(gk[i], {})
+        d[last[i]] = leaf
+    return g
+
+
+def group_inds(data, keys, levels=None, slices=True):
+    """
+    Group the rows of data (a structured array or dict of arrays) by
+    keys (see module docstring)
+
+    keys : str or list of str
+        (dotted) field names to group by, one grouping level per key
+    levels : list (default=None)
+        per key, None (group by each unique value) or a list of values,
+        rows with other values are dropped
+    slices : bool (default=True)
+        if data is already sorted by keys, leaves are slices
+
+    Returns a nested dict (one level per key) with leaves of index
+    arrays (or slices) into data
+    """
+    order, starts, group_keys = sort_groups(data, keys, levels)
+    if not len(order):
+        return {}
+    stops = numpy.concatenate((starts[1:], [len(order)])).tolist()
+    starts = starts.tolist()
+    # sorted (and no rows dropped)
+    if slices and (order[-1] - order[0] == len(order) - 1) and \
+            bool(numpy.all(order[1:] > order[:-1])):
+        o = int(order[0])
+        leaves = [slice(o + s, o + e) for (s, e) in zip(starts, stops)]
+    else:
+        leaves = [order[s:e] for (s, e) in zip(starts, stops)]
+    return nest(group_keys, leaves)
+
+
+def take(data, g, key=None):
+    """
+    Replace the leaves (index arrays or slices) of grouping g with the
+    rows of data (or a (dotted) field of data if key is provided)
+    """
+    if key is not None:
+        data = get_column(data, key)
+    if isinstance(g, dict):
+        return dict([(k, take(data, v)) for (k, v) in g.iteritems()])
+    if isinstance(data, dict):
+        return dict([(k, take(v, g)) for (k, v) in data.iteritems()])
+    return data[g]
+
+
+# ------------------ tests ------------------
+def test_group_inds():
+    a = numpy.zeros(6, dtype=[('s', 'S2'), ('n', [('i', 'i4')]),
+                              ('f', 'f8')])
+    a['s'] = ['b', 'a', 'b', 'a', 'b', 'c']
+    a['n']['i'] = [2, 1, 1, 1, 2, 3]
+    a['f'] = [0., 1., 2., 3., numpy.nan, numpy.nan]
+    g = group_inds(a, 's')
+    assert sorted(g.keys()) == ['a', 'b', 'c']
+    assert g['a'].tolist() == [1, 3] and g['b'].tolist() == [0, 2, 4]
+    g = group_inds(a, ('s', 'n.i'))
+    assert g['b'][2].tolist() == [0, 4] and g['b'][1].tolist() == [2]
+    assert g['a'].keys() == [1] and g['a'][1].tolist() == [1, 3]
+    # same as groupn of the rows
+    from utils import groupn
+    rows = [dict(s=r['s'], i=r['n']['i']) for r in a]
+    gl = groupn(rows, ('s', 'i'))
+    for s in gl:
+        for i in gl[s]:
+            assert [rows[j] for j in g[s][i]] == gl[s][i]
+    gi = groupn(a, ('s', 'n.i'), inds=True)
+    assert gi.keys() == g.keys() and gi['b'][2].tolist() == [0, 4]
+    # levels for one key (a list or dict) or per key
+    from discrete import level_test
+    for levels in (['a', 'c'], [['a', 'c']], {'a': level_test('a'),
+                                              'c': level_test('c')}):
+        gi = groupn(a, 's', levels=levels, inds=True)
+        assert sorted(gi.keys()) == ['a', 'c']
+    gi = groupn(a, ('s', 'n.i'), levels=[None, {2: level_test(2)}],
+                inds=True)
+    assert gi == {'b': {2: gi['b'][2]}} and gi['b'][2].tolist() == [0, 4]
+    for levels in (['a', 'b'], [{'x': level_test('a')}, None]):
+        try:
+            groupn(a, ('s', 'n.i'), levels=levels, inds=True)
+            assert False
+        except ValueError:
+            pass
+    try:
+        groupn(a, ('s', 'f'), gtypes=('d', 'c'), inds=True)
+        assert False
+    except ValueError:
+        pass
+    # NaNs are grouped together
+    g = group_inds(a, 'f', slices=False)
+    assert len(g) == 5 and sorted(map(len, g.values())) == [1, 1, 1, 1, 2]
+    # levels
+    g = group_inds(a, ('s', 'n.i'), levels=(['b', 'c'], None))
+    assert sorted(g.keys()) == ['b', 'c']
+    assert g['b'][2].tolist() == [0, 4] and g['c'][3].tolist() == [5]
+    assert group_inds(a, 's', levels=(['x'], )) == {}
+    s = numpy.sort(a, order=['s'])
+    g = group_inds(s, 's', levels=(['a', 'c'], ))
+    assert g['a'].tolist() == [0, 1] and g['c'].tolist() == [5]
+    # sorted data gives slices
+    g = group_inds(s, 's')
+    assert g['a'] == slice(0, 2) and g['c'] == slice(5, 6)
+    assert isinstance(group_inds(s, 's', slices=False)['a'], numpy.ndarray)
+    # dict of arrays
+    d = {'x': {'y': numpy.array([1, 2, 1])}, 'z': numpy.array([4., 5., 6.])}
+    g = group_inds(d, 'x.y')
+    assert g[1].tolist() == [0, 2]
+    t = take(d, g, 'z')
+    assert t[1].tolist() == [4., 6.] and t[2].tolist() == [5.]
+    assert take(d, g)[2]['x']['y'].tolist() == [2]
+    assert group_inds({'x': numpy.array([])}, 'x') == {}
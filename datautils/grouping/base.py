@@ -18,10 +18,11 @@ class Group(object):
         # TODO fix key
         for v in values:
             tv = v if key is None else key(v)
+            # values are added to every level they match (levels can
+            # overlap, see ContinuousGroup)
             for n, f in self.levels.iteritems():
                 if f(tv):
                     r[n].append(v)
-                    continue
         return r
 
     __call__ = group
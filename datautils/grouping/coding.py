@@ -1,18 +1,297 @@
 #!/usr/bin/env python
+"""
+Codecs convert values to 'codes' (numbers used for plotting, grouping...)
+
+CategoricalCodec is a numpy codec for discrete values (strings, ints...)
+that can be fit incrementally (chunk by chunk) and applied to whole
+arrays at once (numbers are found with searchsorted, strings with a
+dict lookup, codes with take). Codes of fit categories never change
+when more categories are fit and codecs can be saved (to_dict, json...)
+and loaded (from_dict) so codes stay the same across processes and
+runs.
+
+Example
+------
+
+codec = CategoricalCodec()
+for chunk in chunks:
+    codec.fit(chunk)
+codes = codec(values)  # int codes, codec.categories[codes] == values
+s = json.dumps(codec.to_dict())
+codec = CategoricalCodec.from_dict(json.loads(s))
+"""
+
+import itertools
+
+try:
+    import numpy
+    has_numpy = True
+except ImportError:
+    has_numpy = False
 
 
 class DiscreteCodec:
     def __init__(self, mapping=None):
         self.mapping = {} if mapping is None else mapping
 
-    def __call__(self, value):
+    def __call__(self, value, out=None):
+        if has_numpy and isinstance(value, (list, numpy.ndarray)):
+            return self.code_all(value, out)
         return self.mapping[value]
 
+    def code_all(self, values, out=None):
+        """
+        Code a list (or array) of values, all at once if values, mapping
+        keys and codes are scalars of one type (see scalar_array)
+        otherwise one value at a time (returning a list)
+        """
+        a = scalar_array(values)
+        keys = scalar_array(self.mapping.keys())
+        codes = scalar_array(self.mapping.values())
+        if a is not None and keys is not None and codes is not None and \
+                (a.dtype.kind in 'SU') == (keys.dtype.kind in 'SU'):
+            codec = CategoricalCodec(keys)
+            return numpy.take(codes, codec.index(values), out=out)
+        codes = [self.mapping[v] for v in values]
+        if out is None:
+            return codes
+        out[...] = codes
+        return out
+
     def __repr__(self):
         return "DiscreteCodec[%s]" % self.mapping
 
 
+def scalar_array(values):
+    """
+    Return values as a 1d array of numbers or strings, or None if values
+    can't be coded as an array (mixed strings and numbers, tuples...)
+    """
+    if not has_numpy:
+        return None
+    a = numpy.asarray(values)
+    if a.ndim != 1 or a.dtype.kind not in 'biufSU':
+        return None
+    if a.dtype.kind in 'SU' and not isinstance(values, numpy.ndarray):
+        # numpy converts numbers mixed with strings to strings
+        if not all([isinstance(v, basestring) for v in values]):
+            return None
+    return a
+
+
+def merge_nans(values):
+    """
+    Remove all but the first NaN from a 1d array (so NaN is one
+    category)
+    """
+    if values.dtype.kind not in 'fc':
+        return values
+    nans = numpy.flatnonzero(values != values)
+    if len(nans) < 2:
+        return values
+    return numpy.delete(values, nans[1:])
+
+
+class CategoricalCodec(object):
+    """
+    A numpy codec for discrete values (see module docstring)
+
+    categories : array like
+        values to code, the code of categories[i] is i
+    code_range : 2 tuple (default=None)
+        if provided, codes are spread evenly between code_range[0]
+        (for categories[0]) and code_range[1] (for categories[-1])
+        otherwise codes are ints
+    """
+    def __init__(self, categories=None, code_range=None):
+        self.code_range = code_range
+        if categories is None:
+            categories = []
+        self.categories = merge_nans(numpy.asarray(categories))
+        if self.categories.ndim != 1:
+            raise ValueError(
+                "Categories must be 1d not %s" % (self.categories.shape, ))
+        if len(numpy.unique(self.categories)) != len(self.categories):
+            raise ValueError("Categories must be unique")
+        self._index()
+
+    def _index(self):
+        if self.categories.dtype.kind in 'SUO':
+            # strings are faster to look up in a dict than to search
+            self._table = dict(
+                zip(self.categories.tolist(), xrange(len(self.categories))))
+        else:
+            self._table = None
+            self._order = numpy.argsort(self.categories, kind='mergesort')
+            self._sorted = self.categories[self._order]
+        if self.code_range is None:
+            self.codes = None
+        elif len(self.categories) == 1:
+            self.codes = numpy.array([float(self.code_range[0])])
+        else:
+            self.codes = numpy.linspace(
+                self.code_range[0], self.code_range[1], len(self.categories))
+
+    def __len__(self):
+        return len(self.categories)
+
+    def fit(self, values):
+        """
+        Add new (unique) values to categories, new categories are sorted
+        and given codes after all existing categories. Returns self so
+        codec = CategoricalCodec().fit(values) works.
+        """
+        values = numpy.asarray(values)
+        if self._table is not None or (
+                not len(self.categories) and values.dtype.kind in 'SUO'):
+            new = set(values.ravel().tolist())
+            if self._table is not None:
+                new.difference_update(self._table)
+            new = numpy.array(sorted(new), dtype=values.dtype)
+        else:
+            new = merge_nans(numpy.unique(values))
+            if len(self.categories):
+                new = new[~self.contains(new)]
+        if not len(new):
+            return self
+        if len(self.categories):
+            new = numpy.concatenate((self.categories, new))
+        self.categories = new
+        self._index()
+        return self
+
+    def _lookup(self, values):
+        """
+        Return (code, found) arrays (the shape of values), codes of
+        values not in categories are -1
+        """
+        if self._table is not None:
+            if isinstance(values, list):
+                flat, shape = values, (len(values), )
+            else:
+                values = numpy.asarray(values)
+                flat, shape = values.ravel().tolist(), values.shape
+            codes = numpy.fromiter(
+                itertools.imap(self._table.get, flat, itertools.repeat(-1)),
+                int, len(flat)).reshape(shape)
+            return codes, codes != -1
+        values = numpy.asarray(values)
+        if not len(self._sorted):
+            return (numpy.zeros(values.shape, dtype=int) - 1,
+                    numpy.zeros(values.shape, dtype=bool))
+        i = numpy.asarray(numpy.searchsorted(self._sorted, values))
+        numpy.minimum(i, len(self._sorted) - 1, out=i)
+        s = self._sorted.take(i)
+        found = numpy.asarray(s == values)
+        if s.dtype.kind in 'fc':
+            # NaN (which sorts last) is a category
+            found |= (s != s) & numpy.asarray(values != values)
+        codes = numpy.asarray(self._order.take(i))
+        codes[~found] = -1
+        return codes, found
+
+    def contains(self, values):
+        """
+        Return a boolean array, True where values are in categories
+        """
+        return self._lookup(values)[1]
+
+    def index(self, values, default=None):
+        """
+        Return the int code (index in categories) for each value.
+        Values not in categories raise a KeyError unless default
+        is provided (which is used as their code).
+        """
+        codes, found = self._lookup(values)
+        if not numpy.all(found):
+            if default is None:
+                raise KeyError(numpy.asarray(values)[~found].flat[0])
+            codes[~found] = default
+        return codes[()] if codes.ndim == 0 else codes
+
+    def __call__(self, values, default=None, out=None):
+        """
+        Code values (a single value or array like) optionally storing
+        codes in out (an array the shape of values). See index for
+        default.
+        """
+        if self.codes is None:
+            codes = self.index(values, default)
+            if out is None:
+                return codes
+            out[...] = codes
+            return out
+        if default is None:
+            return numpy.take(self.codes, self.index(values), out=out)
+        i = self.index(values, -1)
+        codes = numpy.take(self.codes, i, out=out)
+        if numpy.ndim(codes) == 0:
+            return default if i == -1 else codes
+        codes[i == -1] = default
+        return codes
+
+    def decode(self, codes):
+        """
+        Convert int codes back to values
+        """
+        return self.categories.take(codes)
+
+    def to_dict(self):
+        """
+        Return a (json serializable) dict that from_dict can use to
+        remake this codec
+        """
+        d = {'categories': self.categories.tolist(),
+             'dtype': self.categories.dtype.str}
+        if self.code_range is not None:
+            d['code_range'] = list(self.code_range)
+        return d
+
+    @classmethod
+    def from_dict(cls, d):
+        code_range = d.get('code_range', None)
+        return cls(
+            numpy.array(d['categories'], dtype=d.get('dtype', None)),
+            None if code_range is None else tuple(code_range))
+
+    def __reduce__(self):
+        return (self.__class__, (self.categories, self.code_range))
+
+    def __repr__(self):
+        return "CategoricalCodec[%i categories->codes%s]" % (
+            len(self.categories),
+            '' if self.code_range is None else '(%g,%g)' % self.code_range)
+
+
+def value_range(values, chunksize=65536):
+    """
+    Return (min, max) of values ignoring NaNs (or None if all values
+    are NaN). Arrays are read in chunks (small enough to stay in cache)
+    so min and max are found in a single pass through memory.
+    """
+    if not has_numpy:
+        values = [v for v in values if v == v]
+        return (min(values), max(values)) if len(values) else None
+    values = numpy.asarray(values).ravel()
+    lo = hi = numpy.nan
+    for s in xrange(0, len(values), chunksize):
+        chunk = values[s:s + chunksize]
+        # fmin/fmax ignore NaNs
+        lo = numpy.fmin(lo, numpy.fmin.reduce(chunk))
+        hi = numpy.fmax(hi, numpy.fmax.reduce(chunk))
+    if lo != lo:
+        return None
+    return (lo.item(), hi.item())
+
+
 class ContinuousCodec:
+    """
+    Linearly map values in value_domain to codes in code_range
+
+    Arrays are coded at once (optionally into an out array) and NaNs
+    are coded as NaN. The value_domain can be found from values (auto)
+    or grown chunk by chunk (fit).
+    """
     def __init__(self, code_range=(0, 1.), value_domain=None, values=None):
         self.code_range = code_range
         self.value_domain = value_domain
@@ -21,27 +300,72 @@ class ContinuousCodec:
         else:
             self.build_transfer_function()
 
-    def __call__(self, value):
-        raise Exception("Attempt to use incomplete codec: %r" % self)
+    def __call__(self, values, out=None):
+        if self.value_domain is None:
+            raise Exception("Attempt to use incomplete codec: %r" % self)
+        vm, vr, cr, cm = self._transfer
+        if has_numpy and isinstance(values, (list, numpy.ndarray)):
+            out = numpy.subtract(values, vm, out=out)
+            if vr != 1.:
+                numpy.divide(out, vr, out=out)
+            if cr != 1.:
+                numpy.multiply(out, cr, out=out)
+            if cm != 0.:
+                numpy.add(out, cm, out=out)
+            return out
+        return (values - vm) / vr * cr + cm
 
-    def auto(self, values):
-        self.value_domain = (min(values), max(values))
+    def fit(self, values):
+        """
+        Grow value_domain to include values (so a domain can be found
+        chunk by chunk), returns self
+        """
+        r = value_range(values)
+        if r is None:
+            return self
+        if self.value_domain is not None:
+            r = (min(r[0], self.value_domain[0]),
+                 max(r[1], self.value_domain[1]))
+        self.value_domain = r
         self.build_transfer_function()
+        return self
+
+    def auto(self, values):
+        self.value_domain = None
+        return self.fit(values)
 
     def build_transfer_function(self):
+        if self.value_domain is None:
+            return
         cm = self.code_range[0]
         cr = self.code_range[1] - cm
         vm = float(self.value_domain[0])
         vr = self.value_domain[1] - vm
-        self.__call__ = lambda v: (v - vm) / vr * cr + cm
+        if vr == 0:
+            # all values are coded as code_range[0]
+            vr, cr = 1., 0.
+        self._transfer = (vm, vr, cr, cm)
 
     def __repr__(self):
+        if self.value_domain is None:
+            return "ContinuousCodec[->codes(%g,%g)]" % self.code_range
         return "ContinuousCodec[values(%g,%g)->codes(%g,%g)]" % \
-                (self.value_domain + self.code_range)
+                (tuple(self.value_domain) + tuple(self.code_range))
+
+
+def like(values, codes):
+    """
+    Return codes as a list unless values is an array
+    """
+    if isinstance(values, numpy.ndarray) or isinstance(codes, list):
+        return codes
+    return codes.tolist()
 
 
 def discrete_to_codes_from_codec(values, codec):
     codec = DiscreteCodec(codec) if isinstance(codec, dict) else codec
+    if has_numpy and isinstance(codec, (DiscreteCodec, CategoricalCodec)):
+        return like(values, codec(values)), codec
     return [codec(v) for v in values], codec
 
 
@@ -52,6 +376,12 @@ def discrete_to_codes_from_auto_codec(values, code_min, code_max):
 
 def discrete_to_codes_from_auto_sorted_codec(values, \
         code_min, code_max, sort_codec):
+    if scalar_array(values) is not None:
+        codec = CategoricalCodec(code_range=(code_min, code_max)).fit(values)
+        if sort_codec is not sorted:
+            codec = CategoricalCodec(
+                sort_codec(codec.categories.tolist()), (code_min, code_max))
+        return like(values, codec(values)), codec
     codec = {}
     for v in values:
         codec[v] = 1
@@ -74,8 +404,11 @@ def discrete_to_codes(values, code_min=0., code_max=1., \
 
 
 def continuous_to_codes(values, code_min, code_max, codec):
-    cc = ContinuousCodec((code_min, code_max), values=values)
-    return [cc(v) for v in values], cc
+    if codec is None:
+        codec = ContinuousCodec((code_min, code_max), values=values)
+    if has_numpy:
+        return like(values, codec(numpy.asarray(values, dtype='f8'))), codec
+    return [codec(v) for v in values], codec
 
 
 def to_codes(values, type='auto', min=0., max=1., codec=None, \
@@ -83,7 +416,11 @@ def to_codes(values, type='auto', min=0., max=1., codec=None, \
     if not len(values):
         return [], None
     if type == 'auto':
-        type = 'continuous' if isinstance(values[0], float) else 'discrete'
+        if has_numpy and isinstance(values, numpy.ndarray):
+            float_values = values.dtype.kind == 'f'
+        else:
+            float_values = isinstance(values[0], float)
+        type = 'continuous' if float_values else 'discrete'
     if type == 'continuous':
         codes, codec = continuous_to_codes(values, min, max, codec)
     else:
@@ -91,3 +428,108 @@ def to_codes(values, type='auto', min=0., max=1., codec=None, \
     if return_codec:
         return codes, codec
     return codes
+
+
+# ------------------ tests ------------------
+def test_categorical_codec():
+    import json
+    import pickle
+    c = CategoricalCodec()
+    assert len(c) == 0 and not numpy.any(c.contains(['a']))
+    c.fit(['b', 'a', 'b'])
+    assert c.categories.tolist() == ['a', 'b']
+    c.fit(numpy.array(['c', 'aa', 'a']))
+    # existing codes don't change, new categories are appended
+    assert c.categories.tolist() == ['a', 'b', 'aa', 'c']
+    values = numpy.array(['c', 'a', 'aa', 'b', 'c'])
+    codes = c(values)
+    assert codes.tolist() == [3, 0, 2, 1, 3]
+    assert numpy.all(c.decode(codes) == values)
+    assert c('aa') == 2
+    out = numpy.zeros(5, dtype='i8')
+    assert c(values, out=out) is out and numpy.all(out == codes)
+    try:
+        c(['a', 'x'])
+        assert False
+    except KeyError:
+        pass
+    assert c(['x', 'b'], default=-1).tolist() == [-1, 1]
+    assert c('x', default=-1) == -1
+    for c2 in (CategoricalCodec.from_dict(json.loads(json.dumps(c.to_dict()))),
+               pickle.loads(pickle.dumps(c))):
+        assert numpy.all(c2(values) == codes)
+    r = CategoricalCodec([3, 1, 2], code_range=(0., 1.))
+    assert r([1, 3, 2]).tolist() == [0.5, 0., 1.]
+    assert r([1, 4], default=-1.).tolist() == [0.5, -1.]
+    assert CategoricalCodec([1], code_range=(0., 1.))(1) == 0.
+    # NaN is one category
+    nan = numpy.nan
+    c = CategoricalCodec([1., nan, nan, 0.])
+    assert len(c) == 3 and c([nan, 0., 1.]).tolist() == [1, 2, 0]
+    c = CategoricalCodec().fit([2., nan, 1., nan]).fit([nan, 3.])
+    assert len(c) == 4 and numpy.isnan(c.categories[2])
+    assert c(numpy.array([nan, 3., 1.])).tolist() == [2, 3, 0]
+    assert c(nan) == 2
+    codes = to_codes([2., nan, 1., nan], type='discrete')
+    assert codes == [0.5, 1., 0., 1.]
+    for bad in ([[1, 2]], [1, 1]):
+        try:
+            CategoricalCodec(bad)
+            assert False
+        except ValueError:
+            pass
+
+
+def test_to_codes():
+    assert to_codes(['b', 'a', 'c', 'a']) == [0.5, 0., 1., 0.]
+    codes, codec = to_codes(
+        numpy.array([2, 1, 1]), return_codec=True, sort_codec=False)
+    assert isinstance(codec, CategoricalCodec)
+    assert numpy.all(codes == [1., 0., 0.])
+    assert to_codes(['a', 'b'], sort_codec=lambda v: v[::-1]) == [1., 0.]
+    assert to_codes(['a', 'b', 'a'], codec={'a': 2, 'b': 1}) == [2, 1, 2]
+    assert to_codes([1, 2], codec=codec) == [0., 1.]
+    assert DiscreteCodec({'a': 1})('a') == 1
+    assert DiscreteCodec({'a': 1, 'b': 2})(['b', 'a']).tolist() == [2, 1]
+    # mixed types, tuple values and tuple codes are coded one at a time
+    assert to_codes([1, 'a', 1]) == [0., 1., 0.]
+    assert to_codes([(1, 2), (0, 1), (1, 2)]) == [1., 0., 1.]
+    assert to_codes([1, 'a'], codec={1: 'red', 'a': 'blue'}) == \
+        ['red', 'blue']
+    assert to_codes(['x', 'y'], codec={'x': (1, 0, 0), 'y': (0, 1, 0)}) == \
+        [(1, 0, 0), (0, 1, 0)]
+    assert to_codes(['1', 2], codec={'1': 1, 2: 2}) == [1, 2]
+    assert to_codes([2, 1], codec={1: 'a', 2: 3}) == [3, 'a']
+    assert DiscreteCodec({1: 'a'})(numpy.array([1, 1])).tolist() == ['a'] * 2
+
+
+def test_continuous_codec():
+    values = numpy.array([1., numpy.nan, 3., 2.])
+    assert value_range(values) == (1., 3.)
+    assert value_range(values, chunksize=1) == (1., 3.)
+    assert value_range([numpy.nan]) is None
+    c = ContinuousCodec((0., 10.), values=values)
+    codes = c(values)
+    assert numpy.isnan(codes[1])
+    assert numpy.all(codes[[0, 2, 3]] == [0., 10., 5.])
+    assert c(2.) == 5.
+    assert c([1, 3]).tolist() == [0., 10.]
+    out = numpy.empty(4, dtype='f4')
+    assert c(values, out=out) is out
+    assert numpy.all(out[[0, 2, 3]] == [0., 10., 5.])
+    # fit chunk by chunk
+    c = ContinuousCodec((0., 1.))
+    try:
+        c(values)
+        assert False
+    except Exception:
+        pass
+    for chunk in (values[:2], values[2:3], [numpy.nan], values[3:]):
+        c.fit(chunk)
+    assert c.value_domain == (1., 3.)
+    assert c(3.) == 1.
+    assert ContinuousCodec(values=[2., 2.])(2.) == 0.
+    codes, codec = to_codes([0., 2., 1.], min=1., max=2., return_codec=True)
+    assert codes == [1., 2., 1.5] and isinstance(codec, ContinuousCodec)
+    codes = to_codes(numpy.array([1., 2.], dtype='f4'), codec=codec)
+    assert isinstance(codes, numpy.ndarray) and codes.tolist() == [1.5, 2.]
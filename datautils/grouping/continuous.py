@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import bisect
 import logging
 
 from base import Group
@@ -15,36 +16,150 @@ try:
     linspace = numpy.linspace
 except ImportError, E:
     logging.warning("Failed to import numpy[%s] using slower minmax()" % E)
+    numpy = None
     minmax = lambda vs: (min(vs), max(vs))
-    linspace = numpy.linspace
+    linspace = pylinspace
 
 
 class ContinuousGroup(Group):
+    """
+    Group values into ranges (levels)
+
+    When all levels are range tests (made by level_test...) the level
+    (or levels, if they overlap) for each value is found with a binary
+    search (see Bins) rather than running every level test on every
+    value (with searchsorted for arrays with no key).
+    """
     def find_levels(self, values, key=None, **kwargs):
         self.levels = find_levels(values, key, **kwargs)
 
+    def group(self, values, key=None, **kwargs):
+        if self.levels is None:
+            self.find_levels(values, key=key, **kwargs)
+        bins = Bins.from_levels(self.levels)
+        if bins is None:
+            return Group.group(self, values, key=key, **kwargs)
+        if (numpy is not None) and (key is None) and \
+                isinstance(values, numpy.ndarray):
+            return bins.group_array(values, self.levels)
+        return bins.group(values, key, self.levels)
+
+    __call__ = group
+
+
+class Bins(object):
+    """
+    Range levels sorted by start (and end) so the levels that contain
+    a value can be found with a binary search
+
+    Levels that might contain a value v (start <= v <= end) are
+    contiguous in the sorted levels, only these are tested with the
+    level tests (so inclusive and overlap work as for Group.group).
+    """
+    def __init__(self, names, tests):
+        self.names = names
+        self.tests = tests
+        self.starts = [f.bounds[0] for f in tests]
+        self.ends = [f.bounds[1] for f in tests]
+
+    @classmethod
+    def from_levels(cls, levels):
+        """
+        Make Bins from levels or return None if a level is not a range
+        test or ends are not sorted the same as starts
+        """
+        if not all([hasattr(f, 'bounds') for f in levels.itervalues()]):
+            return None
+        items = sorted(levels.iteritems(), key=lambda i: i[1].bounds)
+        bins = cls([n for (n, _) in items], [f for (_, f) in items])
+        if any([a > b for (a, b) in zip(bins.ends[:-1], bins.ends[1:])]):
+            return None
+        return bins
+
+    def candidates(self, v):
+        """
+        Indices of levels where start <= v <= end
+        """
+        return xrange(
+            bisect.bisect_left(self.ends, v),
+            bisect.bisect_right(self.starts, v))
+
+    def group(self, values, key, levels):
+        r = type(levels)([(k, []) for k in levels.keys()])
+        lists = [r[n] for n in self.names]
+        tests = self.tests
+        for v in values:
+            tv = v if key is None else key(v)
+            if tv != tv:  # NaN is not in any level
+                continue
+            for i in self.candidates(tv):
+                if tests[i](tv):
+                    lists[i].append(v)
+        return r
+
+    def group_array(self, values, levels):
+        """
+        Group a 1d array of values (with searchsorted), each level is
+        a list of values (in the same order as values)
+        """
+        starts = numpy.asarray(self.starts)
+        ends = numpy.asarray(self.ends)
+        left = numpy.array([f.bounds[2] for f in self.tests], dtype=bool)
+        right = numpy.array([f.bounds[3] for f in self.tests], dtype=bool)
+        # levels first:last might contain each value (NaNs sort last
+        # so are in no levels)
+        first = numpy.searchsorted(ends, values, 'left')
+        n = numpy.searchsorted(starts, values, 'right') - first
+        bins, inds = [], []
+        for j in xrange(n.max() if len(n) else 0):
+            vi = numpy.flatnonzero(n > j)
+            bi = first[vi] + j
+            v = values[vi]
+            s, e = starts[bi], ends[bi]
+            ok = numpy.where(left[bi], v >= s, v > s) & \
+                numpy.where(right[bi], v <= e, v < e)
+            bins.append(bi[ok])
+            inds.append(vi[ok])
+        if len(bins):
+            bins = numpy.concatenate(bins)
+            inds = numpy.concatenate(inds)
+            order = numpy.lexsort((inds, bins))
+            bins, inds = bins[order], inds[order]
+        else:
+            bins = inds = numpy.zeros(0, dtype=int)
+        splits = numpy.searchsorted(bins, numpy.arange(1, len(self.names)))
+        r = type(levels)([(k, None) for k in levels.keys()])
+        for (name, sub) in zip(self.names, numpy.split(inds, splits)):
+            r[name] = values[sub].tolist()
+        return r
+
 
 def right_level_test(start, end):
     def f(v):
         return ((v > start) and (v <= end))
+    f.bounds = (start, end, False, True)
     return f
 
 
 def left_level_test(start, end):
     def f(v):
         return ((v >= start) and (v < end))
+    f.bounds = (start, end, True, False)
     return f
 
 
 def both_level_test(start, end):
     def f(v):
         return ((v >= start) and (v <= end))
+    f.bounds = (start, end, True, True)
     return f
 
 
 def neither_level_test(start, end):
     def f(v):
         return ((v > start) and (v < end))
+    f.bounds = (start, end, False, False)
+    return f
 
 
 def level_test(start, end, inclusive):
@@ -75,9 +190,9 @@ def name_function(ftype):
 def find_levels(values, key=None, n=None, inclusive='histogram',
                 names='start', overlap=0.0):
     vs = values if key is None else map(key, values)
-    n = len(vs) ** 0.5 if n is None else n
+    n = int(len(vs) ** 0.5) if n is None else n
     vmin, vmax = minmax(vs)
-    dv = (vmax - vmin) / n
+    dv = (vmax - vmin) / float(n)
     overlap = dv * overlap / 2.
     bounds = linspace(vmin, vmax, n + 1)
     to_name = name_function(names)
@@ -97,4 +212,44 @@ def find_levels(values, key=None, n=None, inclusive='histogram',
         return dict(
             [(to_name(s - overlap, e + overlap),
               level_test(s - overlap, e + overlap, inclusive))
-             for (s, e) in bounds])
+             for (s, e) in zip(bounds[:-1], bounds[1:])])
+
+
+# ------------------ tests ------------------
+def test_continuous_group():
+    values = [0., 0.5, 1., 1.5, 2., 2.5, 3., 3.5, 4., float('nan')]
+    for inclusive in ('histogram', 'left', 'right', 'both', 'neither'):
+        for overlap in (0., 0.5, 1.5):
+            levels = find_levels(
+                values[:-1], n=4, inclusive=inclusive, overlap=overlap)
+            expected = Group.group(ContinuousGroup(levels), values)
+            g = ContinuousGroup(levels)(values)
+            assert g == expected
+            a = ContinuousGroup(levels)(numpy.array(values))
+            assert sorted(a.keys()) == sorted(g.keys())
+            assert a == g
+    g = ContinuousGroup()(values[:-1], n=4)
+    assert g == {0.: [0., 0.5], 1.: [1., 1.5], 2.: [2., 2.5],
+                 3.: [3., 3.5, 4.]}
+    g = ContinuousGroup()(values[:-1], n=4, overlap=0.5)
+    assert g[0.75] == [1., 1.5, 2.] and g[1.75] == [2., 2.5, 3.]
+    # other level tests fall back to testing every value
+    levels = {'low': lambda v: v < 2, 'high': lambda v: v >= 2}
+    g = ContinuousGroup(levels)(values, key=lambda v: v)
+    assert g == {'low': values[:4], 'high': values[4:-1]}
+    # ends sorted differently than starts
+    levels = {'a': both_level_test(0, 4), 'b': both_level_test(1, 2)}
+    assert Bins.from_levels(levels) is None
+    g = ContinuousGroup(levels)(values)
+    assert g == {'a': values[:-1], 'b': [1., 1.5, 2.]}
+    assert ContinuousGroup(levels)(numpy.array([]))['a'] == []
+
+
+def test_continuous_drop_levels():
+    from ops import drop_levels
+    from utils import groupn
+    g = groupn(numpy.arange(8.), [None, None], gkwargs=[{'n': 2}] * 2)
+    g = drop_levels(g, 1)
+    assert sorted(g.keys()) == [0., 3.5]
+    assert sorted(g[0.]) == [0., 1., 2., 3.]
+    assert sorted(g[3.5]) == [4., 5., 6., 7.]
@@ -1,5 +1,6 @@
 #!/usr/bin/env python
 
+import collections
 import logging
 
 from base import Group
@@ -21,16 +22,92 @@ except ImportError, E:
 
 
 class DiscreteGroup(Group):
+    """
+    Group values by equality
+
+    levels : dict, list or tuple (default=None)
+        dict of level name: test function (see level_test) or a list of
+        values (one level per value, in the same order). If None, one
+        level per unique value.
+
+    When all levels are equality tests (made by level_test) values are
+    put in levels with a dict lookup (one pass through the values)
+    rather than running every test function on every value.
+    """
+    def __init__(self, levels=None):
+        if isinstance(levels, (list, tuple)):
+            levels = collections.OrderedDict(
+                [(v, level_test(v)) for v in levels])
+        Group.__init__(self, levels)
+
     def find_levels(self, values, key=None, **kwargs):
         self.levels = find_levels(values, key=key, **kwargs)
 
+    def group(self, values, key=None, **kwargs):
+        try:
+            if self.levels is None:
+                r = partition(values, key)
+                self.levels = dict([(n, level_test(n)) for n in r])
+                return r
+            index = level_index(self.levels)
+            if index is not None:
+                return partition_levels(values, key, self.levels, index)
+        except TypeError:
+            # unhashable values, use the level tests
+            pass
+        return Group.group(self, values, key=key, **kwargs)
+
+    __call__ = group
+
 
 def level_test(name):
     def f(v):
         return v == name
+    f.value = name
     return f
 
 
+def partition(values, key=None):
+    """
+    Group values into a dict of key(value): [values...] in one pass
+    """
+    r = {}
+    for v in values:
+        tv = v if key is None else key(v)
+        try:
+            r[tv].append(v)
+        except KeyError:
+            r[tv] = [v]
+    return r
+
+
+def level_index(levels):
+    """
+    Return a dict of value: [level names...] if all levels are
+    equality tests (see level_test) otherwise None
+    """
+    index = {}
+    for (n, f) in levels.iteritems():
+        if not hasattr(f, 'value'):
+            return None
+        index.setdefault(f.value, []).append(n)
+    return index
+
+
+def partition_levels(values, key, levels, index):
+    """
+    Group values into levels (see level_index) in one pass
+    """
+    r = type(levels)([(k, []) for k in levels.keys()])
+    buckets = dict([
+        (v, [r[n] for n in ns]) for (v, ns) in index.iteritems()])
+    for v in values:
+        tv = v if key is None else key(v)
+        for b in buckets.get(tv, ()):
+            b.append(v)
+    return r
+
+
 def find_levels(values, key=None, **kwargs):
     vs = values if key is None else map(key, values)
     ns = unique(vs)
@@ -39,3 +116,31 @@ def find_levels(values, key=None, **kwargs):
     except:
         pass
     return dict([(n, level_test(n)) for n in ns])
+
+
+# ------------------ tests ------------------
+def test_discrete_group():
+    values = [{'a': 1}, {'a': 2}, {'a': 1}, {'a': 3}]
+    key = lambda v: v['a']
+    g = DiscreteGroup()(values, key=key)
+    assert g == {1: [values[0], values[2]], 2: [values[1]], 3: [values[3]]}
+    assert Group.group(DiscreteGroup(), values, key=key) == g
+    # user levels keep their order and drop other values
+    g = DiscreteGroup([3, 1])(values, key=key)
+    assert list(g.keys()) == [3, 1]
+    assert g[1] == [values[0], values[2]] and g[3] == [values[3]]
+    g = DiscreteGroup([4])(values, key=key)
+    assert g == {4: []}
+    # values can be in more than one level
+    levels = {'x': level_test(1), 'y': level_test(1), 'z': level_test(2)}
+    g = DiscreteGroup(levels)(values, key=key)
+    assert g == {'x': [values[0], values[2]], 'y': [values[0], values[2]],
+                 'z': [values[1]]}
+    # other level tests fall back to testing every value
+    levels = {'odd': lambda v: v % 2, 'even': lambda v: not v % 2}
+    g = DiscreteGroup(levels)(values, key=key)
+    assert g == {'odd': [values[0], values[2], values[3]],
+                 'even': [values[1]]}
+    # unhashable values
+    g = DiscreteGroup()([[1], [2], [1]])
+    assert len(g) == 2 and sorted(map(len, g.values())) == [1, 2]
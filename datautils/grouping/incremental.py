@@ -0,0 +1,322 @@
+#!/usr/bin/env python
+"""
+A grouping that is updated as documents are added (or removed)
+
+IncrementalGrouping groups documents (discrete grouping by keys, like
+groupn) and keeps running statistics (count, sum, mean, var and std,
+see aggregation) for each group. Adding or removing a batch of
+documents only updates the groups of those documents so results are
+always current without regrouping (or recomputing statistics for)
+every document.
+
+Example
+------
+
+ig = IncrementalGrouping(('subject', 'session'), {'rt': ('rt', 'mean')})
+ig.add(docs)
+ig.stat('rt')  # like ops.stat(groupn(docs, keys), mean, 'rt')
+ig.add(new_docs)  # only updates the groups of new_docs
+ig.remove(old_docs)
+ig.groups  # like groupn(docs + new_docs - old_docs, keys)
+"""
+
+import itertools
+
+from aggregation import accumulator, field_getter, key_getter, \
+    missing, parse_reduction
+from arrays import nest
+
+
+class IncrementalGrouping(object):
+    """
+    Group documents and keep running statistics (see module docstring)
+
+    keys : str, function or list of these
+        (dotted) keys to group by (one grouping level per key)
+    stats : dict (default=None)
+        name: (field, reduction) for running statistics, reduction can
+        be 'count', 'sum', 'mean', 'var' or 'std' (statistics that can
+        be updated when documents are removed)
+    levels : list (default=None)
+        per key, None (a group for each value) or a list of values to
+        group (documents with other values are ignored)
+    keep : bool (default=True)
+        keep documents in groups (see groups), if False only
+        statistics are kept (and removed documents are not checked)
+
+    Kept documents are stored per group by id (so removing a document
+    doesn't search its group) and must be removed as the same objects
+    that were added.
+    """
+    def __init__(self, keys, stats=None, levels=None, keep=True):
+        if isinstance(keys, (str, unicode)) or callable(keys):
+            keys = [keys]
+        self.keys = keys
+        if levels is None:
+            levels = [None] * len(keys)
+        if len(levels) != len(keys):
+            raise ValueError(
+                "levels [%i] must match keys [%i]" % (
+                    len(levels), len(keys)))
+        self.allowed = [None if l is None else set(l) for l in levels]
+        self.keep = keep
+        self.key = key_getter(keys)
+        # group key: [documents, {stat name: accumulator}] where
+        # documents are {id(doc): (order added, doc)} or a count
+        self._groups = {}
+        self._stats = {}
+        self._order = itertools.count()
+        for (name, (field, reduction)) in (stats or {}).iteritems():
+            self.register(name, field, reduction)
+
+    def _path(self, gk):
+        return (gk, ) if len(self.keys) == 1 else gk
+
+    def register(self, name, field, reduction):
+        """
+        Add a running statistic (see stats), if documents were already
+        added (and kept) the statistic is computed for them
+        """
+        if name in self._stats:
+            raise ValueError("Statistic %s already exists" % name)
+        make = accumulator(*parse_reduction(reduction))
+        if not hasattr(make(), 'remove'):
+            raise ValueError(
+                "Statistic %s [%r] can't be updated when documents "
+                "are removed" % (name, reduction))
+        if len(self._groups) and not self.keep:
+            raise ValueError(
+                "Cannot add statistic %s after documents were added "
+                "(without keep)" % name)
+        get = field_getter(field)
+        self._stats[name] = (get, make)
+        for (docs, accs) in self._groups.itervalues():
+            acc = accs[name] = make()
+            for (_, d) in docs.itervalues():
+                v = get(d, missing)
+                if v is not missing:
+                    acc.add(v)
+
+    def _allowed(self, gk):
+        for (k, a) in zip(self._path(gk), self.allowed):
+            if (a is not None) and (k not in a):
+                return False
+        return True
+
+    def add(self, batch):
+        """
+        Add documents (updating only their groups), raises ValueError
+        (without adding any documents) if a document was already added
+        (if keep)
+        """
+        docs = []
+        added = set()
+        for d in batch:
+            gk = self.key(d)
+            g = self._groups.get(gk, None)
+            if g is None and not self._allowed(gk):
+                continue
+            if self.keep:
+                if id(d) in added or (g is not None and id(d) in g[0]):
+                    raise ValueError("Document was already added")
+                added.add(id(d))
+            docs.append((gk, d))
+        for (gk, d) in docs:
+            g = self._groups.get(gk, None)
+            if g is None:
+                g = self._new_group(gk)
+            if self.keep:
+                g[0][id(d)] = (self._order.next(), d)
+            else:
+                g[0] += 1
+            for (name, acc) in g[1].iteritems():
+                v = self._stats[name][0](d, missing)
+                if v is not missing:
+                    acc.add(v)
+
+    def remove(self, batch):
+        """
+        Remove documents that were added, raises ValueError (without
+        removing any documents) if a document is not in its group (if
+        keep) or its group does not exist. Groups with no documents
+        are removed.
+        """
+        docs = []
+        removed = set()
+        counts = {}
+        for d in batch:
+            gk = self.key(d)
+            g = self._groups.get(gk, None)
+            if g is None:
+                if not self._allowed(gk):
+                    continue
+                raise ValueError("No group %r for document" % (gk, ))
+            if self.keep:
+                if id(d) in removed or id(d) not in g[0]:
+                    raise ValueError("Document is not in group %r" % (gk, ))
+                removed.add(id(d))
+            else:
+                counts[gk] = counts.get(gk, 0) + 1
+                if counts[gk] > g[0]:
+                    raise ValueError("No documents left in group %r" % (gk, ))
+            docs.append((gk, g, d))
+        for (gk, g, d) in docs:
+            if self.keep:
+                del g[0][id(d)]
+                n = len(g[0])
+            else:
+                g[0] -= 1
+                n = g[0]
+            for (name, acc) in g[1].iteritems():
+                v = self._stats[name][0](d, missing)
+                if v is not missing:
+                    acc.remove(v)
+            if not n:
+                del self._groups[gk]
+
+    def _new_group(self, gk):
+        g = self._groups[gk] = [
+            {} if self.keep else 0,
+            dict([(n, make()) for (n, (_, make)) in
+                  self._stats.iteritems()])]
+        return g
+
+    def __len__(self):
+        """
+        Number of groups (at the last level, so for several keys this
+        is not len(groups))
+        """
+        return len(self._groups)
+
+    def __getitem__(self, key):
+        return self.groups[key]
+
+    def _nest(self, leaf):
+        """
+        Make a grouping with leaf(group) at each group
+        """
+        if not len(self._groups):
+            return {}
+        gks = self._groups.keys()
+        group_keys = [[self._path(gk)[i] for gk in gks]
+                      for i in xrange(len(self.keys))]
+        return nest(group_keys, [leaf(self._groups[gk]) for gk in gks])
+
+    @property
+    def groups(self):
+        """
+        Current grouping (like groupn would return) with lists of
+        documents (in the order they were added) or None (if not keep)
+        """
+        if not self.keep:
+            return self._nest(lambda g: None)
+        return self._nest(
+            lambda g: [d for (_, d) in sorted(g[0].itervalues())])
+
+    def stat(self, name):
+        """
+        Current value of a statistic for every group (a grouping like
+        ops.stat would return)
+        """
+        if name not in self._stats:
+            raise KeyError(name)
+        return self._nest(lambda g: g[1][name].result())
+
+    def stats(self):
+        """
+        Current value of all statistics, dict of name: grouping
+        """
+        return dict([(n, self.stat(n)) for n in self._stats])
+
+    def __repr__(self):
+        return "IncrementalGrouping[%i groups, stats=%s]" % (
+            len(self._groups), sorted(self._stats.keys()))
+
+
+# ------------------ tests ------------------
+def test_incremental_grouping():
+    import random
+    import numpy
+    import ops
+    from utils import groupn
+    docs = [{'a': random.randint(0, 3), 'b': {'c': random.randint(0, 2)},
+             'v': random.random()} for _ in xrange(200)]
+    for d in docs[::10]:
+        del d['v']
+    keys = ('a', 'b.c')
+    ig = IncrementalGrouping(keys, {'n': (None, 'count'),
+                                    'mean': ('v', 'mean')})
+    ig.register('var', 'v', 'var')
+    ig.add(docs[:50])
+    ig.add(docs[50:150])
+    ig.remove(docs[:30])
+    ig.register('std', 'v', 'std')
+    current = docs[30:150]
+
+    def check(current):
+        g = groupn(current, keys)
+        assert ig.groups == g
+        assert ig.stat('n') == ops.stat(g, len)
+        assert len(ig) == sum([len(v) for v in g.values()])
+        present = lambda vs: [v for v in vs if v is not None]
+        for (name, f) in (('mean', numpy.mean), ('var', numpy.var),
+                          ('std', numpy.std)):
+            expected = ops.stat(
+                ops.pick(g, 'v'), lambda vs: f(present(vs)))
+            s = ig.stat(name)
+            for a in expected:
+                for c in expected[a]:
+                    assert abs(s[a][c] - expected[a][c]) < 1e-9
+    check(current)
+    # remove whole groups
+    ig.remove([d for d in current if d['a'] == 0])
+    current = [d for d in current if d['a'] != 0]
+    assert 0 not in ig.groups and 0 not in ig.stat('n')
+    check(current)
+    assert set(ig.stats().keys()) == set(['n', 'mean', 'var', 'std'])
+    try:
+        ig.remove([{'a': 10, 'b': {'c': 1}}])
+        assert False
+    except ValueError:
+        pass
+    try:
+        ig.register('max', 'v', 'max')
+        assert False
+    except ValueError:
+        pass
+    # documents are removed by identity (not equality) and bad batches
+    # change nothing
+    for bad in ([dict(current[0])], current[:2] + current[:1]):
+        try:
+            ig.remove(bad)
+            assert False
+        except ValueError:
+            pass
+        check(current)
+    for bad in (current[:1], docs[:2] * 2):
+        try:
+            ig.add(bad)
+            assert False
+        except ValueError:
+            pass
+        check(current)
+    # levels and keep=False
+    ig = IncrementalGrouping('a', {'n': (None, 'count')}, levels=([1, 2], ),
+                             keep=False)
+    ig.add(docs)
+    assert sorted(ig.stat('n').keys()) == [1, 2]
+    try:
+        ig.remove(docs + docs)
+        assert False
+    except ValueError:
+        pass
+    assert sum(ig.stat('n').values()) == len(
+        [d for d in docs if d['a'] in (1, 2)])
+    ig.remove(docs)
+    assert ig.stat('n') == {} and ig.groups == {}
+    try:
+        ig.add(docs)
+        ig.register('s', 'v', 'sum')
+        assert False
+    except ValueError:
+        pass
@@ -224,7 +224,7 @@ def prune(gts, *keys):
 def pick(gts, key, default=None):
     """
     Reduce leaf nodes from dicts to single values with
-        ddict.tdget(leaf, key, default)
+        ddict.ops.tdget(leaf, key, default)
 
     key : string
         leaf key used to unlock return values
@@ -239,16 +239,17 @@ def pick(gts, key, default=None):
         {'a': {'b': [3]}}
 
     """
+    get = ddict.ops.itemgetter(key, default=default)
     if isinstance(gts, dict):
         r = {}
         for k in gts.keys():
             if isinstance(gts[k], dict):
                 r[k] = pick(gts[k], key)
             elif isinstance(gts[k], (list, tuple)):
-                r[k] = [ddict.ops.tdget(i, key, default) for i in gts[k]]
+                r[k] = get.columns(gts[k])[key]
         return r
     elif isinstance(gts, (list, tuple)):
-        return [ddict.ops.tdget(i, key, default) for i in gts]
+        return get.columns(gts)[key]
 
 
 def stat(gts, func, pick_key=None):
@@ -1,8 +1,10 @@
 #!/usr/bin/env python
 
+from arrays import group_inds
 from continuous import ContinuousGroup
 from discrete import DiscreteGroup
 from .. import ddict
+from ..listify import listify
 
 DefaultGroup = DiscreteGroup
 
@@ -56,7 +58,7 @@ def group(values, key=None, levels=None, gtype=None, gkwargs=None, dget=True):
     if isinstance(key, str):
         sv = key
         if dget:
-            key = lambda x: ddict.ops.dget(x, sv)
+            key = ddict.ops.key_path(sv).get
         else:
             key = lambda x: x[sv]
     gtype = guess_type(values, key) if gtype is None else lookup_gtype(gtype)
@@ -84,8 +86,65 @@ def dwalk(d):
             yield (k, ), v
 
 
+def level_values(levels):
+    """
+    Values of one key's levels: None, a list of values or a dict of
+    value: test made by discrete.level_test(value)
+    """
+    if levels is None:
+        return None
+    if isinstance(levels, dict):
+        for (n, f) in levels.iteritems():
+            if getattr(f, 'value', f) != n:
+                raise ValueError(
+                    "inds levels must be values not tests [%r]" % (n, ))
+        return list(levels.keys())
+    return list(levels)
+
+
+def inds_levels(keys, levels):
+    """
+    Levels for groupn(..., inds=True), returns None or a list (one per
+    key) of None or lists of values (see level_values)
+
+    levels can be None, a list of per key levels (with one item per
+    key, each None, a list or a dict) or (for one key) that key's
+    levels (e.g. ['a', 'b'])
+    """
+    if levels is None:
+        return None
+    per_key = isinstance(levels, (list, tuple)) and \
+        (len(levels) == len(keys)) and \
+        all([(l is None) or isinstance(l, (list, tuple, dict))
+             for l in levels])
+    if not per_key:
+        if len(keys) != 1:
+            raise ValueError(
+                "levels must be a list of levels for each key [%i]" %
+                len(keys))
+        levels = [levels]
+    return [level_values(l) for l in levels]
+
+
 def groupn(values, keys=None, levels=None, gtypes=None, gkwargs=None,
-           dget=True):
+           dget=True, inds=False):
+    """
+    Group values by several keys (one grouping level per key), see group
+
+    inds : bool (default=False)
+        if True, values is a numpy structured array (or dict of arrays)
+        and the leaves are index arrays (or slices) into values found
+        by sorting all rows at once (see arrays.group_inds). keys must be
+        (dotted) field names, grouping is discrete and levels are as
+        described in inds_levels.
+    """
+    if inds:
+        if any([g not in (None, 'discrete', 'd', DiscreteGroup)
+                for g in listify(gtypes)]) or gkwargs is not None:
+            raise ValueError("inds grouping is only discrete")
+        if isinstance(keys, (str, unicode)):
+            keys = [keys]
+        return group_inds(values, keys, inds_levels(keys, levels))
     nlvls = [len(i) for i in (keys, levels, gtypes, gkwargs) if
              (i is not None) and (not isinstance(i, str)) and
              (hasattr(i, '__len__'))]
@@ -9,6 +9,10 @@ try:
     import pymongo.binary as binary
 except ImportError:
     import bson.binary as binary
+try:
+    from bson.raw_bson import RawBSONDocument
+except ImportError:
+    RawBSONDocument = None
 
 from .. import ddict
 
@@ -51,14 +55,26 @@ def write(d, pchar=','):
     return d
 
 
-def read(d, dclass=ddict.DDict):
+def read(d, dclass=ddict.DDict, sub_dclass=None):
     """
     By default returns DDicts rather than dicts
+
+    dclass is used for every (sub-)document, for FlatDDict or
+    FrozenDDict only the top level document needs to be indexed so use
+    sub_dclass=dict (or DDict)
+
+    RawBSONDocuments (from a collection with
+    document_class=RawBSONDocument) are returned as lazy
+    ddict.BSONDDict views, values are read when they are accessed
     """
+    if sub_dclass is None:
+        sub_dclass = dclass
+    if (RawBSONDocument is not None) and isinstance(d, RawBSONDocument):
+        return ddict.BSONDDict(d.raw, convert=lambda v: read(v, sub_dclass))
     if isinstance(d, dict):
-        return dclass([(k, read(v)) for (k, v) in d.iteritems()])
+        return dclass([(k, read(v, sub_dclass)) for (k, v) in d.iteritems()])
     elif isinstance(d, (list, tuple)):
-        return type(d)([read(v) for v in d])
+        return type(d)([read(v, sub_dclass) for v in d])
     elif isinstance(d, binary.Binary):
         return pickle.loads(d)
     return d
@@ -4,10 +4,11 @@ from . import convert
 from . import flookup
 from . import mask
 from . import named
+from . import ondisk
 from . import query
 
 from .mask import mask_array
 from .query import query_array
 
-__all__ = ['convert', 'mask', 'mask_array', 'named', 'query', 'query_array',
-           'flookup']
+__all__ = ['convert', 'mask', 'mask_array', 'named', 'ondisk', 'query',
+           'query_array', 'flookup']
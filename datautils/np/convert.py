@@ -1,8 +1,13 @@
 #!/usr/bin/env python
 
+import collections
+import itertools
+
 import numpy
 
+from .. import ddict
 from .. import grouping
+from ..listify import listify
 
 
 class GuessError(Exception):
@@ -13,10 +18,17 @@ def void_to_dict(v):
     return dict([(k, v[k]) for k in v.dtype.names])
 
 
-def code(v):
+def code(v, codec=None):
     """
     Convert a 1d array of values into 'codes'
+
+    codec : grouping.coding.CategoricalCodec (default=None)
+        if provided, use codec to code the values (so codes are the same
+        for every array coded with codec) otherwise codes are the
+        index of each value in the sorted unique values
     """
+    if codec is not None:
+        return codec(v)
     a = numpy.asarray(v)
     _, r = numpy.unique(a, False, True)
     return r.reshape(a.shape)
@@ -48,7 +60,11 @@ def ordered_labeled_array(*args):
         dt = [(k, guess_type(v)) for (k, v) in args]
     except GuessError as E:
         raise Exception("Failed to guess type: %s" % E)
-    return numpy.array(zip(*[v for (_, v) in args]), dtype=dt)
+    n = min([len(v) for (_, v) in args]) if len(args) else 0
+    a = numpy.empty(n, dtype=dt)
+    for (k, v) in args:
+        a[k] = v[:n]
+    return a
 
 
 def labeled_array(**kwargs):
@@ -61,7 +77,35 @@ def labeled_array(**kwargs):
     return ordered_labeled_array(*[(k, kwargs[k]) for k in sorted(kwargs)])
 
 
-def grouping_to_array(g, default=None, dtype=None, stat=None, pick=None):
+def walk_grouping(g, depth=None):
+    """
+    Walk a grouping once, returning:
+        level_keys : list (one per level) of sets of keys
+        paths : list of tuples of keys (one per leaf)
+        values : list of leaf values
+    """
+    if depth is None:
+        depth = grouping.ops.depth(g)
+    level_keys = [set() for _ in xrange(depth)]
+    paths = []
+    values = []
+
+    def walk(d, ks):
+        level_keys[len(ks)].update(d.iterkeys())
+        for (k, v) in d.iteritems():
+            if isinstance(v, dict):
+                walk(v, ks + (k, ))
+            else:
+                paths.append(ks + (k, ))
+                values.append(v)
+
+    if depth:
+        walk(g, ())
+    return level_keys, paths, values
+
+
+def grouping_to_array(g, default=None, dtype=None, stat=None, pick=None,
+                      sparse=False):
     """
     Convert a grouping to a numpy array
 
@@ -85,6 +129,10 @@ def grouping_to_array(g, default=None, dtype=None, stat=None, pick=None):
 
     pick, see stat
 
+    sparse : bool (default=False)
+        if True, return the leaf coordinates and values (COO) rather
+        than a (possibly huge) dense array
+
     Returns
     ------
         keys : list of lists of keys
@@ -92,14 +140,35 @@ def grouping_to_array(g, default=None, dtype=None, stat=None, pick=None):
 
         array : numpy.ndarray
             grouping values
+
+        or if sparse, (coords, values)
+            coords : int array (levels, leaves), index of each leaf's
+                keys in keys (so array[tuple(coords)] = values)
+            values : array of leaf values
     """
     if stat is not None:
         g = grouping.ops.stat(g, stat, pick)
-    keys = []
-    for di in xrange(grouping.ops.depth(g)):
-        keys.append(sorted(grouping.ops.all_keys(g, di)))
+    level_keys, paths, values = walk_grouping(g)
+    keys = [sorted(ks) for ks in level_keys]
     if dtype is None:
-        dtype = guess_type(grouping.ops.leaves(g))
+        leaves = []
+        for v in values:
+            leaves.extend(listify(v))
+        dtype = guess_type(leaves)
+    # dict lookups instead of list.index
+    indices = [dict([(k, i) for (i, k) in enumerate(ks)]) for ks in keys]
+    vectorize = all([len(p) == len(keys) for p in paths]) and \
+        not any([isinstance(v, (list, tuple)) for v in values])
+    if vectorize:
+        coords = numpy.empty((len(keys), len(paths)), dtype=int)
+        for (l, index) in enumerate(indices):
+            coords[l] = [index[p[l]] for p in paths]
+    if sparse:
+        if not vectorize:
+            raise ValueError(
+                "sparse requires all leaves at the same depth with "
+                "single values")
+        return keys, (coords, numpy.asarray(values, dtype=dtype))
     m = numpy.empty([len(k) for k in keys], dtype=dtype)
     if default is not None:
         m[:] = default
@@ -110,7 +179,406 @@ def grouping_to_array(g, default=None, dtype=None, stat=None, pick=None):
             m[:] = numpy.nan
         elif numpy.issubdtype(dtype, str):
             m[:] = ''
-    for (ks, v) in grouping.ops.walk(g):
-        inds = tuple([dk.index(k) for (k, dk) in zip(ks, keys)])
-        m[inds] = v
+    if vectorize:
+        m[tuple(coords)] = numpy.asarray(values, dtype=dtype)
+    else:
+        for (ks, v) in zip(paths, values):
+            m[tuple([index[k] for (k, index) in zip(ks, indices)])] = v
     return keys, m
+
+
+# ----------- documents to structured arrays -----------
+# column kind for python types (None is missing)
+type_kinds = {
+    bool: 'b',
+    int: 'i',
+    long: 'i',
+    float: 'f',
+    str: 'S',
+    unicode: 'U',
+}
+
+max_int64 = 2 ** 63 - 1
+
+# fill values for missing values by dtype kind
+fill_values = {
+    'b': False,
+    'i': 0,
+    'u': 0,
+    'f': numpy.nan,
+    'c': numpy.nan,
+    'S': '',
+    'U': u'',
+    'O': None,
+}
+
+
+def value_kind(t):
+    """
+    Column kind ('b', 'i', 'f', 'S', 'U' or 'O') for a value type
+    """
+    if t in type_kinds:
+        return type_kinds[t]
+    if issubclass(t, numpy.generic):
+        k = numpy.dtype(t).kind
+        return 'i' if k == 'u' else (k if k in 'bifSU' else 'O')
+    return 'O'
+
+
+def merge_kinds(k0, k1):
+    if k0 is None or k0 == k1:
+        return k1
+    if k1 is None:
+        return k0
+    ks = set((k0, k1))
+    if ks <= set('bi'):
+        return 'i'
+    if ks <= set('bif'):
+        return 'f'
+    if ks == set('SU'):
+        return 'U'
+    return 'O'
+
+
+def column_info(values):
+    """
+    Return (kind, size, missing) for a list of values (None is missing)
+    """
+    types = set(map(type, values))
+    missing = type(None) in types
+    types.discard(type(None))
+    kind = None
+    for t in types:
+        kind = merge_kinds(kind, value_kind(t))
+    if kind == 'i' and long in types:
+        ls = [v for v in values if type(v) is long]
+        if max(ls) > max_int64 or min(ls) < -max_int64 - 1:
+            kind = 'O'
+    size = 0
+    if kind in ('S', 'U'):
+        size = max([len(v) for v in values if v is not None])
+    return kind, size, missing
+
+
+def merge_info(i0, i1):
+    if i0 is None:
+        return i1
+    return (merge_kinds(i0[0], i1[0]), max(i0[1], i1[1]), i0[2] or i1[2])
+
+
+def info_dtype(info, missing='sentinel'):
+    """
+    numpy dtype for a column (see column_info), in sentinel mode
+    columns of bools or ints with missing values are stored as floats
+    (with nan for missing)
+    """
+    kind, size, has_missing = info
+    if kind is None:  # all missing
+        return numpy.dtype('f8')
+    if kind in 'bi' and has_missing and missing == 'sentinel':
+        return numpy.dtype('f8')
+    if kind in 'SU':
+        return numpy.dtype('%s%i' % (kind, max(size, 1)))
+    return numpy.dtype({'b': '?', 'i': 'i8', 'f': 'f8', 'O': 'O'}[kind])
+
+
+def flatten_doc(d, prefix, out):
+    for (k, v) in d.iteritems():
+        if not isinstance(k, basestring):
+            k = str(k)
+        if isinstance(v, dict):
+            flatten_doc(v, prefix + k + '.', out)
+        else:
+            out[prefix + k] = v
+    return out
+
+
+def doc_columns(docs, keys=None):
+    """
+    Get columns (lists of values, None where missing) for each dotted
+    key in keys from docs. If keys is None, all (leaf) keys are used.
+    """
+    if keys is not None:
+        return ddict.itemgetter(*keys, default=None).columns(docs)
+    n = len(docs)
+    cols = {}
+    for (i, d) in enumerate(docs):
+        for (k, v) in flatten_doc(d, '', {}).iteritems():
+            if k not in cols:
+                cols[k] = [None] * n
+            cols[k][i] = v
+    return cols
+
+
+def column_array(values, dtype, has_missing=True):
+    """
+    Convert a column (list of values) to an array of dtype
+    """
+    if has_missing:
+        fill = fill_values[dtype.kind]
+        values = [fill if v is None else v for v in values]
+    if dtype.kind == 'O':
+        a = numpy.empty(len(values), dtype=dtype)
+        for (i, v) in enumerate(values):
+            a[i] = v
+        return a
+    return numpy.array(values, dtype=dtype)
+
+
+def schema_dtype(schema, mask_field=None):
+    """
+    Make a (nested) structured dtype from a schema (list of
+    (dotted key, dtype)). If mask_field is not None, a field (with that
+    name) of bools with the same (nested) fields is added.
+    """
+    tree = collections.OrderedDict()
+    for (key, dt) in schema:
+        node = tree
+        ks = key.split('.')
+        for k in ks[:-1]:
+            node = node.setdefault(k, collections.OrderedDict())
+            if not isinstance(node, dict):
+                raise ValueError("%s is both a value and a document" % key)
+        if ks[-1] in node:
+            raise ValueError("%s is both a value and a document" % key)
+        node[ks[-1]] = dt
+
+    def to_dtype(node, leaf):
+        return [(field_name(k), to_dtype(v, leaf) if isinstance(v, dict)
+                 else (v if leaf is None else leaf))
+                for (k, v) in node.iteritems()]
+
+    dt = to_dtype(tree, None)
+    if mask_field is not None:
+        dt.append((mask_field, to_dtype(tree, '?')))
+    return numpy.dtype(dt)
+
+
+def field_name(k):
+    """
+    numpy (in python 2) needs str field names, unicode keys are utf-8
+    """
+    if isinstance(k, unicode):
+        return k.encode('utf-8')
+    return k
+
+
+def get_field(a, key):
+    for k in key.split('.'):
+        a = a[field_name(k)]
+    return a
+
+
+def infer_schema(docs, keys=None, missing='sentinel'):
+    """
+    Infer a schema (list of (dotted key, dtype)) for documents (or a
+    sample of documents), see docs_to_array
+    """
+    cols = doc_columns(docs, keys)
+    keys = sorted(cols) if keys is None else keys
+    return [(k, info_dtype(column_info(cols[k]), missing)) for k in keys]
+
+
+def docs_to_array(docs, keys=None, schema=None, missing='sentinel',
+                  chunksize=None, mask_field='_missing'):
+    """
+    Convert documents (dicts, possibly nested) to a structured array
+
+    Nested documents become nested fields (so the array can be queried
+    with dotted keys, see np.query).
+
+    docs : list or iterable of dicts
+        iterables (or lists with chunksize) are converted chunksize
+        documents at a time
+
+    keys : list of dotted keys (default=None)
+        keys to convert, if None all keys (sorted) are used
+
+    schema : list of (dotted key, dtype) (default=None)
+        if None, the schema is inferred from all documents. Columns
+        with different types are promoted (bool -> int -> float,
+        str -> unicode, otherwise object). See infer_schema to infer
+        a schema from a sample.
+
+    missing : 'sentinel' or 'mask' (default='sentinel')
+        how to store missing (or None) values
+            sentinel: missing values are nan (float columns, bool and
+                int columns with missing values are stored as floats),
+                '' (string columns) or None (object columns)
+            mask: missing values are 0, and a field (mask_field) is
+                added with True where values are missing
+        with a schema, missing values are filled based on the schema
+        dtype (nan, 0, '' or None)
+
+    chunksize : int (default=None)
+        number of documents to convert at a time
+    """
+    if missing not in ('sentinel', 'mask'):
+        raise ValueError("Unknown missing %s" % missing)
+    if schema is not None:
+        schema = [(k, numpy.dtype(dt)) for (k, dt) in schema]
+        keys = [k for (k, _) in schema]
+    if isinstance(docs, (list, tuple)) and chunksize is None:
+        chunks = [docs]
+    else:
+        if chunksize is None:
+            chunksize = 10000
+        chunks = ichunk(docs, chunksize)
+
+    # get columns (and their info) for each chunk, the columns are
+    # converted to arrays once the dtype of each column is known
+    n = 0
+    infos = {}
+    converted = []  # (n, {key: values})
+    for chunk in chunks:
+        cols = doc_columns(chunk, keys)
+        if schema is None:
+            for (k, values) in cols.iteritems():
+                infos[k] = merge_info(infos.get(k, None), column_info(values))
+        converted.append((len(chunk), cols))
+        n += len(chunk)
+
+    if schema is None:
+        for (k, info) in infos.items():
+            # keys not in every chunk have missing values
+            if not info[2] and any([k not in c for (_, c) in converted]):
+                infos[k] = (info[0], info[1], True)
+        schema = [(k, info_dtype(infos.get(k, (None, 0, True)), missing))
+                  for k in (sorted(infos) if keys is None else keys)]
+    a = numpy.empty(n, dtype=schema_dtype(
+        schema, mask_field if missing == 'mask' else None))
+    for (k, dt) in schema:
+        field = get_field(a, k)
+        mfield = None
+        if missing == 'mask':
+            mfield = get_field(a[mask_field], k)
+        s = 0
+        for (cn, cols) in converted:
+            if k in cols:
+                m = numpy.fromiter(
+                    (v is None for v in cols[k]), dtype=bool, count=cn)
+                field[s:s + cn] = column_array(cols[k], dt, m.any())
+                if mfield is not None:
+                    mfield[s:s + cn] = m
+            else:
+                field[s:s + cn] = fill_values[dt.kind]
+                if mfield is not None:
+                    mfield[s:s + cn] = True
+            s += cn
+    return a
+
+
+def ichunk(iterable, n):
+    """
+    Yield lists of n items from iterable
+    """
+    i = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(i, n))
+        if not len(chunk):
+            return
+        yield chunk
+
+
+# ------------------ tests ------------------
+def test_code():
+    v = numpy.array(['b', 'a', 'c', 'a'])
+    assert code(v).tolist() == [1, 0, 2, 0]
+    codec = grouping.coding.CategoricalCodec().fit(v[2:]).fit(v[:2])
+    assert code(v, codec).tolist() == [2, 0, 1, 0]
+    assert code(v[:2], codec).tolist() == [2, 0]
+
+
+def test_labeled_array():
+    a = labeled_array(i=[1, 2, 3], s=['a', 'bc'], f=numpy.arange(3.))
+    assert a.dtype.names == ('f', 'i', 's')
+    assert list(a['s']) == ['a', 'bc'] and list(a['f']) == [0., 1.]
+
+
+def test_docs_to_array():
+    from . import query
+    docs = [
+        {'a': {'b': 1, 'c': 'x'}, 'f': 1.5, 't': True, 'l': [1]},
+        {'a': {'b': 2, 'c': 'yz'}, 'f': 2, 't': False, 'l': 2},
+        {'a': {'b': None, 'c': u'w'}, 'f': None, 'big': 2 ** 70},
+        {'a': {'b': 4}, 't': True, 'f': numpy.float32(1.)},
+    ]
+    a = docs_to_array(docs)
+    assert a.dtype.names == ('a', 'big', 'f', 'l', 't')
+    assert a['a'].dtype.names == ('b', 'c')
+    assert a['a']['b'].dtype == 'f8'  # int with missing -> float
+    assert numpy.isnan(a['a']['b'][2]) and a['a']['b'][3] == 4
+    assert a['a']['c'].dtype == 'U2' and list(a['a']['c']) == [
+        'x', 'yz', 'w', '']
+    assert a['f'].dtype == 'f8' and numpy.isnan(a['f'][2])
+    assert a['t'].dtype == 'f8' and list(a['t'][[0, 1, 3]]) == [1, 0, 1]
+    assert a['l'].dtype == object and a['l'][0] == [1]
+    assert a['big'].dtype == object and a['big'][2] == 2 ** 70
+    assert numpy.all(query.query_inds(a, {'a.b': {'$gt': 1}}) == [1, 3])
+
+    m = docs_to_array(docs, missing='mask')
+    assert m['a']['b'].dtype == 'i8'
+    assert list(m['_missing']['a']['b']) == [False, False, True, False]
+    assert list(m['_missing']['l']) == [False, False, True, True]
+    assert m['t'].dtype == bool
+
+    k = docs_to_array(docs, keys=['f', 'a.b'])
+    assert k.dtype.names == ('f', 'a')
+    s = docs_to_array(docs, schema=[('a.b', 'i4'), ('a.c', 'S1')])
+    assert list(s['a']['b']) == [1, 2, 0, 4]
+    assert list(s['a']['c']) == ['x', 'y', 'w', '']
+
+    # chunked (types change between chunks)
+    c = docs_to_array(iter(docs), chunksize=2)
+    assert c.dtype == a.dtype
+    for key in ('a.b', 'f', 't'):
+        assert numpy.allclose(
+            get_field(a, key), get_field(c, key), equal_nan=True)
+    assert list(c['a']['c']) == list(a['a']['c'])
+    assert docs_to_array(docs[:2], chunksize=1).dtype.names == (
+        'a', 'f', 'l', 't')
+    # keys missing from a whole chunk
+    c = docs_to_array(iter([{'a': 1}, {'b': 2}]), chunksize=1)
+    assert c.dtype == numpy.dtype([('a', 'f8'), ('b', 'f8')])
+    assert numpy.allclose(c.view(('f8', 2)), [[1, numpy.nan], [numpy.nan, 2]],
+                          equal_nan=True)
+    c = docs_to_array(iter([{'a': 1}, {'b': True}]), chunksize=1,
+                      missing='mask')
+    assert c.dtype['a'] == 'i8' and c.dtype['b'] == bool
+    assert c['_missing'].tolist() == [(False, True), (True, False)]
+    # a chunk of bools then a chunk with floats (and None)
+    c = docs_to_array(iter([{'a': True}, {'a': 2.5}, {'a': None}]),
+                      chunksize=1)
+    assert numpy.allclose(c['a'], [1., 2.5, numpy.nan], equal_nan=True)
+    # non-ascii keys
+    c = docs_to_array([{u'\xe9': {u'\xfc': 1}}])
+    assert get_field(c, u'\xe9.\xfc').tolist() == [1]
+    assert infer_schema([{u'\xe9': 1}]) == [(u'\xe9', numpy.dtype('i8'))]
+    assert infer_schema(docs, ['a.c', 'f']) == [
+        ('a.c', numpy.dtype('U2')), ('f', numpy.dtype('f8'))]
+    try:
+        docs_to_array([{'a': 1}, {'a': {'b': 1}}])
+        assert False
+    except ValueError:
+        pass
+
+
+def test_grouping_to_array():
+    g = {'a': {'x': 1., 'y': 2.}, 'b': {'y': 3.}, 'c': {}}
+    keys, m = grouping_to_array(g)
+    assert keys == [['a', 'b', 'c'], ['x', 'y']]
+    assert m.shape == (3, 2)
+    assert numpy.allclose(
+        m, [[1, 2], [numpy.nan, 3], [numpy.nan, numpy.nan]], equal_nan=True)
+    keys, (coords, values) = grouping_to_array(g, sparse=True)
+    d = numpy.zeros([len(k) for k in keys])
+    d[tuple(coords)] = values
+    assert numpy.allclose(d, numpy.nan_to_num(m))
+    keys, m = grouping_to_array(
+        {'a': {'x': [1, 2], 'y': [3]}}, stat=numpy.sum, default=-1)
+    assert m.tolist() == [[3, 3]]
+    keys, m = grouping_to_array({'a': {'x': 's'}, 'b': {'y': 'tt'}})
+    assert m.dtype == 'S2' and m.tolist() == [['s', ''], ['', 'tt']]
+    # leaves at different depths
+    keys, m = grouping_to_array({'a': {'x': 1}, 'b': 2}, dtype=int)
+    assert m.tolist() == [[1], [2]]
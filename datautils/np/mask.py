@@ -63,7 +63,36 @@ def resolve_combiner(c):
     return c
 
 
-def mask_array(array, conditions, operator, selector=None, combiner='and'):
+def isufunc(f):
+    return isinstance(f, numpy.ufunc)
+
+
+def apply_operator(o, a, cond, out):
+    """
+    Run operator o on a and cond, storing the result in out
+    """
+    if isufunc(o):
+        return o(a, cond, out=out)
+    out[...] = o(a, cond)
+    return out
+
+
+def is_isin(conditions, op, sel, comb):
+    """
+    Check if conditions compare the same selector with == and combine
+    the results with or (which is numpy.isin)
+    """
+    if not all([o is numpy.equal for o in op]):
+        return False
+    if not all([c is numpy.logical_or for c in comb[1:]]):
+        return False
+    if not all([s is sel[0] for s in sel[1:]]):
+        return False
+    return not any([islist(c) for c in conditions])
+
+
+def mask_array(array, conditions, operator, selector=None, combiner='and',
+               out=None):
     """
     Examples:
         # create a mask with True where values == 3
@@ -82,7 +111,13 @@ def mask_array(array, conditions, operator, selector=None, combiner='and'):
         logical_or(
             logical_or(a['outcome'] == 'bar', a['outcome'] == 'baz'),
             a['outcome'] == 'foo')
+        # which is computed as
+        numpy.isin(a['outcome'], ('foo', 'bar', 'baz'))
 
+    out : bool array (default=None)
+        if provided, the mask is stored in (and returned as) out. For
+        multiple conditions one temporary array is used to hold each
+        condition result which is then combined in place into out
     """
     op = resolve_operator(operator)
     sel = resolve_selector(selector)
@@ -92,19 +127,49 @@ def mask_array(array, conditions, operator, selector=None, combiner='and'):
         op = listify(op, N)
         sel = listify(sel, N)
         comb = listify(comb, N)
-        if comb[0] == numpy.logical_and:
-            m = numpy.ones(array.size, dtype=bool)
+        if N and is_isin(conditions, op, sel, comb):
+            m = numpy.isin(sel[0](array), conditions)
+            if out is None:
+                return m
+            out[...] = m
+            return out
+        if (N == 0) or not all([isufunc(c) for c in comb]):
+            # can't combine in place
+            if comb[0] == numpy.logical_and:
+                m = numpy.ones(array.size, dtype=bool)
+            else:
+                m = numpy.zeros(array.size, dtype=bool)
+            for (cond, o, s, c) in zip(conditions, op, sel, comb):
+                #foo = s(array)  # 1.2%
+                #bar = o(foo, cond)  # 61.7%
+                #m = c(m, bar)  # 29%
+                m = c(m, o(s(array), cond))  # all the time
+            if out is None:
+                return m
+            out[...] = m
+            return out
+        # the first combiner (with ones or zeros) returns the first result
+        if out is None:
+            m = op[0](sel[0](array), conditions[0])
+            if isufunc(op[0]) and isinstance(m, numpy.ndarray):
+                # a new array, safe to combine into
+                m = m.astype(bool, copy=False)
+            else:
+                # other operators might return (a view of) array
+                m = numpy.array(m, dtype=bool, copy=True)
         else:
-            m = numpy.zeros(array.size, dtype=bool)
-        for (cond, o, s, c) in zip(conditions, op, sel, comb):
-            #foo = s(array)  # 1.2%
-            #bar = o(foo, cond)  # 61.7%
-            #m = c(m, bar)  # 29%
-            m = c(m, o(s(array), cond))  # all the time
+            m = apply_operator(op[0], sel[0](array), conditions[0], out)
+        if N > 1:
+            t = numpy.empty_like(m)
+            for (cond, o, s, c) in zip(
+                    conditions[1:], op[1:], sel[1:], comb[1:]):
+                c(m, apply_operator(o, s(array), cond, t), out=m)
         return m
     assert not islist(op)
     assert not islist(sel)
-    return op(sel(array), conditions)
+    if out is None:
+        return op(sel(array), conditions)
+    return apply_operator(op, sel(array), conditions, out)
 
 
 def test_mask_array():
@@ -127,3 +192,41 @@ def test_mask_array():
     assert s(ma(a, (4, 6), ('greater', 'less'), combiner='or')) == 10
     assert s(ma(a, (4, 6, 3), ('greater', 'less', 'equal'),
                 combiner=('and', 'and', 'or'))) == 2
+
+
+def test_mask_array_out():
+    ma = mask_array
+    a = numpy.zeros(10, dtype=[('i', 'i4'), ('s', 'S1')])
+    a['i'] = range(10)
+    a['s'] = list('abcdeabcde')
+    out = numpy.empty(10, dtype=bool)
+    r = ma(a, (2, 5, 7), 'equal', 'i', 'or', out=out)
+    assert r is out
+    assert numpy.all(out == numpy.in1d(a['i'], (2, 5, 7)))
+    assert numpy.all(
+        ma(a, ('a', 'c'), 'equal', 's', 'or') ==
+        ((a['s'] == 'a') | (a['s'] == 'c')))
+    r = ma(a, (2, 5, 8), ('greater', 'not_equal', 'less'), 'i',
+           ('and', 'and', 'or'), out=out)
+    assert r is out
+    assert numpy.all(
+        out == (((a['i'] > 2) & (a['i'] != 5)) | (a['i'] < 8)))
+    r = ma(a, 3, 'less', 'i', out=out)
+    assert r is out
+    assert numpy.sum(out) == 3
+    # combiner that isn't a ufunc
+    r = ma(a, (2, 8), 'greater', 'i', (numpy.logical_and, lambda x, y: x & y))
+    assert numpy.sum(r) == 1
+
+
+def test_mask_array_no_overwrite():
+    # an operator that returns a stored bool field is not combined into
+    a = numpy.zeros(4, dtype=[('i', 'i4'), ('b', '?')])
+    a['i'] = range(4)
+    a['b'] = [True, True, False, True]
+    r = mask_array(a, (None, 2), (lambda v, c: v, 'less'), ('b', 'i'))
+    assert r.tolist() == [True, True, False, False]
+    assert a['b'].tolist() == [True, True, False, True]
+    b = a['b'].copy()
+    r = mask_array(b, (None, None), lambda v, c: v, combiner='xor')
+    assert not numpy.any(r) and b.tolist() == [True, True, False, True]
@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+"""
+Query (and mask) structured arrays that are too big to fit in memory
+
+Arrays can be numpy.memmap (or any array) or paths to .npy files (which
+are opened with numpy.load(..., mmap_mode='r')). Queries are evaluated
+chunk by chunk so only one chunk of the array is read at a time.
+Results are indices of matching rows or a Rows view that only reads
+the matching rows when they are accessed.
+
+Example
+------
+
+rows = query_array('session.npy', {'trial': {'$gt': 10}})
+len(rows)  # number of matching rows
+rows['trial']  # read only the 'trial' field of matching rows
+rows[:10]  # read the first 10 matching rows
+inds = query_inds('session.npy', {'trial': {'$gt': 10}})
+"""
+
+import os
+import tempfile
+
+import numpy
+
+from . import mask
+from . import query
+
+
+# default number of bytes to read per chunk
+chunk_bytes = 64 * 1024 * 1024
+
+
+def load(array, mmap_mode='r'):
+    """
+    Open a .npy filename as a memory mapped array (arrays are returned)
+    """
+    if isinstance(array, (str, unicode)):
+        return numpy.load(os.path.expanduser(array), mmap_mode=mmap_mode)
+    return array
+
+
+def iter_chunks(array, chunksize=None):
+    """
+    Yield (start index, chunk) for sequential chunks of array
+
+    chunksize : int (default=None)
+        number of rows per chunk, if None use chunk_bytes
+    """
+    if chunksize is None:
+        chunksize = max(1, chunk_bytes // array.dtype.itemsize)
+    for s in xrange(0, array.size, chunksize):
+        yield s, array[s:s + chunksize]
+
+
+def chunked_inds(array, f, chunksize=None):
+    """
+    Run f (a function that returns indices) on each chunk of array
+    and combine the results (as indices into array)
+    """
+    array = load(array)
+    inds = [s + f(chunk) for (s, chunk) in iter_chunks(array, chunksize)]
+    if not len(inds):
+        return numpy.zeros(0, dtype=int)
+    return numpy.concatenate(inds)
+
+
+def query_inds(array, q, chunksize=None):
+    """
+    Indices of rows in array (or .npy filename) that match q
+    (see np.query)
+    """
+    return chunked_inds(
+        array, lambda c: query.query_inds(c, q), chunksize)
+
+
+def mask_inds(array, conditions, operator, selector=None, combiner='and',
+              chunksize=None):
+    """
+    Indices of rows in array (or .npy filename) that are True for
+    np.mask.mask_array(array, conditions, operator, selector, combiner)
+    """
+    return chunked_inds(
+        array, lambda c: numpy.flatnonzero(mask.mask_array(
+            c, conditions, operator, selector, combiner)), chunksize)
+
+
+class Rows(object):
+    """
+    A view of some rows (inds) of array, rows are read when accessed
+    """
+    def __init__(self, array, inds):
+        self.array = load(array)
+        self.inds = inds
+
+    @property
+    def dtype(self):
+        return self.array.dtype
+
+    def __len__(self):
+        return len(self.inds)
+
+    def __getitem__(self, item):
+        """
+        A field name returns that field for all rows, otherwise
+        item indexes the rows
+        """
+        if isinstance(item, (str, unicode)):
+            return self.array[item][self.inds]
+        return self.array[self.inds[item]]
+
+    def chunk_inds(self):
+        """
+        Yield chunks of inds, each chunk reads at most chunk_bytes of
+        rows
+        """
+        n = max(1, chunk_bytes // self.array.dtype.itemsize)
+        for (_, inds) in iter_chunks(self.inds, n):
+            yield inds
+
+    def __iter__(self):
+        for inds in self.chunk_inds():
+            for r in self.array[inds]:
+                yield r
+
+    def materialize(self):
+        """
+        Read all rows into an (in memory) array
+        """
+        return self.array[self.inds]
+
+    def __array__(self, dtype=None):
+        a = self.materialize()
+        return a if dtype is None else a.astype(dtype)
+
+    def __repr__(self):
+        return "Rows[%i of %i]" % (len(self.inds), self.array.size)
+
+
+def query_array(array, q, chunksize=None):
+    """
+    Rows (see Rows) of array (or .npy filename) that match q
+    """
+    array = load(array)
+    return Rows(array, query_inds(array, q, chunksize))
+
+
+def test_ondisk():
+    a = numpy.zeros(1000, dtype=[('i', 'i4'), ('f', 'f8')])
+    a['i'] = numpy.arange(a.size)
+    a['f'] = numpy.arange(a.size) % 7
+    q = {'i': {'$gte': 100}, 'f': {'$in': [1, 2]}}
+    d = tempfile.mkdtemp()
+    fn = os.path.join(d, 'a.npy')
+    try:
+        numpy.save(fn, a)
+        m = load(fn)
+        assert isinstance(m, numpy.memmap)
+        inds = numpy.flatnonzero(query.mask(a, q))
+        assert numpy.all(query_inds(fn, q, chunksize=33) == inds)
+        assert numpy.all(query_inds(m, q) == inds)
+        assert len(query_inds(m, {'i': -1}, chunksize=33)) == 0
+        rows = query_array(fn, q, chunksize=100)
+        assert len(rows) == len(inds)
+        assert numpy.all(rows['i'] == a['i'][inds])
+        assert rows[0] == a[inds[0]]
+        assert numpy.all(rows[:5] == a[inds[:5]])
+        assert numpy.all(numpy.asarray(rows) == a[inds])
+        assert [r['i'] for r in rows] == list(a['i'][inds])
+        minds = mask_inds(fn, (100, 3), ('greater_equal', 'equal'),
+                          ('i', 'f'), chunksize=33)
+        assert numpy.all(minds == numpy.flatnonzero(
+            (a['i'] >= 100) & (a['f'] == 3)))
+        del m, rows
+    finally:
+        os.remove(fn)
+        os.rmdir(d)
+
+
+def test_rows_chunks():
+    global chunk_bytes
+    # wide rows, chunks are sized by the row (not index) size
+    a = numpy.zeros(100, dtype=[('w', 'f8', 64)])
+    a['w'] = numpy.arange(100)[:, None]
+    rows = Rows(a, numpy.arange(0, 100, 2))
+    old = chunk_bytes
+    try:
+        chunk_bytes = a.dtype.itemsize * 7
+        assert [len(c) for c in rows.chunk_inds()] == [7] * 7 + [1]
+        assert [r['w'][0] for r in rows] == range(0, 100, 2)
+    finally:
+        chunk_bytes = old
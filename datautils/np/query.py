@@ -1,98 +1,350 @@
 #!/usr/bin/env python
 """
-Top level conditional queries do not work. For example:
-
-{'$and': [...]} will instead look for a $and field in the array
+Mongo-like queries on numpy structured arrays
+
+Fields are addressed by name ('a') or, for nested dtypes, by a dotted
+name ('a.b'). Missing fields never match (except {'$exists': False}).
+Fields with more than one dimension (e.g. ('a', 'f4', (3,))) are
+treated like lists: a row matches if any element matches (see also
+$all, $size and $elemMatch).
+
+Supported operators:
+    logical (top level or value): $and, $or, $nor
+    value: $lt, $lte, $gt, $gte, $eq, $ne, $in, $nin, $all, $mod, $size,
+        $exists, $elemMatch, $not
+
+Queries are evaluated one item at a time. When few rows match the
+previous items (see sparse_density) the next item is only evaluated for
+those rows (by index), otherwise it is evaluated for all rows and the
+masks are combined.
 """
 
+import math
+import warnings
+
 import numpy
 
+from ..ddict import key_path
 from ..listify import listify
 
 
+logical_ops = ('$and', '$or', '$nor')
+# evaluate query items for surviving rows by index (rather than by mask)
+# when fewer than this fraction of rows survive (see mask)
+sparse_density = 0.3
+
+
+def get_column(array, key):
+    """
+    Get a (possibly nested) field by dotted key, raises KeyError if the
+    field does not exist. Field names that contain '.' are found by
+    trying the rest of the key as a field name before splitting it.
+    """
+    a = array
+    keys = key_path(key).keys
+    for (i, k) in enumerate(keys):
+        names = a.dtype.names
+        if names is None:
+            raise KeyError(key)
+        rest = '.'.join(keys[i:])
+        if rest in names:
+            return a[rest]
+        if k not in names:
+            raise KeyError(key)
+        a = a[k]
+    return a
+
+
+def reduce_rows(m):
+    """
+    Reduce an element mask to a row mask (any element in a row)
+    """
+    if m.ndim > 1:
+        return numpy.any(m.reshape(m.shape[0], -1), 1)
+    return m
+
+
+def eq_elements(a, v):
+    """
+    Element-wise equality with nan == nan (like qfilter)
+    """
+    if isinstance(v, float) and math.isnan(v):
+        if a.dtype.kind in 'fc':
+            return numpy.isnan(a)
+        return numpy.zeros(a.shape, dtype=bool)
+    with warnings.catch_warnings():
+        # comparison of incompatible types returns a scalar (and warns)
+        warnings.simplefilter('ignore')
+        m = a == v
+    if not isinstance(m, numpy.ndarray):
+        return numpy.zeros(a.shape, dtype=bool)
+    return m
+
+
+def in_elements(a, v):
+    return numpy.in1d(a.ravel(), listify(v)).reshape(a.shape)
+
+
+def mod_elements(a, v):
+    d, r = v
+    return numpy.mod(a, d) == r
+
+
+# element-wise tests, each returns a mask the same shape as a
+etests = {
+    '$lt': numpy.less,
+    '$lte': numpy.less_equal,
+    '$gt': numpy.greater,
+    '$gte': numpy.greater_equal,
+    '$eq': eq_elements,
+    '$ne': lambda a, v: numpy.logical_not(eq_elements(a, v)),
+    '$in': in_elements,
+    '$nin': lambda a, v: numpy.logical_not(in_elements(a, v)),
+    '$mod': mod_elements,
+}
+
+
+def element_mask(a, v):
+    """
+    Element-wise mask for a value query (used by $elemMatch)
+    """
+    if not isinstance(v, dict):
+        return eq_elements(a, v)
+    m = numpy.ones(a.shape, dtype=bool)
+    with numpy.errstate(invalid='ignore'):  # nan comparisons
+        for op, t in v.iteritems():
+            m &= etests[op](a, t)
+    return m
+
+
 def not_vtest(a, v):
-    assert isinstance(v, dict)
-    assert len(v.keys()) == 1
-    op = v.keys()[0]
-    val = v[op]
-    return numpy.logical_not(value_test(a, op, val))
+    return numpy.logical_not(value_mask(a, v))
 
 
 def and_vtest(a, v):
     assert isinstance(v, (tuple, list))
-    m = numpy.ones(a.size, dtype=bool)
-    for subq in v:
-        m = numpy.logical_and(m, value_test(a, subq, m))
+    m = numpy.ones(len(a), dtype=bool)
+    for subv in v:
+        m &= value_mask(a, subv)
     return m
 
 
 def or_vtest(a, v):
     assert isinstance(v, (tuple, list))
-    m = numpy.zeros(a.size, dtype=bool)
-    for subq in v:
-        m = numpy.logical_or(m, value_test(a, subq, m))
+    m = numpy.zeros(len(a), dtype=bool)
+    for subv in v:
+        m |= value_mask(a, subv)
     return m
 
 
 def all_vtest(a, v):
-    # find doc fields that contain all values[v]
-    assert a.ndim > 1
-    m = numpy.ones(a.size, dtype=bool)
-    for iv in v:
-        m = numpy.logical_and(
-            m, numpy.any(numpy.in1d(a, [iv, ]).reshape(a.shape), 1))
+    # find rows that contain all values[v]
+    m = numpy.ones(len(a), dtype=bool)
+    for iv in listify(v):
+        m &= reduce_rows(eq_elements(a, iv))
     return m
 
 
+def size_vtest(a, v):
+    if a.ndim > 1:
+        n = numpy.prod(a.shape[1:])
+        return numpy.ones(len(a), dtype=bool) & (n == v)
+    if a.dtype.kind == 'O':
+        return numpy.array(
+            [hasattr(i, '__len__') and (len(i) == v) for i in a],
+            dtype=bool)
+    return numpy.zeros(len(a), dtype=bool)
+
+
+# row tests, each returns a mask of length len(a)
 vtests = {
-    #'$exists':,  # doesn't really make sense
-    '$lt': numpy.less,
-    '$lte': numpy.less_equal,
-    '$gt': numpy.greater,
-    '$gte': numpy.greater_equal,
-    '$ne': numpy.not_equal,
+    '$lt': lambda a, v: reduce_rows(numpy.less(a, v)),
+    '$lte': lambda a, v: reduce_rows(numpy.less_equal(a, v)),
+    '$gt': lambda a, v: reduce_rows(numpy.greater(a, v)),
+    '$gte': lambda a, v: reduce_rows(numpy.greater_equal(a, v)),
+    '$eq': lambda a, v: reduce_rows(eq_elements(a, v)),
+    # no element is equal to/in v
+    '$ne': lambda a, v: numpy.logical_not(reduce_rows(eq_elements(a, v))),
+    '$in': lambda a, v: reduce_rows(in_elements(a, v)),
+    '$nin': lambda a, v: numpy.logical_not(reduce_rows(in_elements(a, v))),
+    '$mod': lambda a, v: reduce_rows(mod_elements(a, v)),
     '$all': all_vtest,
-    # TODO not sure how this behaves for a.ndim > 1
-    '$in': lambda a, v: numpy.in1d(a, listify(v)),
-    '$nin': lambda a, v: numpy.logical_not(numpy.in1d(a, listify(v))),
+    '$size': size_vtest,
+    '$elemMatch': lambda a, v: reduce_rows(element_mask(a, v)),
     '$not': not_vtest,
     '$and': and_vtest,
     '$or': or_vtest,
     '$nor': lambda a, v: numpy.logical_not(or_vtest(a, v)),
-
-    #'$elemMatch':,
 }
 
 
 def value_test(vs, k, v):
-    return vtests[k](vs, v)
+    with numpy.errstate(invalid='ignore'):  # nan comparisons
+        return vtests[k](vs, v)
+
+
+def value_mask(a, v):
+    """
+    Row mask for a value query (a dict of operators or a value)
+    """
+    if not isinstance(v, dict):
+        return reduce_rows(eq_elements(a, v))
+    m = numpy.ones(len(a), dtype=bool)
+    for k, sv in v.iteritems():
+        m &= value_test(a, k, sv)
+    return m
 
 
-def subparse(vs, q, mask):
-    for k, v in q.iteritems():
-        mask = numpy.logical_and(mask, value_test(vs, k, v))
-    return mask
+def count(rows):
+    """
+    Number of rows in a bool mask or index array
+    """
+    if rows.dtype == bool:
+        return numpy.count_nonzero(rows)
+    return len(rows)
 
 
-def mask(array, query, mask=None):
-    if mask is None:
-        mask = numpy.ones(array.size, dtype=bool)
+def to_dense(rows, n):
+    """
+    Convert rows (bool mask or index array) to a bool mask of length n
+    """
+    if rows.dtype == bool:
+        return rows
+    m = numpy.zeros(n, dtype=bool)
+    m[rows] = True
+    return m
+
+
+def to_sparse(rows):
+    """
+    Convert rows (bool mask or index array) to an index array
+    """
+    if rows.dtype == bool:
+        return numpy.flatnonzero(rows)
+    return rows
+
+
+def select(rows, n, density):
+    """
+    Use an index array if fewer than density * n rows remain (or density
+    is at least 1), else a mask
+    """
+    if (density >= 1) or (count(rows) < density * n):
+        return to_sparse(rows)
+    return to_dense(rows, n)
+
+
+def union(r0, r1, n):
+    if (r0.dtype != bool) and (r1.dtype != bool):
+        return numpy.union1d(r0, r1)
+    return to_dense(r0, n) | to_dense(r1, n)
+
+
+def difference(r0, r1, n):
+    if (r0.dtype != bool) and (r1.dtype != bool):
+        return numpy.setdiff1d(r0, r1, assume_unique=True)
+    return to_dense(r0, n) & ~to_dense(r1, n)
+
+
+def none_of(rows):
+    if rows.dtype == bool:
+        return numpy.zeros_like(rows)
+    return rows[:0]
+
+
+def item_rows(array, key, v, rows):
+    """
+    Rows (subset of rows) that match a query item
+
+    For a mask (dense rows) the test is run on the whole column (avoiding
+    a copy), for indices (sparse rows) only the indexed rows are tested
+    """
+    if isinstance(v, dict) and '$exists' in v:
+        v = v.copy()
+        exists = v.pop('$exists')
     else:
-        if numpy.sum(mask) == 0:  # short circuit
-            return mask
-    # keys are columns
+        exists = True
+    try:
+        a = get_column(array, key)
+    except KeyError:
+        return none_of(rows) if exists else rows
+    if not exists:
+        return none_of(rows)
+    if rows.dtype == bool:
+        return rows & value_mask(a, v)
+    return rows[value_mask(a[rows], v)]
+
+
+def logical_rows(array, op, qs, rows, density):
+    """
+    Rows (subset of rows) that match a logical ($and...) query
+    """
+    if op == '$and':
+        for q in qs:
+            rows = query_rows(array, q, rows, density)
+        return rows
+    n = array.size
+    remaining = rows
+    matched = none_of(rows)
+    for q in qs:
+        if not count(remaining):
+            break
+        r = query_rows(array, q, remaining, density)
+        matched = union(matched, r, n)
+        remaining = difference(remaining, r, n)
+    if op == '$or':
+        return matched
+    elif op == '$nor':
+        return remaining
+    raise ValueError("Unknown logical operator: %s" % op)
+
+
+def query_rows(array, query, rows, density):
+    """
+    Rows (subset of rows, a bool mask or index array) that match query
+    """
+    n = array.size
     for k, v in query.iteritems():
-        if isinstance(v, dict):
-            mask = subparse(array[k], v, mask)
+        if not count(rows):  # short circuit
+            break
+        if k in logical_ops:
+            rows = logical_rows(array, k, v, rows, density)
         else:
-            if array[k].ndim > 1:
-                mask = numpy.logical_and(numpy.any(
-                    numpy.in1d(array[k], [v, ]).reshape(array[k].shape), 1))
-            else:
-                mask = numpy.logical_and(mask, array[k] == v)
-        if numpy.sum(mask) == 0:  # short circuit
-            return mask
-    return mask
+            rows = item_rows(array, k, v, rows)
+        rows = select(rows, n, density)
+    return rows
+
+
+def query_inds(array, query, inds=None, density=None):
+    """
+    Indices (subset of inds) for rows matching query
+    """
+    if inds is None:
+        inds = numpy.arange(array.size)
+    density = sparse_density if density is None else density
+    return to_sparse(query_rows(array, query, inds, density))
+
+
+def mask(array, query, mask=None, density=None):
+    """
+    Return a bool array, True for rows that match query
+
+    mask : bool array (default=None)
+        if provided, only evaluate the query for rows where mask is True
+
+    density : float (default=None)
+        when fewer than density of the rows still match, evaluate later
+        query items only for those rows (by index), otherwise evaluate
+        items for all rows and combine masks. 0 always uses masks,
+        1 always uses indices. None uses sparse_density
+    """
+    density = sparse_density if density is None else density
+    if mask is None:
+        rows = numpy.ones(array.size, dtype=bool)
+    else:
+        rows = numpy.asarray(mask, dtype=bool).copy()
+    rows = select(rows, array.size, density)
+    return to_dense(query_rows(array, query, rows, density), array.size)
 
 
 def query_array(array, q):
@@ -118,16 +370,16 @@ def test():
     assert qa({'f': {'$lt': 98}}).size == 1
     #assert qa({'s': {'$lt': 98}}).size == 1
 
-    assert qa({'i': {'$gt': 106}}).size == 1
-    assert qa({'f': {'$gt': 106}}).size == 1
+    assert qa({'i': {'$gt': 105}}).size == 1
+    assert qa({'f': {'$gt': 105}}).size == 1
     #assert qa({'s': {'$gt': 106}}).size == 1
 
     assert qa({'i': {'$lte': 98}}).size == 2
     assert qa({'f': {'$lte': 98}}).size == 2
     #assert qa({'s': {'$lte': 98}}).size == 2
 
-    assert qa({'i': {'$gte': 106}}).size == 2
-    assert qa({'f': {'$gte': 106}}).size == 2
+    assert qa({'i': {'$gte': 105}}).size == 2
+    assert qa({'f': {'$gte': 105}}).size == 2
     #assert qa({'s': {'$gte': 106}}).size == 2
 
     assert qa({'i': {'$ne': 97}}).size == a.size - 1
@@ -139,10 +391,72 @@ def test():
     assert qa({'a': {'$all': [97, 194]}}).size == 1
     assert qa({'a': {'$all': [97, 195]}}).size == 0
 
-    #'$in': lambda a, v: numpy.any(numpy.in1d(v, a)),
-    #'$nin': lambda a, v: numpy.logical_not(numpy.any(numpy.in1d(a, v))),
-    #'$not': not_vtest,
-    #'$and': and_vtest,
-    #'$or': or_vtest,
-    #'$nor': lambda a, v: numpy.logical_not(or_vtest(a, v)),
-    pass
+    assert qa({'i': {'$in': [97, 98, 200]}}).size == 2
+    assert qa({'i': {'$nin': [97, 98, 200]}}).size == a.size - 2
+    assert qa({'a': 194}).size == 1
+    assert qa({'a': {'$in': [194, 196]}}).size == 2
+    assert qa({'i': {'$not': {'$gt': 98}}}).size == 2
+    assert qa({'i': {'$and': [{'$gt': 98}, {'$lt': 101}]}}).size == 2
+    assert qa({'i': {'$or': [{'$lt': 98}, {'$gt': 105}]}}).size == 2
+    assert qa({'i': {'$nor': [{'$lt': 98}, {'$gt': 105}]}}).size == 8
+
+    # top level logical operators
+    assert qa({'$or': [{'i': 97}, {'s': 'b'}, {'f': 97}]}).size == 2
+    assert qa({'$and': [{'i': {'$gt': 97}}, {'f': {'$lt': 100}}]}).size == 2
+    assert qa({'$nor': [{'i': 97}, {'s': 'b'}]}).size == a.size - 2
+    assert qa({'$or': [{'i': 97}], 's': 'b'}).size == 0
+
+    # exists, mod, size, elemMatch
+    assert qa({'i': {'$exists': True}}).size == a.size
+    assert qa({'i': {'$exists': False}}).size == 0
+    assert qa({'x': {'$exists': False}}).size == a.size
+    assert qa({'x': 1}).size == 0
+    assert qa({'i': {'$mod': [2, 0]}}).size == 5
+    assert qa({'a': {'$size': 3}}).size == a.size
+    assert qa({'a': {'$size': 2}}).size == 0
+    assert qa({'a': {'$elemMatch': {'$gt': 300, '$lt': 304}}}).size == 1
+    assert qa({'a': {'$gt': 300, '$lt': 304}}).size == 6
+
+    # nested fields and nan
+    nt = numpy.dtype([('b', [('c', 'f8')]), ('d', 'i4')])
+    n = numpy.zeros(4, dtype=nt)
+    n['b']['c'] = [0., numpy.nan, 2., numpy.nan]
+    assert query_array(n, {'b.c': float('nan')}).size == 2
+    assert query_array(n, {'b.c': {'$ne': float('nan')}}).size == 2
+    assert mask(n, {'b.c': {'$gte': 0}}, mask=[1, 1, 0, 0]).sum() == 1
+
+
+def test_dotted_field_names():
+    a = numpy.zeros(3, dtype=[('a.b', 'i4'), ('c', [('d.e', 'i4')])])
+    a['a.b'] = [1, 2, 3]
+    a['c']['d.e'] = [3, 2, 1]
+    assert numpy.all(get_column(a, 'a.b') == [1, 2, 3])
+    assert query_inds(a, {'a.b': {'$gt': 1}}).tolist() == [1, 2]
+    assert query_inds(a, {'c.d.e': 3}).tolist() == [0]
+    try:
+        get_column(a, 'a.c')
+        assert False
+    except KeyError:
+        pass
+
+
+def test_density():
+    r = numpy.random.RandomState(0)
+    a = numpy.zeros(1000, dtype=[('x', 'f8'), ('y', 'i4'), ('z', 'i4', (2,))])
+    a['x'] = r.rand(a.size)
+    a['y'] = r.randint(0, 10, a.size)
+    a['z'] = r.randint(0, 10, (a.size, 2))
+    qs = [
+        {'x': {'$lt': 0.01}, 'y': 1},
+        {'x': {'$lt': 0.9}, 'y': {'$in': [1, 2, 3]}, 'z': 4},
+        {'$or': [{'x': {'$lt': 0.05}}, {'y': 3, 'z': {'$all': [1, 2]}}]},
+        {'$nor': [{'x': {'$gt': 0.5}}, {'y': 3}], 'z': {'$nin': [1]}},
+        {'y': {'$gt': 100}, 'x': 0.5},
+    ]
+    assert select(numpy.ones(4, dtype=bool), 4, 1).tolist() == [0, 1, 2, 3]
+    assert select(numpy.arange(4), 4, 0).dtype == bool
+    for q in qs:
+        m = mask(a, q, density=0)
+        assert numpy.all(m == mask(a, q, density=1))
+        assert numpy.all(m == mask(a, q))
+        assert numpy.all(numpy.flatnonzero(m) == query_inds(a, q))
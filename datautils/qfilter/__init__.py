@@ -1,7 +1,22 @@
 #!/usr/bin/env python
 
+import warnings
+
+from . import index
+from . import planner
 from . import query
-from .query import qfilter
+from .index import IndexedCollection
+from .planner import PlannedQuery
+from .query import qfilter, iqfilter, compile_query, CompiledQuery
 qf = qfilter
 
-__all__ = ['query', 'qf', 'qfilter']
+__all__ = [
+    'index', 'planner', 'query', 'qf', 'qfilter', 'iqfilter',
+    'compile_query', 'CompiledQuery', 'IndexedCollection', 'PlannedQuery']
+
+try:
+    from . import columnar
+    from .columnar import ColumnarCollection, vqfilter
+    __all__.extend(['columnar', 'ColumnarCollection', 'vqfilter'])
+except ImportError as E:
+    warnings.warn('datautils.qfilter.columnar failed to import with: %s' % E)
@@ -0,0 +1,352 @@
+#!/usr/bin/env python
+"""
+Vectorized (numpy) mongo-like queries on a list of dicts
+
+A ColumnarCollection pulls the values for each queried (dotted) key out
+of the documents once and stores them as a numpy column with a mask of
+which documents contain the key (so $exists works). Queries are then
+evaluated as numpy masks.
+
+Columns are typed by the values they contain:
+    number : all values are int, long, float or bool (stored as float64)
+    str : all values are str
+    unicode : all values are unicode
+    object : anything else (including lists and sub-documents)
+
+Operators that can't be evaluated exactly with numpy for a column type
+(for example $all, $elemMatch, or comparing a number column to a
+unicode value) fall back to the qfilter (python) value tests for the
+documents still matching the query, so results are the same as qfilter.
+
+Example
+------
+
+cc = ColumnarCollection(docs)
+cc.filter({'a.b': {'$gt': 1}})  # same as qfilter(docs, {'a.b': {'$gt': 1}})
+cc.count({'a.b': {'$gt': 1, '$lt': 10}})  # columns are reused
+"""
+
+import math
+import operator
+
+import numpy
+
+from .query import CompiledQuery, compile_value_test, make_getter, \
+    qfilter
+
+
+number_types = (int, long, float, bool)
+# largest integer that can be exactly stored as a float64
+max_exact_int = 2 ** 53
+
+# string arrays don't support the numpy.less... ufuncs
+comparisons = {
+    '$lt': operator.lt,
+    '$lte': operator.le,
+    '$gt': operator.gt,
+    '$gte': operator.ge,
+}
+
+
+def is_number(v):
+    if type(v) not in number_types:
+        return False
+    if isinstance(v, (int, long)) and (abs(v) > max_exact_int):
+        return False
+    return True
+
+
+def is_nan(v):
+    return isinstance(v, float) and math.isnan(v)
+
+
+class Column(object):
+    """
+    Values for one key from a list of documents
+
+    objects : list
+        python values (None where missing)
+
+    valid : numpy bool array
+        True where the document contains the key
+
+    values : numpy array
+        typed values (filled where missing)
+
+    kind : str
+        'number', 'str', 'unicode' or 'object'
+    """
+    def __init__(self, docs, key):
+        get = make_getter(key)
+        n = len(docs)
+        self.key = key
+        self.objects = [None] * n
+        self.valid = numpy.zeros(n, dtype=bool)
+        for (i, d) in enumerate(docs):
+            try:
+                self.objects[i] = get(d)
+            except:
+                continue
+            self.valid[i] = True
+        self.kind = self.find_kind()
+        if self.kind == 'number':
+            self.values = numpy.array(
+                [0. if v is None else v for v in self.objects],
+                dtype='f8')
+        elif self.kind == 'str':
+            self.values = numpy.array(
+                ['' if v is None else v for v in self.objects], dtype=str)
+        elif self.kind == 'unicode':
+            self.values = numpy.array(
+                [u'' if v is None else v for v in self.objects],
+                dtype=unicode)
+        else:
+            self.values = numpy.empty(n, dtype=object)
+            for (i, v) in enumerate(self.objects):
+                self.values[i] = v
+
+    def find_kind(self):
+        vs = [v for (v, ok) in zip(self.objects, self.valid) if ok]
+        if not len(vs):
+            return 'object'
+        if all([is_number(v) for v in vs]):
+            return 'number'
+        # numpy strips trailing nulls
+        for (kind, t) in (('str', str), ('unicode', unicode)):
+            if all([(type(v) is t) and (not v.endswith('\x00'))
+                    for v in vs]):
+                return kind
+        return 'object'
+
+    def matches_type(self, t):
+        """
+        Can t be compared to values with numpy
+        """
+        if self.kind == 'number':
+            return is_number(t)
+        if self.kind == 'str':
+            return type(t) is str
+        if self.kind == 'unicode':
+            return type(t) is unicode
+        return False
+
+    def never_equal(self, t):
+        """
+        Is t a value that can never equal (==) a value in this column
+        """
+        if self.kind == 'number':
+            return type(t) in (str, unicode, type(None))
+        if self.kind in ('str', 'unicode'):
+            return (type(t) is type(None)) or is_number(t)
+        return False
+
+    def __len__(self):
+        return len(self.objects)
+
+
+def python_mask(col, value, rows):
+    """
+    Run the qfilter value test for value on all rows (of col)
+    """
+    test = compile_value_test(value)
+    m = numpy.zeros(len(col), dtype=bool)
+    for i in numpy.flatnonzero(rows & col.valid):
+        m[i] = test(col.objects[i])
+    return m
+
+
+def eq_mask(col, t, rows):
+    """
+    Mask where values are equal (see query.eq) to t
+    """
+    if col.matches_type(t):
+        if is_nan(t):
+            return numpy.isnan(col.values)
+        return col.values == t
+    if col.never_equal(t):
+        return numpy.zeros(len(col), dtype=bool)
+    return python_mask(col, t, rows)
+
+
+def in_mask(col, t, rows):
+    """
+    Mask where values are in t
+    """
+    if (col.kind != 'object') and \
+            isinstance(t, (tuple, list, set, frozenset)):
+        ts = []
+        for i in t:
+            if col.matches_type(i) and not is_nan(i):
+                ts.append(i)
+            elif not col.never_equal(i):
+                # nan can match by identity, fall back to python
+                break
+        else:
+            return numpy.in1d(col.values, ts)
+    return python_mask(col, {'$in': t}, rows)
+
+
+def or_mask(col, t, rows):
+    m = numpy.zeros(len(col), dtype=bool)
+    remaining = rows.copy()
+    for sv in t:
+        sm = value_mask(col, sv, remaining) & remaining
+        m |= sm
+        remaining &= ~sm
+    return m
+
+
+def and_mask(col, t, rows):
+    m = rows.copy()
+    for sv in t:
+        m &= value_mask(col, sv, m)
+    return m
+
+
+def op_mask(col, op, t, rows):
+    """
+    Mask for one value test operator (see query.vtests)
+    """
+    if op in comparisons and col.matches_type(t):
+        with numpy.errstate(invalid='ignore'):  # nan comparisons
+            return comparisons[op](col.values, t)
+    if op == '$ne' and (col.kind != 'object'):
+        return numpy.logical_not(eq_mask(col, t, rows))
+    if op == '$in':
+        return in_mask(col, t, rows)
+    if op == '$nin':
+        return numpy.logical_not(in_mask(col, t, rows))
+    if op == '$not':
+        return numpy.logical_not(value_mask(col, t, rows))
+    if op == '$or':
+        return or_mask(col, t, rows)
+    if op == '$and':
+        return and_mask(col, t, rows)
+    if op == '$nor':
+        return numpy.logical_not(or_mask(col, t, rows))
+    return python_mask(col, {op: t}, rows)
+
+
+def value_mask(col, value, rows):
+    """
+    Mask of values (in col) that pass a query value test (only
+    valid where rows is True)
+    """
+    if not isinstance(value, dict):
+        if col.kind == 'object':
+            return python_mask(col, value, rows)
+        return eq_mask(col, value, rows)
+    m = rows.copy()
+    for (op, t) in value.iteritems():
+        m &= op_mask(col, op, t, m)
+    return m
+
+
+class ColumnarCollection(object):
+    """
+    Run queries on a list of dicts using numpy masks
+
+    Columns are extracted the first time a key is queried and reused
+    for later queries so the collection should not be modified.
+    """
+    def __init__(self, docs):
+        self.docs = docs if isinstance(docs, list) else list(docs)
+        self.columns = {}
+
+    def column(self, key):
+        if key not in self.columns:
+            self.columns[key] = Column(self.docs, key)
+        return self.columns[key]
+
+    def item_mask(self, key, value, rows):
+        col = self.column(key)
+        if isinstance(value, dict) and '$exists' in value:
+            value = value.copy()
+            if not value['$exists']:  # test for non-existance
+                return rows & ~col.valid
+            del value['$exists']
+        return rows & col.valid & value_mask(col, value, rows & col.valid)
+
+    def mask(self, query):
+        """
+        Return a bool array, True for documents that match query
+        """
+        if isinstance(query, CompiledQuery):
+            query = query.query
+        rows = numpy.ones(len(self.docs), dtype=bool)
+        for (k, v) in query.iteritems():
+            rows = self.item_mask(k, v, rows)
+            if not rows.any():  # short-circuit
+                break
+        return rows
+
+    def indices(self, query):
+        return numpy.flatnonzero(self.mask(query))
+
+    def filter(self, query):
+        if query == {}:  # short-circuit
+            return self.docs
+        return [self.docs[i] for i in self.indices(query)]
+
+    def count(self, query):
+        return int(numpy.sum(self.mask(query)))
+
+    def __len__(self):
+        return len(self.docs)
+
+
+def vqfilter(data, query):
+    """
+    qfilter using a ColumnarCollection
+    """
+    return ColumnarCollection(data).filter(query)
+
+
+# ------------------ tests ------------------
+def test_columnar_collection():
+    nan = float('nan')
+    docs = [
+        {'a': {'b': 1}, 'f': 1.5, 's': 'x', 'u': u'x', 'l': [1, 2], 'm': 1},
+        {'a': {'b': 2}, 'f': nan, 's': 'y', 'u': u'y', 'l': [3], 'm': 'x'},
+        {'a': {'b': 3}, 'f': 2.5, 's': 'z', 'l': 1, 'm': None},
+        {'a': {'b': True}, 'f': -1, 'u': u'z', 'm': [1, 2]},
+        {'a': 1, 'm': {'n': 1}},
+        {},
+    ]
+    queries = [
+        {},
+        {'a.b': 1},
+        {'a.b': {'$exists': True}},
+        {'a.b': {'$exists': False}},
+        {'a.b': {'$gt': 1, '$lte': 3}},
+        {'a.b': {'$in': [1, 3, 'x']}},
+        {'a.b': {'$nin': [2]}},
+        {'a.b': {'$ne': 2}},
+        {'a.b': {'$not': {'$gt': 1}}},
+        {'a.b': {'$or': [{'$lt': 2}, {'$gt': 2}]}},
+        {'a.b': {'$nor': [{'$lt': 2}, {'$gt': 2}]}},
+        {'a.b': {'$and': [{'$gt': 1}, {'$lt': 3}]}},
+        {'f': nan},
+        {'f': {'$ne': nan}},
+        {'f': {'$lt': 2}},
+        {'f': {'$lt': 'a'}},
+        {'s': 'y'},
+        {'s': u'y'},
+        {'s': {'$gte': 'y'}},
+        {'s': {'$in': ['x', 'z', 1]}},
+        {'u': u'y'},
+        {'u': {'$lt': u'z'}},
+        {'l': 1},
+        {'l': {'$in': [2, 3]}},
+        {'l': {'$ne': [3]}},
+        {'m': 1},
+        {'m': {'$in': [None, 'x']}},
+        {'m': {'$exists': True, '$ne': None}},
+        {'m.n': 1},
+        {'a.b': {'$gte': 2}, 's': {'$exists': True}},
+    ]
+    cc = ColumnarCollection(docs)
+    for q in queries:
+        assert cc.filter(q) == qfilter(docs, q), q
+        assert cc.count(q) == len(qfilter(docs, q)), q
+    assert vqfilter(docs, {'a.b': 1}) == qfilter(docs, {'a.b': 1})
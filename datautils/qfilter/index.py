@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+"""
+Indexed collections of dicts for repeated mongo-like queries
+
+An IndexedCollection keeps a list of dicts and any number of indexes
+on (dotted) keys:
+
+    hash indexes : used for equality and $in tests
+    sorted indexes : used for $lt, $lte, $gt and $gte tests
+
+When filtering, each indexed query item is used to find a set of
+candidate documents (a superset of the matching documents). The
+candidates are then tested with the full query (see CompiledQuery) so
+the results are the same as qfilter on the same documents (in the same
+order).
+
+Indexes are updated when documents are appended or removed. Documents
+that are modified after being added should be removed and re-added.
+
+Example
+------
+
+ic = IndexedCollection(docs)
+ic.create_index('subject.name')
+ic.create_index('session.value', sorted=True)
+ic.filter({'subject.name': 's1', 'session.value': {'$gt': 0.5}})
+ic.append({'subject': {'name': 's1'}, 'session': {'value': 1.0}})
+"""
+
+import bisect
+import collections
+import itertools
+import math
+
+from .query import compile_query, make_getter, qfilter
+
+
+number_types = (int, long, float, bool)
+
+
+def is_hashable(v):
+    try:
+        hash(v)
+    except TypeError:
+        return False
+    return True
+
+
+def is_nan(v):
+    return isinstance(v, float) and math.isnan(v)
+
+
+def family(v):
+    """
+    Values are only sorted with other values of the same family
+    (None for values that are not sorted)
+    """
+    if type(v) in number_types:
+        return None if is_nan(v) else 'number'
+    if type(v) in (str, unicode):
+        return type(v).__name__
+    return None
+
+
+class Index(object):
+    """
+    Base index, subclasses must define add, remove and candidates
+    """
+    def __init__(self, key):
+        self.key = key
+        self.get = make_getter(key)
+
+    def value(self, doc):
+        """
+        Get the indexed value from doc, raises KeyError if missing
+        """
+        try:
+            return self.get(doc)
+        except:
+            raise KeyError(self.key)
+
+
+class HashIndex(Index):
+    """
+    Index documents by value (and by item for list values)
+
+    Documents with unhashable values are always returned as candidates.
+    """
+    def __init__(self, key):
+        Index.__init__(self, key)
+        self.index = {}
+        self.unhashable = set()
+        self.entries = {}
+
+    def add(self, docid, doc):
+        try:
+            v = self.value(doc)
+        except KeyError:
+            return
+        vs = v if isinstance(v, (tuple, list)) else (v, )
+        if not all([is_hashable(i) for i in vs]):
+            self.unhashable.add(docid)
+            self.entries[docid] = None
+            return
+        for i in vs:
+            self.index.setdefault(i, set()).add(docid)
+        self.entries[docid] = vs
+
+    def remove(self, docid):
+        if docid not in self.entries:
+            return
+        vs = self.entries.pop(docid)
+        if vs is None:
+            self.unhashable.discard(docid)
+            return
+        for i in vs:
+            ids = self.index.get(i)
+            if ids is None:
+                continue
+            ids.discard(docid)
+            if not len(ids):
+                del self.index[i]
+
+    def lookup(self, values):
+        """
+        Candidate ids for documents with a value (or item) in values
+        returns None if any value can't be looked up
+        """
+        ids = set()
+        for v in values:
+            if isinstance(v, dict) or is_nan(v) or not is_hashable(v):
+                return None
+            ids.update(self.index.get(v, ()))
+        return ids | self.unhashable
+
+    def candidates(self, op, t):
+        """
+        Candidate ids for a value test (op, t), None if the index can't
+        be used for this test
+        """
+        if op == '$eq':
+            return self.lookup((t, ))
+        if op == '$in' and isinstance(t, (tuple, list, set, frozenset)):
+            return self.lookup(t)
+        return None
+
+
+class SortedIndex(Index):
+    """
+    Index documents by sorted values
+
+    Numbers, str and unicode values are each kept in a sorted list.
+    All other values (and documents whose value family doesn't match
+    the tested value) are always returned as candidates.
+    """
+    def __init__(self, key):
+        Index.__init__(self, key)
+        self.sorted = {}  # family : sorted [(value, docid), ...]
+        self.ids = {}  # family : set of docids
+        self.entries = {}
+
+    def add(self, docid, doc):
+        try:
+            v = self.value(doc)
+        except KeyError:
+            return
+        f = family(v)
+        if f is not None:
+            bisect.insort(self.sorted.setdefault(f, []), (v, docid))
+        self.ids.setdefault(f, set()).add(docid)
+        self.entries[docid] = (f, v)
+
+    def remove(self, docid):
+        if docid not in self.entries:
+            return
+        f, v = self.entries.pop(docid)
+        if f is not None:
+            l = self.sorted[f]
+            del l[bisect.bisect_left(l, (v, docid))]
+        self.ids[f].discard(docid)
+
+    def candidates(self, op, t):
+        if op not in ('$lt', '$lte', '$gt', '$gte'):
+            return None
+        f = family(t)
+        if f is None:
+            return None
+        l = self.sorted.get(f, [])
+        if op in ('$lt', '$gte'):
+            i = bisect.bisect_left(l, (t, ))
+        else:
+            i = bisect.bisect_right(l, (t, float('inf')))
+        if op in ('$lt', '$lte'):
+            ids = set([e[1] for e in l[:i]])
+        else:
+            ids = set([e[1] for e in l[i:]])
+        # add all values not in this family
+        for (of, oids) in self.ids.iteritems():
+            if of != f:
+                ids.update(oids)
+        return ids
+
+
+class IndexedCollection(object):
+    """
+    A list of dicts with indexes on some keys (see create_index)
+    """
+    def __init__(self, docs=None):
+        self.docs = collections.OrderedDict()
+        self.indexes = {}
+        self.ids = {}  # id(doc) : docid
+        self._next_id = itertools.count()
+        if docs is not None:
+            self.extend(docs)
+
+    def create_index(self, key, sorted=False):
+        """
+        Create (and fill) a hash index (or sorted index if sorted=True)
+        """
+        index = SortedIndex(key) if sorted else HashIndex(key)
+        for (docid, doc) in self.docs.iteritems():
+            index.add(docid, doc)
+        self.indexes.setdefault(key, []).append(index)
+        return index
+
+    def drop_index(self, key):
+        del self.indexes[key]
+
+    def append(self, doc):
+        docid = self._next_id.next()
+        self.docs[docid] = doc
+        self.ids[id(doc)] = docid
+        for indexes in self.indexes.itervalues():
+            for index in indexes:
+                index.add(docid, doc)
+
+    def extend(self, docs):
+        for doc in docs:
+            self.append(doc)
+
+    def find_id(self, doc):
+        docid = self.ids.get(id(doc), None)
+        if (docid is not None) and (self.docs.get(docid) is doc):
+            return docid
+        # fall back to equality (like list.remove)
+        for (docid, d) in self.docs.iteritems():
+            if d == doc:
+                return docid
+        raise ValueError("IndexedCollection.remove(x): x not in collection")
+
+    def remove(self, doc):
+        docid = self.find_id(doc)
+        doc = self.docs.pop(docid)
+        if self.ids.get(id(doc)) == docid:
+            del self.ids[id(doc)]
+        for indexes in self.indexes.itervalues():
+            for index in indexes:
+                index.remove(docid)
+
+    def candidates(self, query):
+        """
+        Find candidate ids for a query using the indexes, returns None
+        if no index could be used
+        """
+        ids = None
+        for (key, value) in query.iteritems():
+            if key not in self.indexes:
+                continue
+            if isinstance(value, dict):
+                tests = [(op, t) for (op, t) in value.iteritems()
+                         if op != '$exists']
+                if not value.get('$exists', True):
+                    tests = []
+            else:
+                tests = [('$eq', value)]
+            for (op, t) in tests:
+                for index in self.indexes[key]:
+                    cids = index.candidates(op, t)
+                    if cids is None:
+                        continue
+                    ids = cids if ids is None else (ids & cids)
+                    if not len(ids):
+                        return ids
+        return ids
+
+    def filter(self, query):
+        if query == {}:
+            return self.docs.values()
+        cq = compile_query(query)
+        ids = self.candidates(cq.query)
+        if ids is None:
+            return cq.filter(self.docs.itervalues())
+        docs = self.docs
+        return [docs[i] for i in sorted(ids) if cq.match(docs[i])]
+
+    def count(self, query):
+        return len(self.filter(query))
+
+    def __iter__(self):
+        return self.docs.itervalues()
+
+    def __len__(self):
+        return len(self.docs)
+
+
+# ------------------ tests ------------------
+def test_indexed_collection():
+    nan = float('nan')
+    docs = [
+        {'a': {'b': i % 5}, 'c': float(i), 'l': [i % 3, 'x'],
+         's': 'abcde'[i % 5]}
+        for i in xrange(50)]
+    docs.extend([
+        {'a': {'b': nan}, 'c': 'x', 'l': [{'y': 1}], 's': u'c'},
+        {'a': {'b': [1, 2]}, 'c': None, 'l': 1, 's': 1},
+        {'a': {'b': True}, 'c': [1], 's': None},
+        {'a': 1},
+        {},
+    ])
+    queries = [
+        {'a.b': 1},
+        {'a.b': nan},
+        {'a.b': {'$in': [2, 3]}},
+        {'a.b': {'$in': [2, [1, 2]]}},
+        {'a.b': {'$exists': False}},
+        {'a.b': {'$exists': True, '$in': [0]}},
+        {'c': {'$gt': 10.5}},
+        {'c': {'$gte': 10, '$lt': 20}},
+        {'c': {'$lte': 'x'}},
+        {'c': {'$lt': nan}},
+        {'l': 2},
+        {'l': {'$in': ['x']}},
+        {'s': {'$gte': 'c'}},
+        {'s': {'$lt': u'c'}},
+        {'a.b': {'$in': [1, 2]}, 'c': {'$lt': 25}, 's': {'$ne': 'b'}},
+    ]
+    ic = IndexedCollection(docs)
+    for key in ('a.b', 'l', 's'):
+        ic.create_index(key)
+    for key in ('c', 's', 'a.b'):
+        ic.create_index(key, sorted=True)
+
+    def check():
+        ds = list(ic)
+        for q in queries:
+            assert ic.filter(q) == qfilter(ds, q), q
+            assert ic.count(q) == len(qfilter(ds, q)), q
+
+    check()
+    for d in docs[::3]:
+        ic.remove(d)
+    check()
+    ic.extend(docs[::6])
+    ic.append({'a': {'b': 1}, 'c': 15.5})
+    check()
+    try:
+        ic.remove({'not': 'here'})
+        assert False
+    except ValueError:
+        pass
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+"""
+Selectivity-aware ordering of query item tests
+
+A query like {'a': 1, 'b': {'$elemMatch': {...}}} is a logical and of
+item tests. All item tests must pass for a document to match so the
+order the tests are run in doesn't change the result but does change
+how much work is done: cheap tests that reject most documents should
+be run first.
+
+A PlannedQuery estimates the cost of each item test from the query and
+measures the fraction of documents that pass each test by running all
+tests on the first sample documents (and then on every interval'th
+document). Tests are ordered by cost / (1 - pass fraction).
+
+Results match qfilter for queries where no test raises an exception.
+Documents where a (reordered) test raises are re-run in the original
+order.
+
+Example
+------
+
+pq = PlannedQuery({'a.b': 1, 'c': {'$elemMatch': {'$gt': 1}}})
+pq.filter(docs)  # same as qfilter(docs, query)
+qfilter(docs, pq)  # PlannedQuery can be used like a CompiledQuery
+"""
+
+from ..ddict import key_path
+from .query import CompiledQuery, qfilter
+
+
+# relative cost of running each operator
+op_costs = {
+    '$all': lambda v: len(v),
+    '$elemMatch': lambda v: 10. * value_cost(v),
+    '$not': lambda v: value_cost(v),
+    '$and': lambda v: sum([value_cost(i) for i in v]),
+    '$or': lambda v: sum([value_cost(i) for i in v]),
+    '$nor': lambda v: sum([value_cost(i) for i in v]),
+}
+
+
+def value_cost(value):
+    """
+    Estimate the cost of running a query value test
+    """
+    if not isinstance(value, dict):
+        return 1.
+    c = 0.
+    for k, v in value.iteritems():
+        if k in op_costs:
+            c += op_costs[k](v)
+        else:
+            c += 1.
+    return c
+
+
+def item_cost(key, value):
+    """
+    Estimate the cost of running a query item test
+    (getting the value for key and testing it)
+    """
+    return len(key_path(key)) + value_cost(value)
+
+
+class PlannedQuery(CompiledQuery):
+    """
+    A CompiledQuery that reorders item tests by estimated cost and
+    measured selectivity
+
+    sample : int (default 100)
+        run all tests on this many documents before reordering
+
+    interval : int (default 1000)
+        after sampling, run all tests on every interval'th document
+        and reorder (None to stop measuring after sample)
+    """
+    def __init__(self, query, sample=100, interval=1000):
+        CompiledQuery.__init__(self, query)
+        self.sample = sample
+        self.interval = interval
+        self.ordered_match = self.match
+        self.costs = [item_cost(k, v) for (k, v) in self.items]
+        self.evaluated = [0] * len(self.tests)
+        self.passed = [0] * len(self.tests)
+        self.n = 0
+        self.plan()
+        self.match = self.planned_match
+
+    def pass_fraction(self, i):
+        # add one pass and one fail to avoid 0 and 1
+        return (self.passed[i] + 1.) / (self.evaluated[i] + 2.)
+
+    def rank(self, i):
+        return self.costs[i] / (1. - self.pass_fraction(i))
+
+    def plan(self):
+        """
+        Order tests by rank (lowest first)
+        """
+        self.order = sorted(range(len(self.tests)), key=self.rank)
+        self.ordered_tests = [self.tests[i] for i in self.order]
+
+    def sample_match(self, doc):
+        """
+        Run all tests on doc, record results and return if doc matched
+        """
+        r = []
+        for t in self.tests:
+            try:
+                r.append(t(doc))
+            except Exception:
+                # let the original test order decide
+                return self.ordered_match(doc)
+        for (i, p) in enumerate(r):
+            self.evaluated[i] += 1
+            if p:
+                self.passed[i] += 1
+        return all(r)
+
+    def planned_match(self, doc):
+        self.n += 1
+        if self.n <= self.sample:
+            r = self.sample_match(doc)
+            if self.n == self.sample:
+                self.plan()
+            return r
+        if (self.interval is not None) and \
+                ((self.n - self.sample) % self.interval == 0):
+            r = self.sample_match(doc)
+            self.plan()
+            return r
+        try:
+            for t in self.ordered_tests:
+                if not t(doc):
+                    return False
+            return True
+        except Exception:
+            return self.ordered_match(doc)
+
+    def __repr__(self):
+        return "PlannedQuery(%r)" % (self.query, )
+
+
+# ------------------ tests ------------------
+def test_planned_query():
+    docs = [{'a': i % 10, 'b': [i, i + 1, i + 2], 'c': {'d': i}}
+            for i in xrange(1000)]
+    docs.append({'a': 1, 'b': 1})  # $all raises for this doc
+    q = {
+        'b': {'$all': [1, 2, 3], '$elemMatch': {'$gt': 5}},
+        'c.d': {'$gte': 0},
+        'a': 0,
+    }
+    pq = PlannedQuery(q, sample=10, interval=100)
+    assert pq.filter(docs) == qfilter(docs, q)
+    # a is cheap and selective so should be run first
+    assert pq.items[pq.order[0]][0] == 'a'
+    # c.d always passes so should be run last
+    assert pq.items[pq.order[-1]][0] == 'c.d'
+    assert qfilter(docs, PlannedQuery(q)) == qfilter(docs, q)
@@ -5,11 +5,14 @@ Mongo-like queries on a list of dicts
 I have not implemented the full set of mongodb queries [see vtests]
 """
 
-#import collections
+import collections
+import copy
 import itertools
 import math
+import multiprocessing
+import sys
 
-from ..ddict import dget
+from ..ddict import key_path
 from ..listify import listify
 
 
@@ -57,31 +60,32 @@ def combine(q0, q1, *args):
 
 
 # ----------- Query Value parsing -----------
-def elemMatch_vtest(t):
-    test = make_value_test(t)
+# nested tests are built with make_test (default: make_value_test)
+def elemMatch_vtest(t, make_test=None):
+    test = (make_test or make_value_test)(t)
 
     def elem_test(value):
         return any([test(v) for v in itertools.chain.from_iterable(value)])
     return elem_test
 
 
-def not_vtest(t):
-    test = make_value_test(t)
+def not_vtest(t, make_test=None):
+    test = (make_test or make_value_test)(t)
     return lambda v: (not test(v))
 
 
-def nor_vtest(t):
-    tests = [make_value_test(i) for i in t]
+def nor_vtest(t, make_test=None):
+    tests = [(make_test or make_value_test)(i) for i in t]
     return lambda v: not any([t(v) for t in tests])
 
 
-def or_vtest(t):
-    tests = [make_value_test(i) for i in t]
+def or_vtest(t, make_test=None):
+    tests = [(make_test or make_value_test)(i) for i in t]
     return lambda v: any([t(v) for t in tests])
 
 
-def and_vtest(t):
-    tests = [make_value_test(i) for i in t]
+def and_vtest(t, make_test=None):
+    tests = [(make_test or make_value_test)(i) for i in t]
     return lambda v: all([t(v) for t in tests])
 
 
@@ -141,12 +145,13 @@ def make_item_test(key, value):
     """
     # first, check if value has an $exists test
     #test_exists = True
+    get = key_path(key).get
     if isinstance(value, dict) and '$exists' in value:
         value = value.copy()
         if not value['$exists']:  # test for non-existance
             def test_non_existance(i):
                 try:
-                    dget(i, key)
+                    get(i)
                 except:
                     return True
                 return False
@@ -159,7 +164,7 @@ def make_item_test(key, value):
 
     def test_item(i):
         try:
-            tv = dget(i, key)
+            tv = get(i)
         except:
             return False
             #print "Failed to get %s from %s" % (key, i)
@@ -185,11 +190,350 @@ def make_query_test(query):
     return lambda i: all((t(i) for t in tests))
 
 
-def qfilter(data, query):
+# ----------- Compiled queries -----------
+def make_getter(key, delimiter='.'):
+    """
+    Return a function that performs a dotted get (see ddict.dget) of key
+    with the key split once (rather than on every get)
+    """
+    p = key_path(key, delimiter)
+    if len(p) == 1:
+        k = p.last
+        return lambda d: d[k]
+    return p.get
+
+
+def as_set(t):
+    """
+    Convert a $in/$nin value list to a frozenset, returns None if
+    t is not a list (or contains unhashable items)
+    """
+    if not isinstance(t, (tuple, list, set, frozenset)):
+        return None
+    try:
+        return frozenset(t)
+    except TypeError:
+        return None
+
+
+def in_ctest(t):
+    ts = as_set(t)
+    if ts is None:
+        return vtests['$in'](t)
+
+    def contains(v):
+        try:
+            return v in ts
+        except TypeError:  # unhashable value, fall back to a list search
+            return v in t
+
+    def in_test(v):
+        if isinstance(v, (tuple, list)):
+            return any((contains(vi) for vi in v))
+        return contains(v)
+    return in_test
+
+
+def nin_ctest(t):
+    test = in_ctest(t)
+    return lambda v: not test(v)
+
+
+# same as vtests but with compiled $in/$nin and nested tests
+ctests = vtests.copy()
+ctests.update({
+    '$in': in_ctest,
+    '$nin': nin_ctest,
+    '$nor': lambda t: nor_vtest(t, compile_value_test),
+    '$or': lambda t: or_vtest(t, compile_value_test),
+    '$and': lambda t: and_vtest(t, compile_value_test),
+    '$elemMatch': lambda t: elemMatch_vtest(t, compile_value_test),
+    '$not': lambda t: not_vtest(t, compile_value_test),
+})
+
+
+def compile_value_test(value):
+    """
+    Compiled version of make_value_test
+    """
+    if not isinstance(value, dict):
+        return lambda v: value in v if isinstance(v, (tuple, list)) \
+                else eq(v, value)
+    tests = [ctests[k](v) for k, v in value.iteritems()]
+    if len(tests) == 1:
+        return tests[0]
+    return lambda v: all((t(v) for t in tests))
+
+
+def compile_item_test(key, value):
+    """
+    Compiled version of make_item_test
+    """
+    get = make_getter(key)
+    if isinstance(value, dict) and '$exists' in value:
+        value = value.copy()
+        if not value['$exists']:  # test for non-existance
+            def test_non_existance(i):
+                try:
+                    get(i)
+                except:
+                    return True
+                return False
+            return test_non_existance
+        # remove $exists test
+        del value['$exists']
+
+    test_value = compile_value_test(value)
+
+    def test_item(i):
+        try:
+            tv = get(i)
+        except:
+            return False
+        return test_value(tv)
+
+    return test_item
+
+
+class CompiledQuery(object):
+    """
+    A query parsed once and reusable for many documents
+
+    Dotted keys are split and $in/$nin values are converted to sets
+    during compilation. The query is copied so later changes to the
+    query dict do not change the compiled query.
+
+    Example
+    ------
+    cq = CompiledQuery({'a.b': {'$in': [1, 2]}})
+    cq.match({'a': {'b': 1}})  # True
+    cq.filter(docs)  # same as qfilter(docs, query)
+    cq.count(docs)  # same as len(qfilter(docs, query))
+    """
+    def __init__(self, query):
+        self.query = copy.deepcopy(query)
+        self.items = self.query.items()
+        self.tests = [compile_item_test(k, v) for k, v in self.items]
+        tests = self.tests
+        if len(tests) == 1:
+            self.match = tests[0]
+        else:
+            self.match = lambda i: all((t(i) for t in tests))
+
+    def filter(self, docs):
+        m = self.match
+        return [i for i in docs if m(i)]
+
+    def count(self, docs):
+        m = self.match
+        return sum(1 for i in docs if m(i))
+
+    def __call__(self, doc):
+        return self.match(doc)
+
+    def __repr__(self):
+        return "CompiledQuery(%r)" % (self.query, )
+
+
+def query_key(query):
+    """
+    Convert a query to a canonical (hashable) form for use as a cache key
+
+    dicts are sorted by key, lists converted to tuples and all values
+    are tagged with their type (so [1] and (1, ) do not collide).
+    Raises TypeError for queries containing unhashable values.
+    """
+    if isinstance(query, dict):
+        return (dict, tuple(sorted(
+            [(k, query_key(v)) for (k, v) in query.iteritems()])))
+    if isinstance(query, (tuple, list, set, frozenset)):
+        items = [query_key(v) for v in query]
+        if isinstance(query, (set, frozenset)):
+            items = sorted(items)
+        return (type(query), tuple(items))
+    hash(query)
+    return (type(query), query)
+
+
+class QueryCache(object):
+    """
+    Least recently used cache of CompiledQuery objects
+    """
+    def __init__(self, maxsize=128):
+        self.maxsize = maxsize
+        self.queries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, query):
+        try:
+            k = query_key(query)
+        except TypeError:  # unhashable query, don't cache
+            self.misses += 1
+            return CompiledQuery(query)
+        cq = self.queries.pop(k, None)
+        if cq is None:
+            self.misses += 1
+            cq = CompiledQuery(query)
+            if len(self.queries) >= self.maxsize:
+                self.queries.popitem(last=False)
+        else:
+            self.hits += 1
+        self.queries[k] = cq
+        return cq
+
+    def clear(self):
+        self.queries.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.queries)
+
+
+query_cache = QueryCache()
+
+
+def compile_query(query, cache=True):
+    """
+    Return a CompiledQuery for query, reusing a cached one if possible
+    """
+    if isinstance(query, CompiledQuery):
+        return query
+    if not cache:
+        return CompiledQuery(query)
+    return query_cache.get(query)
+
+
+# ----------- Parallel queries -----------
+# smallest default number of documents sent to each worker
+min_chunksize = 5000
+# data shared (by fork) with worker processes started by pqfilter, this
+# is only set in the workers (see set_forked_data)
+forked_data = None
+
+
+def set_forked_data(data):
+    """
+    Pool initializer for pqfilter workers, data is not pickled as the
+    initializer arguments are inherited by the forked workers
+    """
+    global forked_data
+    forked_data = data
+
+
+def match_chunk(args):
+    """
+    Return indices of documents (in chunk) that match query
+
+    This is run in the worker processes for a parallel qfilter
+    """
+    query, chunk = args
+    m = compile_query(query).match
+    return [i for (i, d) in enumerate(chunk) if m(d)]
+
+
+def match_range(args):
+    """
+    Like match_chunk but for a range (start, end) of forked_data
+    """
+    query, s, e = args
+    return match_chunk((query, forked_data[s:e]))
+
+
+def pqfilter(data, query, workers, chunksize=None):
+    """
+    Filter data (a list of dicts) with a query using a pool of processes
+
+    workers : int or multiprocessing.Pool
+        number of processes (or an existing pool)
+
+    chunksize : int or None (default)
+        number of documents sent to each worker at a time, if None
+        uses enough chunks for 4 per worker (at least min_chunksize)
+
+    Data is split into chunks and each worker returns the indices of
+    matching documents in a chunk. Matches are returned in their
+    original order. If workers is an int (and processes are forked) the
+    workers get a copy of data when the pool is created, otherwise each
+    chunk (and the query dict) is pickled and sent to a worker.
+    """
+    if isinstance(query, CompiledQuery):
+        query = query.query
+    if isinstance(workers, (int, long)):
+        nworkers = workers
+    else:
+        nworkers = getattr(
+            workers, '_processes', None) or multiprocessing.cpu_count()
+    n = len(data)
+    if chunksize is None:
+        chunksize = max(min_chunksize, -(-n // (nworkers * 4)))
+    if (nworkers < 2) or (n <= chunksize):  # don't bother with a pool
+        return qfilter(data, query)
+    starts = range(0, n, chunksize)
+    fork = isinstance(workers, (int, long)) and (sys.platform != 'win32')
+    if fork:
+        pool = multiprocessing.Pool(
+            workers, initializer=set_forked_data, initargs=(data, ))
+    elif isinstance(workers, (int, long)):
+        pool = multiprocessing.Pool(workers)
+    else:
+        pool = workers
+    try:
+        if fork:
+            results = pool.imap(
+                match_range, ((query, s, s + chunksize) for s in starts))
+        else:
+            results = pool.imap(
+                match_chunk, ((query, data[s:s + chunksize]) for s in starts))
+        r = []
+        for (s, inds) in itertools.izip(starts, results):
+            r.extend([data[s + i] for i in inds])
+    finally:
+        if pool is not workers:
+            pool.close()
+            pool.join()
+    return r
+
+
+def qfilter(data, query, workers=None, chunksize=None):
+    """
+    Filter data (list of dicts) with a mongo-like query
+
+    query can be a dict or a CompiledQuery (see compile_query)
+
+    workers : int, multiprocessing.Pool or None (default)
+        if not None, filter using a pool of processes (see pqfilter)
+
+    chunksize : int or None (default)
+        see pqfilter
+    """
     if query == {}:  # short-circuit
         return data
-    t = make_query_test(query)
-    return [i for i in data if t(i)]
+    if workers is not None:
+        return pqfilter(data, query, workers, chunksize)
+    return compile_query(query).filter(data)
+
+
+def iqfilter(data, query, limit=None, skip=0):
+    """
+    Lazily filter an iterable (list, cursor, generator...) of dicts
+    with a mongo-like query
+
+    Returns an iterator that yields matching items without storing them.
+
+    limit : int or None (default)
+        stop after yielding this many matches (None for no limit)
+
+    skip : int (default 0)
+        number of matches to skip before yielding
+    """
+    if query == {}:
+        matches = iter(data)
+    else:
+        matches = itertools.ifilter(compile_query(query).match, data)
+    stop = None if limit is None else skip + limit
+    return itertools.islice(matches, skip, stop)
 
 
 # ------------------ tests ------------------
@@ -243,5 +587,104 @@ def test_qfilter():
     assert len(qfilter(nani, {'a': {'$ne': float('nan')}})) == 1
 
 
+def test_compiled_query():
+    items = [
+        {'a': {'b': {'c': 1}}, 'l': [1, 2]},
+        {'a': {'b': {'c': 2}}, 'l': [{'x': 1}]},
+        {'a': {'b': {'c': float('nan')}}},
+        {'all': [1, 2, 3]},
+        ]
+    queries = [
+        {'a.b.c': 1},
+        {'a.b.c': {'$exists': False}},
+        {'a.b.c': {'$exists': True, '$in': [1, 3]}},
+        {'a.b.c': {'$nin': [2, 3]}},
+        {'a.b.c': float('nan')},
+        {'a.b.c': {'$not': {'$in': [1]}}},
+        {'a.b.c': {'$or': [{'$in': [1]}, {'$gte': 2}]}},
+        {'l': {'$in': [2, {'x': 1}]}},
+        {'all': {'$all': [1, 3]}, 'a.b': {'$exists': False}},
+        ]
+    for q in queries:
+        cq = compile_query(q)
+        t = make_query_test(q)
+        r = [i for i in items if t(i)]
+        assert cq.filter(items) == r
+        assert cq.count(items) == len(r)
+        assert [cq.match(i) for i in items] == [t(i) for i in items]
+        assert qfilter(items, q) == r
+
+    # cache
+    cache = QueryCache(maxsize=2)
+    cq = cache.get({'a': 1, 'b': [1, 2]})
+    assert cache.get({'b': [1, 2], 'a': 1}) is cq
+    assert cache.get({'b': (1, 2), 'a': 1}) is not cq
+    cache.get({'c': 1})
+    assert len(cache) == 2
+    assert cache.get({'a': 1, 'b': [1, 2]}) is not cq
+
+    # compiled queries are not changed by changing the query
+    q = {'a.b.c': {'$in': [1]}}
+    cq = CompiledQuery(q)
+    q['a.b.c']['$in'].append(2)
+    assert cq.count(items) == 1
+
+
+def test_pqfilter():
+    items = [{'a': {'b': i % 7}, 'c': [i, i % 3]} for i in xrange(100)]
+    for q in ({'a.b': 3}, {'c': 1, 'a.b': {'$lt': 4}}, {'d': 1}):
+        r = qfilter(items, q)
+        pr = qfilter(items, q, workers=2, chunksize=9)
+        assert pr == r
+        assert all([i is j for (i, j) in zip(pr, r)])
+    # existing pool
+    pool = multiprocessing.Pool(2)
+    try:
+        q = {'a.b': {'$in': [1, 2]}}
+        assert qfilter(items, q, workers=pool, chunksize=9) == \
+            qfilter(items, q)
+    finally:
+        pool.close()
+        pool.join()
+    # small inputs don't use a pool
+    assert qfilter(items, {'a.b': 3}, workers=2) == qfilter(items, {'a.b': 3})
+    # concurrent calls (from threads) don't share data
+    import threading
+    other = [{'a': {'b': 3}, 'c': [-i]} for i in xrange(100)]
+    results = {}
+
+    def run(name, docs):
+        results[name] = qfilter(docs, {'a.b': 3}, workers=2, chunksize=9)
+    threads = [threading.Thread(target=run, args=(n, docs)) for (n, docs)
+               in (('items', items), ('other', other))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert results['items'] == qfilter(items, {'a.b': 3})
+    assert results['other'] == other
+
+
+def test_iqfilter():
+    def docs():
+        for i in itertools.count():
+            yield {'a': {'b': i}}
+
+    r = iqfilter(docs(), {'a.b': {'$gte': 10}}, limit=3)
+    assert [i['a']['b'] for i in r] == [10, 11, 12]
+    r = iqfilter(docs(), {'a.b': {'$gte': 10}}, limit=2, skip=5)
+    assert [i['a']['b'] for i in r] == [15, 16]
+    r = iqfilter(docs(), {}, limit=2)
+    assert [i['a']['b'] for i in r] == [0, 1]
+    items = [{'a': 1}, {'a': 2}, {'a': 1}]
+    assert list(iqfilter(items, {'a': 1})) == qfilter(items, {'a': 1})
+    assert list(iqfilter(items, {'a': 1}, limit=0)) == []
+
+
 def test():
+    from . import planner
     test_qfilter()
+    test_compiled_query()
+    test_iqfilter()
+    test_pqfilter()
+    planner.test_planned_query()
@@ -101,40 +101,56 @@ def parse_mapping(mapping):
 
 
 def apply_functions(docs, fs):
-    rs = {}
-    for (rk, v) in fs.iteritems():
-        rs[rk] = v['f']([d[v['k']] for d in docs])
-    return rs
+    if not len(fs):
+        return {}
+    cols = ddict.itemgetter(*[v['k'] for v in fs.itervalues()]).columns(docs)
+    return dict([(rk, v['f'](cols[v['k']])) for (rk, v) in fs.iteritems()])
+
+
+def simple_map(doc, ss):
+    r = {}
+    for rk, mk in ss.iteritems():
+        ms = re.findall('{.*?}', mk)
+        if len(ms):
+            cmk = re.sub('{.*?}', '{}', mk)
+            items = []
+            for m in ms:
+                k = m[1:-1]
+                items.append(doc[k])
+            r[rk] = doc[cmk.format(*items)]
+        else:
+            r[rk] = doc[mk]
+    return r
 
 
 def remap(cursor, mapping, asdocs=False):
-    docs = [ddict.DDict(d) for d in cursor]
+    """
+    cursor can be any iterable of dicts (list, pymongo cursor, the
+    result of qfilter.iqfilter...). Documents are consumed one at a time
+    and only the mapped values are stored.
+    """
     ss, qs, fs, fqs = parse_mapping(mapping)
-    # first queries
-    docs = qfilter.qfilter(docs, qs)
 
     # then function, queries
     if len(fqs.keys()):
         raise NotImplementedError("function queries are not supported [%s]"
                                   % (fqs.keys(), ))
 
-    # then simple mapping
-    rs = [{} for _ in xrange(len(docs))]
-    for i in xrange(len(docs)):
-        for rk, mk in ss.iteritems():
-            ms = re.findall('{.*?}', mk)
-            if len(ms):
-                cmk = re.sub('{.*?}', '{}', mk)
-                items = []
-                for m in ms:
-                    k = m[1:-1]
-                    items.append(docs[i][k])
-                rs[i][rk] = docs[i][cmk.format(*items)]
-            else:
-                rs[i][rk] = docs[i][mk]
+    # first queries
+    docs = qfilter.iqfilter((ddict.DDict(d) for d in cursor), qs)
+
+    # then simple mapping, collecting function values
+    rs = []
+    fks = fs.keys()
+    fvs = [[] for _ in fks]
+    fget = ddict.itemgetter(*[fs[rk]['k'] for rk in fks])
+    for doc in docs:
+        rs.append(simple_map(doc, ss))
+        for (l, v) in zip(fvs, fget(doc)):
+            l.append(v)
 
     # then functions
-    frs = apply_functions(docs, fs)  # returns dict
+    frs = dict([(rk, fs[rk]['f'](l)) for (rk, l) in zip(fks, fvs)])
     if asdocs:
         for fk, fv in frs.iteritems():
             if hasattr(fv, '__len__') and (not isinstance(fv, (str, unicode))):
@@ -182,3 +198,7 @@ def test_remap():
     m = {'a': {'k': 'a', 'f': lambda x: sum(x) / float(len(x))}}
     rs = remap(l, m, asdocs=False)
     assert rs['a'] == 1.5
+
+    # test remapping from an iterator
+    rs = remap(qfilter.iqfilter(iter(l), {'a': {'$gt': 1}}), {'b': 'b'})
+    assert rs == {'b': [2]}
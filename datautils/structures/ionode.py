@@ -11,6 +11,7 @@ import pizco
 import zmq
 
 from .. import config
+from .. import ddict
 from .. import log
 
 logger = log.get_logger(__name__)
@@ -32,15 +33,21 @@ class PizcoNodeServer(pizco.Server):
 
 
 class IONode(object):
+    """
+    Configs are (immutable) ddict.PDicts so changing a config (see
+    config) only copies the changed sub-dicts. Use node.config(value)
+    to change the config, ddict.persistent.thaw(node.config()) returns
+    a mutable copy.
+    """
     def __init__(self, cfg=None):
         cfg = config.parse(cfg)
         if cfg is not None:
             if not isinstance(cfg, dict):
                 raise TypeError(
                     "Config must be a dict not {}".format(type(cfg)))
-            self._config = cfg
+            self._config = ddict.persistent.freeze(cfg)
         else:
-            self._config = {}
+            self._config = ddict.PDict()
         self.loop = None  # will be replaced with server ioloop
         self._server = None
         self._log_handler = None
@@ -105,9 +112,10 @@ class IONode(object):
         if value == self._config:
             return self._config
         if replace:
-            new_config = copy.deepcopy(value)
+            new_config = ddict.persistent.freeze(value)
         else:
-            new_config = config.cascade(self._config, value)
+            new_config = config.cascade(
+                self._config, value, persistent=True)
         # make sure new_config is valid
         delta = config.delta(self._config, new_config)
         try:
@@ -190,7 +198,8 @@ def resolve_config(node_type, module=None, cfg=None):
     if module is None:
         module = resolve_module(node_type)
     if hasattr(module, 'default_config'):
-        node_cfg = copy.deepcopy(getattr(module, 'default_config'))
+        node_cfg = ddict.persistent.freeze(
+            getattr(module, 'default_config'))
     else:
         logger.warning("{} missing default config".format(module.__name__))
         node_cfg = {}
@@ -199,14 +208,14 @@ def resolve_config(node_type, module=None, cfg=None):
         '~/.temcagt/config/{}.json'.format(node_type))
     if os.path.exists(user_config_filename):
         node_cfg = config.cascade(
-            node_cfg, config.parse(user_config_filename))
+            node_cfg, config.parse(user_config_filename), persistent=True)
     else:
         logger.warning("{} user configuration ({}) missing".format(
             node_type, user_config_filename))
         pass
     # cascade local config (cfg) [this could be pre-parsed command line args]
     if cfg is not None:
-        node_cfg = config.cascade(node_cfg, cfg)
+        node_cfg = config.cascade(node_cfg, cfg, persistent=True)
     return node_cfg
 
 
@@ -240,3 +249,24 @@ def command_line_launch(args=None):
     else:
         cfg = None
     launch(node_type, cfg)
+
+
+# ------------------ tests ------------------
+def test_ionode_config():
+    n = IONode({'a': {'b': 1}, 'c': {'d': 2}})
+    cfg = n.config()
+    assert isinstance(cfg, ddict.PDict)
+    # configs are immutable, changes go through config
+    try:
+        cfg['a'] = 2
+        assert False
+    except TypeError:
+        pass
+    n.config({'a': {'b': 3}})
+    assert n.config() == {'a': {'b': 3}, 'c': {'d': 2}}
+    assert n.config()['c'] is cfg['c'] and cfg['a']['b'] == 1
+    m = ddict.persistent.thaw(n.config())
+    m['a']['b'] = 4
+    assert n.config()['a']['b'] == 3
+    n.config({'e': 5}, replace=True)
+    assert n.config() == {'e': 5} and isinstance(n.config(), ddict.PDict)